@@ -0,0 +1,113 @@
+import copy
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.db import close_old_connections
+from django.http import QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework import serializers, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from moviehouse.settings import API_BATCH_MAX_REQUESTS, API_BATCH_WORKERS
+
+API_PREFIX = '/api/'
+
+# shared by all batches, so no more than API_BATCH_WORKERS sub-requests of the process hit the database at once
+_pool = ThreadPoolExecutor(max_workers=API_BATCH_WORKERS, thread_name_prefix='batch')
+
+
+class BatchMemo:
+    """Values computed once per batch and shared by its sub-requests, which may run at the same time"""
+
+    def __init__(self):
+        self.values = {}
+        self.locks = defaultdict(threading.Lock)
+        self.lock = threading.Lock()
+
+    def get(self, key, compute):
+        with self.lock:
+            key_lock = self.locks[key]
+        # a sub-request asking for a value being computed waits for it instead of running the queries again
+        with key_lock:
+            if key not in self.values:
+                self.values[key] = compute()
+            return self.values[key]
+
+
+def batch_memoized(request, key, compute):
+    """compute() shared by the sub-requests of a batch under `key`, run as is outside of batches"""
+    memo = getattr(getattr(request, '_request', request), 'batch_memo', None)
+    return compute() if memo is None else memo.get(key, compute)
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = serializers.ListField(child=serializers.CharField(), min_length=1, max_length=API_BATCH_MAX_REQUESTS)
+
+    def validate_requests(self, paths):
+        for path in paths:
+            url = urlsplit(path)
+            if url.scheme or url.netloc or not url.path.startswith(API_PREFIX):
+                raise serializers.ValidationError(f'{path} is not a relative {API_PREFIX} url.')
+            if url.path.startswith(f'{API_PREFIX}batch/'):
+                raise serializers.ValidationError('Batches can not be nested.')
+        return paths
+
+
+class BatchView(APIView):
+    """
+    POST {"requests": ["/api/sessions/todays/", "/api/halls/"]} runs the GET requests and answers
+    [{"path": ..., "status": ..., "body": ...}] in the same order. The client is authenticated once
+    for all of them, repeated urls are answered once, up to API_BATCH_WORKERS run at the same time.
+    Sub-requests share values of batch_memoized(), like session lists prepared for the same filters.
+    """
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        paths = serializer.validated_data['requests']
+
+        # sub-requests reuse the user and token found for the batch instead of authenticating again
+        user, auth = request.user, request.auth
+        # and values of batch_memoized(), sub-requests are shallow copies sharing the memo
+        request._request.batch_memo = BatchMemo()
+        unique = list(dict.fromkeys(paths))
+        if API_BATCH_WORKERS > 1 and len(unique) > 1:
+            results = list(_pool.map(lambda path: self.run_in_thread(request, path, user, auth), unique))
+        else:
+            results = [self.run(request, path, user, auth) for path in unique]
+        results = dict(zip(unique, results))
+
+        return Response([{'path': path, 'status': results[path][0], 'body': results[path][1]} for path in paths],
+                        status=status.HTTP_200_OK)
+
+    def run_in_thread(self, request, path, user, auth):
+        # workers outlive requests: connections are kept or dropped by CONN_MAX_AGE as in Django request handling
+        close_old_connections()
+        try:
+            return self.run(request, path, user, auth)
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def run(request, path, user, auth):
+        """(status code, data) of GET `path` handled by its api view"""
+        url = urlsplit(path)
+        try:
+            match = resolve(url.path)
+        except Resolver404:
+            return status.HTTP_404_NOT_FOUND, {'detail': 'Not found.'}
+
+        sub_request = copy.copy(request._request)
+        sub_request.method = 'GET'
+        sub_request.path = sub_request.path_info = url.path
+        sub_request.GET = QueryDict(url.query)
+        sub_request.META = {**request._request.META, 'REQUEST_METHOD': 'GET',
+                            'PATH_INFO': url.path, 'QUERY_STRING': url.query}
+        sub_request._force_auth_user = user
+        sub_request._force_auth_token = auth
+
+        response = match.func(sub_request, *match.args, **match.kwargs)
+        return response.status_code, getattr(response, 'data', None)
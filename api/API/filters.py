@@ -1,14 +1,17 @@
 from rest_framework import filters
 
+from cinema.facets import filter_sessions, normalize
+
+
+def session_filters(params):
+    """Schedule filters (see cinema.facets) given by query parameters of session lists"""
+    requested = {'hall': params.get('hall')}
+    for name, param in (('time', 'time_start_range'), ('date', 'date_range')):
+        if params.get(param):
+            requested[f'{name}_start'], _, requested[f'{name}_end'] = params[param].partition(',')
+    return normalize(requested)
+
 
 class SessionsFilter(filters.BaseFilterBackend):
     def filter_queryset(self, request, queryset, view):
-        hall = request.query_params.get('hall')
-        start_between = request.query_params.get('time_start_range')
-        if hall:
-            queryset = queryset.filter(settings__hall__name=hall)
-        if start_between:
-            start_between = start_between.split(",")
-            queryset = queryset.filter(settings__time_start__gte=start_between[0],
-                                       settings__time_start__lte=start_between[1])
-        return queryset
+        return filter_sessions(queryset, session_filters(request.query_params))
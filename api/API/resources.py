@@ -1,48 +1,191 @@
-from django.db import transaction
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from rest_framework import mixins, serializers
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import mixins, serializers, status
 from rest_framework.decorators import action
-from rest_framework.permissions import IsAdminUser
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet, GenericViewSet
 
-from api.API.filters import SessionsFilter
+from api.API.batch import batch_memoized
+from api.API.filters import SessionsFilter, session_filters
 from api.API.permissions import IsAdminOrReadOnly, IsAdminOrCreateOnlyOrReadOwnForOrder, \
     IsAdminOrCreateOnlyForUsers
 from api.API.serializers import GenreSerializer, MovieSerializer, HallSerializer, MovieSessionSerializer
 from api.API.serializers import MovieSessionSettingsSerializer, OrderSerializer, CinemaUserSerializer
-from cinema.models import Genre, Movie, Hall, Order, CinemaUser, Sit
+from api.API.serializers import DailySalesSerializer, TimelineSessionSerializer, requested
+from api.API.serializers import MovieValuesSerializer, MovieSessionValuesSerializer, OrderValuesSerializer
+from api.API.throttles import OrderThrottle
+from cinema import idempotency, versions, waiting_room
+from cinema.booking import book_best_seats
+from cinema.facets import prepare_sessions, schedule_facets
+from cinema.models import Genre, Movie, Hall, Order, CinemaUser, Sit, DailySales, occupancy
 from cinema.models import MovieSession, MovieSessionSettings
+from cinema.timeline import movie_timeline
+from moviehouse.settings import API_AVAILABILITY_MAX_SESSIONS
 
 
-class GenreViewSet(ModelViewSet):
+class ExpandableViewSetMixin:
+    """Joins and prefetches what the serializer reads for the fields expanded by ?expand="""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        select, prefetch = self.get_serializer_class().related_lookups(requested(self.request, 'expand'))
+        return queryset.select_related(*select).prefetch_related(*prefetch)
+
+
+class ValuesListMixin:
+    """Lists without ?expand= are built by values_serializer_class from values() rows, the JSON stays the same"""
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.values_serializer_class is None or requested(request, 'expand'):
+            return super().list(request, *args, **kwargs)
+
+        values_serializer = self.values_serializer_class(fields=requested(request, 'fields'),
+                                                         context=self.get_serializer_context())
+        queryset = values_serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(values_serializer.to_representation(page))
+        return Response(values_serializer.to_representation(queryset))
+
+
+class ConditionalGetMixin:
+    """
+    ETag and Last-Modified on list and retrieve from the versions of versioned_models.
+    Matching If-None-Match / If-Modified-Since get 304 and other requests get the payload cached
+    under the same ETag, both without touching the database.
+    """
+    versioned_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        state = batch_memoized(request, ('versions', self.versioned_models),
+                               lambda: versions.state(*self.versioned_models))
+        if state is None:
+            return handler(request, *args, **kwargs)
+
+        tag, last_modified = state
+        # image urls are absolute, so the host is a part of the variant too
+        etag = versions.etag(tag, request.build_absolute_uri(), request.headers.get('Accept', ''))
+        response = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if response is None:
+            payload = versions.cached_payload(etag)
+            if payload is not None:
+                response = Response(payload)
+            else:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                versions.cache_payload(etag, response.data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class SoftDeleteViewSetMixin:
+    """Destroy hides the object at once, the purge_deleted task deletes it with everything depending on it"""
+
+    def perform_destroy(self, instance):
+        instance.soft_delete()
+
+
+class GenreViewSet(ConditionalGetMixin, ExpandableViewSetMixin, ModelViewSet):
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
+    versioned_models = (Genre, )
     pagination_class = None
     permission_classes = (IsAdminOrReadOnly, )
 
 
-class HallViewSet(ModelViewSet):
+class HallViewSet(ConditionalGetMixin, SoftDeleteViewSetMixin, ExpandableViewSetMixin, ModelViewSet):
     queryset = Hall.objects.all()
     serializer_class = HallSerializer
+    versioned_models = (Hall, )
     pagination_class = None
     permission_classes = (IsAdminOrReadOnly, )
 
 
-class MovieViewSet(ModelViewSet):
+class MovieViewSet(ConditionalGetMixin, SoftDeleteViewSetMixin, ValuesListMixin, ExpandableViewSetMixin,
+                   ModelViewSet):
     queryset = Movie.objects.all()
     serializer_class = MovieSerializer
+    values_serializer_class = MovieValuesSerializer
+    versioned_models = (Movie, Genre)
     permission_classes = (IsAdminOrReadOnly, )
 
+    @action(detail=True, methods=['get', 'post'], permission_classes=[IsAuthenticated])
+    def queue(self, request, pk=None):
+        """Waiting room: POST joins the queue, GET shows the position and the admission token once admitted"""
+        movie = self.get_object()
+        if request.method == 'POST':
+            position, token = waiting_room.join(movie.pk, request.user.pk)
+        else:
+            position, token = waiting_room.status(movie.pk, request.user.pk)
+        return Response({'position': position, 'admission_token': token})
+
+    @action(detail=True)
+    def sessions(self, request, pk=None):
+        """Sessions of the movie which have not started yet, split into today, tomorrow and later"""
+        movie = self.get_object()
+        return Response({part: TimelineSessionSerializer(sessions, many=True).data
+                         for part, sessions in movie_timeline(movie.pk).items()})
 
-class MovieSessionViewSet(ReadOnlyModelViewSet):
+
+class MovieSessionViewSet(ValuesListMixin, ExpandableViewSetMixin, ReadOnlyModelViewSet):
     queryset = MovieSession.objects.all()
     serializer_class = MovieSessionSerializer
+    values_serializer_class = MovieSessionValuesSerializer
     filter_backends = [SessionsFilter, ]
 
     def get_queryset(self):
         return MovieSession.objects.filter(date__gte=timezone.now())\
-            .exclude(date=timezone.now(), settings__time_start__lte=timezone.now())
+            .exclude(date=timezone.now(), settings__time_start__lte=timezone.now()).with_seat_counts()
+
+    def list(self, request, *args, **kwargs):
+        return self.sessions_response(request, super().list, *args, **kwargs)
+
+    @staticmethod
+    def sessions_response(request, view, *args, **kwargs):
+        """
+        Days asked for beyond the horizon are created first. Sessions-Until tells the last day the response
+        has all sessions for, Sessions-Partial marks responses asking for later days than that.
+        """
+        filters = session_filters(request.query_params)
+        until, partial = batch_memoized(request, ('sessions', tuple(sorted(filters.items()))),
+                                        lambda: prepare_sessions(filters))
+        response = view(request, *args, **kwargs)
+        response['Sessions-Until'] = until.isoformat()
+        if partial:
+            response['Sessions-Partial'] = 'true'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        """Sold and free seats of ?ids=1,2,3 sessions in one query, past ones included"""
+        ids = requested(request, 'ids')
+        if not ids or not all(pk.isdigit() for pk in ids):
+            raise serializers.ValidationError({'ids': 'Give comma separated session ids.'})
+        if len(ids) > API_AVAILABILITY_MAX_SESSIONS:
+            raise serializers.ValidationError({'ids': f'Not more than {API_AVAILABILITY_MAX_SESSIONS} sessions at once.'})
+        sessions = MovieSession.objects.filter(pk__in=ids).with_seat_counts()\
+            .values('id', 'sold_seats', 'free_seats').order_by('id')
+        return Response(list(sessions))
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Movies, halls and dates of upcoming sessions with session counts, for the filters of the list"""
+        return self.sessions_response(request, lambda request: Response(schedule_facets(
+            session_filters(request.query_params))))
 
     @action(detail=False, methods=['get'])
     def todays(self, request):
@@ -52,7 +195,7 @@ class MovieSessionViewSet(ReadOnlyModelViewSet):
         return Response(serializer.data)
 
 
-class MovieSessionSettingsViewSet(ModelViewSet):
+class MovieSessionSettingsViewSet(ExpandableViewSetMixin, ModelViewSet):
     queryset = MovieSessionSettings.objects.all()
     serializer_class = MovieSessionSettingsSerializer
     permission_classes = (IsAdminUser, )
@@ -62,35 +205,89 @@ class MovieSessionSettingsViewSet(ModelViewSet):
         serializer.save(date_start=start)
 
     def perform_destroy(self, instance):
-        if Order.objects.filter(sits__session__settings=instance):
+        if Order.objects.filter(session__settings=instance):
             raise serializers.ValidationError("Can't delete: sessions already in orders")
-        instance.delete()
+        instance.soft_delete()
 
     def perform_update(self, serializer):
         obj = self.get_object()
-        if Order.objects.filter(sits__session__settings=obj):
+        if Order.objects.filter(session__settings=obj):
             raise serializers.ValidationError("Can't update: sessions already in orders")
-        MovieSession.objects.filter(settings=obj).delete()
+        # sessions follow the new settings in MovieSessionSettings.save()
         self.perform_create(serializer)
 
+    @action(detail=True)
+    def generation(self, request, pk=None):
+        """Progress of sessions generation, large schedules are generated in the background"""
+        setting = self.get_object()
+        return Response({'generating': setting.generating,
+                         'generated_until': setting.generated_until,
+                         'progress': setting.generation_progress})
 
-class OrderViewSet(mixins.CreateModelMixin,
+
+class OrderViewSet(ValuesListMixin,
+                   ExpandableViewSetMixin,
+                   mixins.CreateModelMixin,
                    mixins.RetrieveModelMixin,
                    mixins.ListModelMixin,
                    GenericViewSet):
 
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    values_serializer_class = OrderValuesSerializer
     permission_classes = (IsAdminOrCreateOnlyOrReadOwnForOrder, )
+    throttle_classes = (OrderThrottle, )
 
     def get_queryset(self):
         return self.queryset if self.request.user.is_superuser else self.queryset.filter(customer=self.request.user)
 
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return super().create(request, *args, **kwargs)
+        if not idempotency.valid_key(key):
+            return Response({'detail': f'Idempotency-Key must be 1 to {idempotency.KEY_MAX_LENGTH} characters long.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        request_fingerprint = idempotency.fingerprint(request.data)
+        stored = idempotency.claim(request.user, key, request_fingerprint)
+        if stored is not None:
+            if stored.fingerprint != request_fingerprint:
+                return Response({'detail': 'Idempotency-Key is already used for another request.'},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if stored.status_code is None:
+                return Response({'detail': 'Request with this Idempotency-Key is still in progress.'},
+                                status=status.HTTP_409_CONFLICT)
+            return Response(stored.response, status=stored.status_code, headers={'Idempotent-Replayed': 'true'})
+
+        try:
+            response = super().create(request, *args, **kwargs)
+        except Exception:
+            idempotency.release(request.user, key)
+            raise
+        idempotency.complete(request.user, key, response.status_code, response.data)
+        return response
+
     def perform_create(self, serializer):
         sits = serializer.validated_data.get('sits')
         session = serializer.validated_data.get('session')
-        for sit in sits:
-            Order.objects.create(customer=self.request.user, sits=Sit.objects.get(session=session, number=int(sit)))
+        count = serializer.validated_data.get('count')
+        if session.waiting_room and not waiting_room.is_admitted(session.settings.movie_id, self.request.user.pk,
+                                                                 self.request.headers.get('Admission-Token')):
+            raise PermissionDenied('Admission-Token of the movie waiting room is missing or expired.')
+        if count and not sits:
+            try:
+                serializer.instance = book_best_seats(self.request.user, session, count)
+            except ValidationError as error:
+                raise serializers.ValidationError({'count': error.messages})
+            return
+        try:
+            serializer.instance = Order.objects.place(self.request.user, session,
+                                                      Sit.objects.filter(session=session, number__in=sits))
+        except IntegrityError:
+            # the sits were free when validated, a concurrent order took them since: checked again for the conflicts
+            serializer.validate(serializer.validated_data)
+            raise serializers.ValidationError({'sits': 'Sits from your order are not free already. Please choose new.'})
 
 
 class UserViewSet(ModelViewSet):
@@ -100,3 +297,37 @@ class UserViewSet(ModelViewSet):
 
     def get_queryset(self):
         return self.queryset if self.request.user.is_superuser else self.queryset.filter(pk=self.request.user.pk)
+
+
+class DailySalesViewSet(ReadOnlyModelViewSet):
+    """Sales rollup, filtered by ?date_start=, ?date_end=, ?movie=, ?hall="""
+    queryset = DailySales.objects.all()
+    serializer_class = DailySalesSerializer
+    permission_classes = (IsAdminUser, )
+
+    def get_queryset(self):
+        queryset = self.queryset.select_related('hall', 'movie')
+        params = self.request.query_params
+        if params.get('date_start'):
+            queryset = queryset.filter(date__gte=params['date_start'])
+        if params.get('date_end'):
+            queryset = queryset.filter(date__lte=params['date_end'])
+        if params.get('movie'):
+            queryset = queryset.filter(movie=params['movie'])
+        if params.get('hall'):
+            queryset = queryset.filter(hall=params['hall'])
+        return queryset
+
+    @action(detail=False, methods=['get'])
+    def totals(self, request):
+        """Sums per ?by=date (default), hall or movie"""
+        by = request.query_params.get('by', 'date')
+        if by not in ('date', 'hall', 'movie'):
+            raise serializers.ValidationError({'by': 'Choose date, hall or movie.'})
+        totals = [{by: row[by],
+                   'tickets': row['total_tickets'],
+                   'revenue': row['total_revenue'],
+                   'capacity': row['total_capacity'],
+                   'occupancy': occupancy(row['total_tickets'], row['total_capacity'])}
+                  for row in self.get_queryset().totals(by)]
+        return Response(totals)
@@ -1,46 +1,135 @@
-import datetime
-
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models
+from django.db.models import Sum
 from django.utils import timezone
-from rest_framework import serializers
+from rest_framework import permissions, serializers
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.validators import UniqueValidator
 
-from cinema.models import Genre, Movie, Hall, Order, CinemaUser
+from cinema.booking import check_seats
+from cinema.models import Genre, Movie, Hall, Order, CinemaUser, DailySales, Ticket
 from cinema.models import MovieSession, MovieSessionSettings
 
 
-class GenreSerializer(serializers.ModelSerializer):
+def requested(request, param):
+    """Names from a comma separated query parameter"""
+    value = request.query_params.get(param) if request is not None else None
+    return {name.strip() for name in value.split(',') if name.strip()} if value else set()
+
+
+class ExpandableFieldsMixin:
+    """
+    GET ?fields=id,date keeps only the listed fields of the top level objects,
+    ?expand=movie,hall,genres nests related objects in place of their ids or names at any level.
+    expandable_fields maps a field name to {'serializer': ..., 'source': ..., 'many': ...},
+    select_related_fields and prefetch_related_fields are what the plain fields read.
+    """
+    expandable_fields = {}
+    select_related_fields = ()
+    prefetch_related_fields = ()
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return fields
+
+        expand = requested(request, 'expand')
+        for name, options in self.expandable_fields.items():
+            if name in expand:
+                kwargs = {'many': options.get('many', False), 'read_only': True}
+                if options.get('source', name) != name:
+                    kwargs['source'] = options['source']
+                fields[name] = options['serializer'](**kwargs)
+
+        selected = requested(request, 'fields')
+        # the root serializer or the child of the root list
+        if selected and self.root in (self, self.parent):
+            for name in set(fields) - selected:
+                fields.pop(name)
+        return fields
+
+    @classmethod
+    def related_lookups(cls, expand, prefix=''):
+        """(select_related, prefetch_related) lookups for the fields and expansions read from a queryset"""
+        select = [prefix + lookup for lookup in cls.select_related_fields]
+        prefetch = [prefix + lookup for lookup in cls.prefetch_related_fields]
+        for name, options in cls.expandable_fields.items():
+            if name not in expand:
+                continue
+            lookup = prefix + options.get('source', name).replace('.', '__')
+            nested_select, nested_prefetch = options['serializer'].related_lookups(expand, f'{lookup}__')
+            if options.get('many'):
+                # relations under a prefetched one are prefetched with it
+                prefetch += [lookup] + nested_select + nested_prefetch
+            else:
+                select += [lookup] + nested_select
+                prefetch += nested_prefetch
+        return select, prefetch
+
+
+class GenreSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Genre
         fields = '__all__'
 
 
-class HallSerializer(serializers.ModelSerializer):
+class HallSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Hall
-        fields = '__all__'
+        exclude = ['deleted']
+        # names are unique among halls which are not deleted, the model constraint is not validated by DRF
+        extra_kwargs = {'name': {'validators': [UniqueValidator(queryset=Hall.objects.all())]}}
+
 
+class MovieSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {
+        'genres': {'serializer': GenreSerializer, 'many': True},
+    }
+    prefetch_related_fields = ('genres', )
 
-class MovieSerializer(serializers.ModelSerializer):
     class Meta:
         model = Movie
-        fields = '__all__'
+        exclude = ['deleted']
+        extra_kwargs = {'title': {'validators': [UniqueValidator(queryset=Movie.objects.all())]}}
 
 
-class MovieSessionSerializer(serializers.ModelSerializer):
+class MovieSessionSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     movie = serializers.CharField(source='settings.movie.title', read_only=True)
     hall = serializers.CharField(source='settings.hall.name', read_only=True)
     time_start = serializers.TimeField(source='settings.time_start', read_only=True)
     time_end = serializers.TimeField(source='settings.time_end', read_only=True)
     price = serializers.IntegerField(source='settings.price', read_only=True)
+    free_seats = serializers.SerializerMethodField()
+
+    expandable_fields = {
+        'movie': {'serializer': MovieSerializer, 'source': 'settings.movie'},
+        'hall': {'serializer': HallSerializer, 'source': 'settings.hall'},
+    }
+    select_related_fields = ('settings__movie', 'settings__hall')
 
     class Meta:
         model = MovieSession
-        fields = ['id', 'date', 'time_start', 'time_end', 'movie', 'hall', 'price']
+        fields = ['id', 'date', 'time_start', 'time_end', 'movie', 'hall', 'price', 'free_seats']
 
+    def get_free_seats(self, session):
+        # sessions from MovieSession.objects.with_seat_counts() carry it already
+        if hasattr(session, 'free_seats'):
+            return session.free_seats
+        return session.settings.hall.hall_capacity - session.sold
+
+
+class MovieSessionSettingsSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    generation_progress = serializers.FloatField(read_only=True)
+
+    expandable_fields = {
+        'movie': {'serializer': MovieSerializer},
+        'hall': {'serializer': HallSerializer},
+    }
 
-class MovieSessionSettingsSerializer(serializers.ModelSerializer):
     class Meta:
         model = MovieSessionSettings
-        fields = '__all__'
+        exclude = ['deleted']
 
     def validate(self, data):
         hall = data['hall']
@@ -93,35 +182,165 @@ class CinemaUserSerializer(serializers.ModelSerializer):
         return user
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     customer = serializers.PrimaryKeyRelatedField(read_only=True)
-    session = serializers.IntegerField(write_only=True)
-    sits = serializers.ListField(child=serializers.IntegerField(min_value=1))
+    session = serializers.PrimaryKeyRelatedField(queryset=MovieSession.objects.all())
+    sits = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False)
+    count = serializers.IntegerField(min_value=1, required=False, write_only=True)
+    total = serializers.IntegerField(read_only=True)
+
+    expandable_fields = {
+        'session': {'serializer': MovieSessionSerializer},
+    }
+    prefetch_related_fields = ('ticket_set', )
 
     class Meta:
         model = Order
         fields = '__all__'
 
     def validate(self, data):
-        sits = data['sits']
-        session = MovieSession.objects.get(pk=data['session'])
-        start = datetime.datetime.combine(session.date, session.settings.time_start)
-        list_of_free = session.free_sits.values_list('number', flat=True)
-        string_of_free = ', '.join(str(x) for x in list_of_free)
-
-        for sit in sits:
-            if not (1 <= sit <= session.settings.hall.hall_capacity):
-                raise serializers.ValidationError(
-                    {'sits': f'Sit has to be positive number from list of free sits at this time: {string_of_free}.'})
-            if sit not in list_of_free:
-                raise serializers.ValidationError(
-                    {'sits': f'One or more sits from your order are not free already. '
-                     f'Free numbers at this time: {string_of_free}.'})
-
-        if len(sits) > len(set(sits)):
-            raise serializers.ValidationError({'sits': 'Sits are duplicated'})
-
-        if timezone.now() > start:
-            raise serializers.ValidationError('Current session is already expired.')
+        sits = data.get('sits', [])
+        if not sits and not data.get('count'):
+            raise serializers.ValidationError({'sits': 'Choose sits or number of best sits to book.'})
+        session = data['session']
+        conflicts = check_seats(session, numbers=sits)
+        if conflicts.expired:
+            raise serializers.ValidationError('Current session is already expired.', code='expired')
+        if conflicts:
+            details = conflicts.as_dict()
+            del details['expired']
+            raise serializers.ValidationError({
+                'sits': [ErrorDetail(message, code=code) for code, message in conflicts.messages()],
+                'conflicts': {kind: seats for kind, seats in details.items() if seats},
+            })
 
         return data
+
+
+class TimelineSessionSerializer(serializers.ModelSerializer):
+    """Sessions of a movie timeline, only what is cached with them: settings and hall"""
+    hall = serializers.CharField(source='settings.hall.name', read_only=True)
+    time_start = serializers.TimeField(source='settings.time_start', read_only=True)
+    time_end = serializers.TimeField(source='settings.time_end', read_only=True)
+    price = serializers.IntegerField(source='settings.price', read_only=True)
+
+    class Meta:
+        model = MovieSession
+        fields = ['id', 'date', 'time_start', 'time_end', 'hall', 'price']
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    movie_title = serializers.CharField(source='movie.title', read_only=True)
+    hall_name = serializers.CharField(source='hall.name', read_only=True)
+    occupancy = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = DailySales
+        fields = ['date', 'hall', 'hall_name', 'movie', 'movie_title', 'tickets', 'revenue', 'capacity', 'occupancy']
+
+
+class ValuesSerializer:
+    """
+    Read only lists with the JSON of `serializer_class`, built from queryset.values() rows
+    without model instances. Fields on columns and foreign keys are read with values() and formatted
+    by the serializer's own fields, many to many ones take one more query for the page.
+    Annotations of the list queryset named in annotated_fields are read as columns,
+    anything else needs get_<field>(pks) returning {pk: value}.
+    """
+    serializer_class = None
+    annotated_fields = ()
+
+    def __init__(self, fields=None, context=None):
+        self.serializer = self.serializer_class(context=context or {})
+        model = self.serializer_class.Meta.model
+        self.columns, self.many, self.extra = {}, {}, {}
+        for name, field in self.serializer.fields.items():
+            if field.write_only or (fields and name not in fields):
+                continue
+            if name in self.annotated_fields:
+                self.columns[name] = (name, lambda value: value)
+            elif hasattr(self, f'get_{name}'):
+                self.extra[name] = getattr(self, f'get_{name}')
+            elif isinstance(field, serializers.ManyRelatedField):
+                self.many[name] = field.source
+            else:
+                lookup = field.source.replace('.', '__')
+                model_field = self.model_field(model, lookup, name)
+                if isinstance(field, serializers.RelatedField):
+                    self.columns[name] = (lookup, lambda value: value)
+                elif isinstance(model_field, models.FileField):
+                    self.columns[name] = (lookup, self.file_formatter(field, model_field))
+                else:
+                    self.columns[name] = (lookup, field.to_representation)
+        self.names = [name for name in self.serializer.fields if name in self.columns or name in self.many
+                      or name in self.extra]
+
+    @staticmethod
+    def model_field(model, lookup, name):
+        try:
+            for part in lookup.split('__'):
+                field = model._meta.get_field(part)
+                model = field.related_model
+        except FieldDoesNotExist:
+            raise ImproperlyConfigured(f'{name} is not a column, add get_{name}(pks) to read it')
+        return field
+
+    @staticmethod
+    def file_formatter(field, model_field):
+        return lambda value: field.to_representation(model_field.attr_class(None, model_field, value))
+
+    def values(self, queryset):
+        lookups = {'pk'} | {lookup for lookup, _ in self.columns.values()}
+        return queryset.prefetch_related(None).values(*lookups)
+
+    def to_representation(self, rows):
+        rows = list(rows)
+        pks = [row['pk'] for row in rows]
+        related = {name: self.many_values(source, pks) for name, source in self.many.items()}
+        related.update({name: get_values(pks) for name, get_values in self.extra.items()})
+
+        data = []
+        for row in rows:
+            item = {}
+            for name in self.names:
+                if name in self.columns:
+                    lookup, formatter = self.columns[name]
+                    value = row[lookup]
+                    item[name] = None if value is None else formatter(value)
+                else:
+                    item[name] = related[name].get(row['pk'], [] if name in self.many else None)
+            data.append(item)
+        return data
+
+    def many_values(self, source, pks):
+        values = {}
+        for pk, related_pk in self.serializer_class.Meta.model.objects.filter(pk__in=pks, **{f'{source}__isnull': False})\
+                .values_list('pk', source):
+            values.setdefault(pk, []).append(related_pk)
+        return values
+
+
+class MovieValuesSerializer(ValuesSerializer):
+    serializer_class = MovieSerializer
+
+
+class MovieSessionValuesSerializer(ValuesSerializer):
+    serializer_class = MovieSessionSerializer
+    # lists come from MovieSession.objects.with_seat_counts()
+    annotated_fields = ('free_seats', )
+
+
+class OrderValuesSerializer(ValuesSerializer):
+    serializer_class = OrderSerializer
+
+    def get_sits(self, pks):
+        sits = {pk: [] for pk in pks}
+        for order, number in Ticket.objects.filter(order__in=pks).order_by('number').values_list('order', 'number'):
+            sits[order].append(number)
+        return sits
+
+    def get_total(self, pks):
+        totals = dict.fromkeys(pks, 0)
+        totals.update(Ticket.objects.filter(order__in=pks).values('order').order_by('order')
+                      .annotate(total=Sum('price')).values_list('order', 'total'))
+        return totals
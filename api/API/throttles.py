@@ -0,0 +1,28 @@
+from rest_framework.throttling import BaseThrottle
+
+from cinema.throttling import TokenBucket
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Redis token bucket from TOKEN_BUCKETS[scope], counted per key: 'user' or 'ip'"""
+    scope = None
+    key = 'user'
+    methods = ('POST', )
+
+    def allow_request(self, request, view):
+        if request.method not in self.methods:
+            return True
+        allowed, self.wait_seconds = TokenBucket(self.scope, self.key).consume(request)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class OrderThrottle(TokenBucketThrottle):
+    scope = 'order'
+
+
+class TokenThrottle(TokenBucketThrottle):
+    scope = 'token'
+    key = 'ip'
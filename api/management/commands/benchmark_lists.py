@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from api.API.serializers import MovieSerializer, MovieSessionSerializer, OrderSerializer
+from api.API.serializers import MovieValuesSerializer, MovieSessionValuesSerializer, OrderValuesSerializer
+from cinema.models import CinemaUser, Genre, Hall, Movie, MovieSession, MovieSessionSettings, Order, Sit
+
+SESSIONS_PER_SETTINGS = 20
+
+
+def create_sample(sessions):
+    """Sessions with an order each, movies and halls for them, to be rolled back after measuring"""
+    today = timezone.now().date()
+    genre = Genre.objects.create(name='benchmark genre')
+    customer = CinemaUser.objects.create(email='benchmark@example.com', username='benchmark', first_name='Bench')
+    for number in range(0, sessions, SESSIONS_PER_SETTINGS):
+        hall = Hall.objects.create(name=f'benchmark hall {number}', sits_rows=5, sits_cols=2)
+        movie = Movie.objects.create(title=f'benchmark movie {number}', description='benchmark',
+                                     director='director', starring='starring')
+        movie.genres.add(genre)
+        setting = MovieSessionSettings(hall=hall, movie=movie, price=10, date_start=today,
+                                       date_end=today + timezone.timedelta(days=min(SESSIONS_PER_SETTINGS,
+                                                                                    sessions - number) - 1),
+                                       time_start='18:00', time_end='20:00')
+        setting.save()
+    for session in MovieSession.objects.filter(settings__movie__title__startswith='benchmark movie'):
+        Order.objects.place(customer, session, Sit.objects.filter(session=session, number__in=[1, 2]))
+
+
+def measure(build, repeat):
+    """Best time of `repeat` runs in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        build()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+class Command(BaseCommand):
+    help = 'Rows per second of API lists built by serializers and by values serializers, ' \
+           'on sample data which is rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=500, help='sample sessions, each gets an order')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the best one counts')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            create_sample(options['sessions'])
+            cases = [
+                ('sessions', MovieSession.objects.with_seat_counts(), MovieSessionSerializer,
+                 MovieSessionValuesSerializer),
+                ('movies', Movie.objects.all(), MovieSerializer, MovieValuesSerializer),
+                ('orders', Order.objects.all(), OrderSerializer, OrderValuesSerializer),
+            ]
+            for name, queryset, serializer_class, values_serializer_class in cases:
+                select, prefetch = serializer_class.related_lookups(set())
+                queryset = queryset.select_related(*select).prefetch_related(*prefetch)
+                rows = queryset.count()
+
+                before = measure(lambda: serializer_class(queryset.all(), many=True).data, options['repeat'])
+                values_serializer = values_serializer_class()
+                after = measure(lambda: values_serializer.to_representation(values_serializer.values(queryset)),
+                                options['repeat'])
+                self.stdout.write(f'{name}: {rows} rows, serializer {rows / before:.0f} rows/s, '
+                                  f'values {rows / after:.0f} rows/s ({before / after:.1f}x)')
+            transaction.set_rollback(True)
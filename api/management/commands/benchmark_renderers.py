@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from api.API.renderers import MessagePackRenderer
+from api.API.serializers import MovieSessionValuesSerializer, OrderValuesSerializer
+from api.management.commands.benchmark_lists import create_sample, measure
+from cinema.models import MovieSession, Order
+
+
+class Command(BaseCommand):
+    help = 'Payload size and encode time of JSON and MessagePack API responses, ' \
+           'on sample data which is rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=500, help='sample sessions, each gets an order')
+        parser.add_argument('--repeat', type=int, default=5, help='runs per measurement, the best one counts')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            create_sample(options['sessions'])
+            cases = [
+                ('sessions', MovieSession.objects.with_seat_counts(), MovieSessionValuesSerializer),
+                ('orders', Order.objects.all(), OrderValuesSerializer),
+            ]
+            for name, queryset, values_serializer_class in cases:
+                values_serializer = values_serializer_class()
+                data = values_serializer.to_representation(values_serializer.values(queryset))
+                for renderer in (JSONRenderer(), MessagePackRenderer()):
+                    size = len(renderer.render(data))
+                    elapsed = measure(lambda: renderer.render(data), options['repeat'])
+                    self.stdout.write(f'{name} {renderer.format}: {len(data)} rows, {size} bytes, '
+                                      f'{elapsed * 1000:.2f} ms')
+            transaction.set_rollback(True)
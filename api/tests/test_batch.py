@@ -0,0 +1,97 @@
+import datetime
+import threading
+from unittest import mock
+
+from django.test import TransactionTestCase
+from rest_framework.test import APIClient
+
+from cinema.models import MovieSessionSettings, MovieSession, MovieSessionSettingsQuerySet, Order, Sit
+from cinema.tests.factories import UserFactory, HallFactory, MovieFactory
+from moviehouse.settings import SESSIONS_HORIZON_DAYS
+
+
+class BatchViewTest(TransactionTestCase):
+    # worker threads of the batch view read through their own connections, so rows are committed
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.user.save()
+
+        self.hall = HallFactory(sits_rows=2, sits_cols=2)
+        self.hall.save()
+        movie = MovieFactory()
+        movie.save()
+        setting = MovieSessionSettings(hall=self.hall,
+                                       movie=movie,
+                                       price=20,
+                                       date_start=(datetime.date.today() + datetime.timedelta(days=1)),
+                                       date_end=(datetime.date.today() + datetime.timedelta(days=2)),
+                                       time_start='18:00',
+                                       time_end='21:00')
+        setting.save()
+        session = MovieSession.objects.filter(settings=setting).first()
+        self.order = Order.objects.place(self.user, session, Sit.objects.filter(session=session, number=1))
+
+    def test_batch_same_as_single_requests(self):
+        paths = [f'/api/sessions/?hall={self.hall.name}', '/api/halls/', '/api/genres/']
+        response = self.client.post('/api/batch/', {'requests': paths}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['path'] for item in response.data], paths)
+        for item in response.data:
+            self.assertEqual(item['status'], 200)
+            self.assertEqual(item['body'], self.client.get(item['path']).data)
+
+    def test_shared_authentication(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/batch/', {'requests': ['/api/orders/']}, format='json')
+        self.assertEqual(response.data[0]['status'], 200)
+        self.assertEqual([order['id'] for order in response.data[0]['body']['results']], [self.order.pk])
+
+        self.client.force_authenticate(user=None)
+        response = self.client.post('/api/batch/', {'requests': ['/api/orders/']}, format='json')
+        self.assertEqual(response.data[0]['status'], 403)
+
+    def test_repeated_path_runs_once(self):
+        paths = ['/api/halls/', '/api/halls/']
+        with mock.patch('api.API.batch.BatchView.run', return_value=(200, [])) as run:
+            response = self.client.post('/api/batch/', {'requests': paths}, format='json')
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(len(response.data), 2)
+
+    def test_sub_requests_overlap(self):
+        # each sub-request waits for the other one, they pass only when running at the same time
+        barrier = threading.Barrier(2, timeout=5)
+
+        def run(request, path, user, auth):
+            barrier.wait()
+            return 200, path
+
+        with mock.patch('api.API.batch.BatchView.run', side_effect=run):
+            response = self.client.post('/api/batch/', {'requests': ['/api/halls/', '/api/genres/']}, format='json')
+        self.assertEqual([item['body'] for item in response.data], ['/api/halls/', '/api/genres/'])
+
+    def test_sessions_prepared_once(self):
+        until = datetime.date.today() + datetime.timedelta(days=SESSIONS_HORIZON_DAYS + 5)
+        paths = [f'/api/sessions/?date_range=,{until}', f'/api/sessions/facets/?date_range=,{until}']
+        materialize = MovieSessionSettingsQuerySet.materialize_on_demand
+        with mock.patch.object(MovieSessionSettingsQuerySet, 'materialize_on_demand', autospec=True,
+                               side_effect=materialize) as prepared:
+            for path in paths:
+                self.client.get(path)
+            self.assertEqual(prepared.call_count, 2)
+            prepared.reset_mock()
+
+            response = self.client.post('/api/batch/', {'requests': paths}, format='json')
+        self.assertEqual([item['status'] for item in response.data], [200, 200])
+        # the queries for days beyond the horizon run for the first sub-request only
+        self.assertEqual(prepared.call_count, 1)
+
+    def test_unknown_path(self):
+        response = self.client.post('/api/batch/', {'requests': ['/api/nothing/']}, format='json')
+        self.assertEqual(response.data[0]['status'], 404)
+
+    def test_only_api_paths(self):
+        for path in ['/account/', 'http://example.com/api/halls/', '/api/batch/']:
+            response = self.client.post('/api/batch/', {'requests': [path]}, format='json')
+            self.assertEqual(response.status_code, 400)
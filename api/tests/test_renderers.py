@@ -0,0 +1,58 @@
+import datetime
+import decimal
+
+import msgpack
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from api.API.renderers import MessagePackRenderer
+from cinema.models import MovieSessionSettings, MovieSession, Order
+from cinema.tests.factories import UserFactory, HallFactory, MovieFactory
+
+
+class MessagePackTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = UserFactory()
+        self.user.save()
+
+        self.hall = HallFactory(sits_rows=2, sits_cols=2)
+        self.hall.save()
+        movie = MovieFactory()
+        movie.save()
+        setting = MovieSessionSettings(hall=self.hall,
+                                       movie=movie,
+                                       price=20,
+                                       date_start=(datetime.date.today() + datetime.timedelta(days=1)),
+                                       date_end=(datetime.date.today() + datetime.timedelta(days=2)),
+                                       time_start='18:00',
+                                       time_end='21:00')
+        setting.save()
+        self.session = MovieSession.objects.filter(settings=setting).first()
+
+    def test_render_types(self):
+        data = {'date': datetime.date(2022, 8, 1), 'time': datetime.time(18, 30), 'price': decimal.Decimal('9.50')}
+        self.assertEqual(msgpack.unpackb(MessagePackRenderer().render(data)),
+                         {'date': '2022-08-01', 'time': '18:30:00', 'price': 9.5})
+
+    def test_sessions_negotiated(self):
+        url = f'/api/sessions/?hall={self.hall.name}'
+        response = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(response.content), self.client.get(url).json())
+
+    def test_order_posted(self):
+        self.client.force_authenticate(user=self.user)
+        body = msgpack.packb({'session': self.session.pk, 'sits': [1, 2]})
+        response = self.client.post('/api/orders/', body, content_type='application/msgpack',
+                                    HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        order = msgpack.unpackb(response.content)
+        self.assertEqual(order['sits'], [1, 2])
+        self.assertEqual(Order.objects.get(pk=order['id']).total, 40)
+
+    def test_malformed_body(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/orders/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
@@ -1,13 +1,16 @@
 import json
-from unittest import TestCase
+from unittest import TestCase, mock
 from datetime import datetime, timedelta
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from rest_framework.test import APIClient
 
 from api.API.serializers import MovieSessionSerializer, OrderSerializer
-from cinema.models import MovieSessionSettings, MovieSession, Sit, Order
-from cinema.tests.factories import SuperUserFactory, UserFactory, HallFactory, MovieFactory
+from cinema.booking import SeatConflicts, check_seats
+from cinema.models import MovieSessionSettings, MovieSession, Sit, Order, DailySales, IdempotencyKey
+from cinema.tests.factories import SuperUserFactory, UserFactory, HallFactory, MovieFactory, GenreFactory
 
 
 class MovieSessionViewSetTest(TestCase):
@@ -20,12 +23,12 @@ class MovieSessionViewSetTest(TestCase):
         self.user = UserFactory()
         self.user.save()
 
-        hall = HallFactory(sits_rows=5, sits_cols=5)
-        hall.save()
+        self.hall = HallFactory(sits_rows=5, sits_cols=5)
+        self.hall.save()
         movie = MovieFactory()
         movie.save()
 
-        setting = MovieSessionSettings(hall=hall,
+        setting = MovieSessionSettings(hall=self.hall,
                                        movie=movie,
                                        price=20,
                                        date_start=(datetime.now().date() - timedelta(days=5)),
@@ -48,6 +51,21 @@ class MovieSessionViewSetTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['results'], serializer.data)
 
+    def test_get_sessions_free_seats(self):
+        response = self.client.get(f'/api/sessions/?hall={self.hall.name}')
+        self.assertEqual({session['free_seats'] for session in response.data['results']}, {25})
+
+    def test_get_sessions_availability(self):
+        sessions = list(MovieSession.objects.filter(settings__hall=self.hall)[:2])
+        Order.objects.place(self.user, sessions[0], Sit.objects.filter(session=sessions[0], number__in=[1, 2]))
+        response = self.client.get(f'/api/sessions/availability/?ids={sessions[0].pk},{sessions[1].pk}')
+        self.assertEqual(response.data, [{'id': sessions[0].pk, 'sold_seats': 2, 'free_seats': 23},
+                                         {'id': sessions[1].pk, 'sold_seats': 0, 'free_seats': 25}])
+
+    def test_get_sessions_availability_bad_ids(self):
+        response = self.client.get('/api/sessions/availability/?ids=1,x')
+        self.assertEqual(response.status_code, 400)
+
     def test_get_sessions_data_todays_action(self):
         response = self.client.get('/api/sessions/todays/')
         queryset = MovieSession.objects.filter(date=timezone.now(), settings__time_start__gt=timezone.now())
@@ -56,6 +74,159 @@ class MovieSessionViewSetTest(TestCase):
         self.assertEqual(response.data, serializer.data)
 
 
+class ExpandFieldsTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+        self.hall = HallFactory(sits_rows=2, sits_cols=2)
+        self.hall.save()
+        self.genre = GenreFactory()
+        self.genre.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+        self.movie.genres.add(self.genre)
+
+        setting = MovieSessionSettings(hall=self.hall,
+                                       movie=self.movie,
+                                       price=20,
+                                       date_start=(datetime.now().date() + timedelta(days=1)),
+                                       date_end=(datetime.now().date() + timedelta(days=5)),
+                                       time_start='18:00',
+                                       time_end='21:00')
+        setting.save()
+
+    def test_sparse_fields(self):
+        response = self.client.get(f'/api/sessions/?hall={self.hall.name}&fields=id,price')
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(set(response.data['results'][0]), {'id', 'price'})
+
+    def test_expand_nested(self):
+        response = self.client.get(f'/api/sessions/?hall={self.hall.name}&fields=id,movie,hall&expand=movie,hall,genres')
+        session = response.data['results'][0]
+        self.assertEqual(session['hall']['name'], self.hall.name)
+        self.assertEqual(session['movie']['title'], self.movie.title)
+        self.assertEqual([(genre['id'], genre['name']) for genre in session['movie']['genres']],
+                         [(self.genre.pk, self.genre.name)])
+
+    def test_expand_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'/api/sessions/?hall={self.hall.name}&expand=movie,hall,genres')
+        # count, sessions joined with settings, movie and hall, genres prefetch
+        self.assertEqual(len(queries), 3)
+
+    def test_fields_ignored_on_write(self):
+        admin = SuperUserFactory()
+        admin.save()
+        self.client.force_authenticate(user=admin)
+        response = self.client.post('/api/genres/?fields=id', {'name': f'{self.genre.name}-new'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('name', response.data)
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+        self.genre = GenreFactory()
+        self.genre.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+        self.movie.genres.add(self.genre)
+
+    def test_not_modified_without_queries(self):
+        response = self.client.get(f'/api/movies/{self.movie.pk}/')
+        self.assertIn('Last-Modified', response)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/movies/{self.movie.pk}/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 0)
+
+    def test_cached_payload(self):
+        response = self.client.get('/api/genres/')
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get('/api/genres/')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(json.loads(cached.content), json.loads(response.content))
+
+    def test_changes_make_new_etag(self):
+        etag = self.client.get(f'/api/movies/{self.movie.pk}/?expand=genres')['ETag']
+        self.genre.name = f'{self.genre.name}-renamed'
+        self.genre.save()
+        response = self.client.get(f'/api/movies/{self.movie.pk}/?expand=genres', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['genres'][0]['name'], self.genre.name)
+
+        etag = response['ETag']
+        self.movie.genres.clear()
+        response = self.client.get(f'/api/movies/{self.movie.pk}/?expand=genres', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.data['genres'], [])
+
+
+class MovieTimelineActionTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+        hall = HallFactory(sits_rows=2, sits_cols=2)
+        hall.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+        setting = MovieSessionSettings(hall=hall,
+                                       movie=self.movie,
+                                       price=20,
+                                       date_start=(datetime.now().date() + timedelta(days=1)),
+                                       date_end=(datetime.now().date() + timedelta(days=3)),
+                                       time_start='18:00',
+                                       time_end='21:00')
+        setting.save()
+
+    def test_sessions(self):
+        response = self.client.get(f'/api/movies/{self.movie.pk}/sessions/')
+        self.assertEqual(response.data['today'], [])
+        self.assertEqual(len(response.data['tomorrow']), 1)
+        self.assertEqual(len(response.data['later']), 2)
+        self.assertEqual(set(response.data['tomorrow'][0]), {'id', 'date', 'time_start', 'time_end', 'hall', 'price'})
+
+    def test_unknown_movie(self):
+        self.assertEqual(self.client.get('/api/movies/0/sessions/').status_code, 404)
+
+
+class SessionFacetsActionTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+        self.hall = HallFactory(sits_rows=2, sits_cols=2)
+        self.hall.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+        setting = MovieSessionSettings(hall=self.hall,
+                                       movie=self.movie,
+                                       price=20,
+                                       date_start=(datetime.now().date() + timedelta(days=1)),
+                                       date_end=(datetime.now().date() + timedelta(days=3)),
+                                       time_start='18:00',
+                                       time_end='21:00')
+        setting.save()
+
+    def test_facets(self):
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        response = self.client.get('/api/sessions/facets/', {'hall': self.hall.name,
+                                                             'date_range': f'{tomorrow},{tomorrow}'})
+        self.assertEqual(response.data['movies'], [{'id': self.movie.pk, 'title': self.movie.title, 'sessions': 1}])
+        self.assertEqual(response.data['halls'], [{'id': self.hall.pk, 'name': self.hall.name, 'sessions': 1}])
+        self.assertEqual(response.data['dates'], [{'date': tomorrow.isoformat(), 'sessions': 1}])
+
+        response = self.client.get('/api/sessions/', {'hall': self.hall.name})
+        self.assertEqual(response.data['count'], sum(day['sessions'] for day in
+                                                     self.client.get('/api/sessions/facets/',
+                                                                     {'hall': self.hall.name}).data['dates']))
+
+
 class MovieSessionSettingsViewSetTest(TestCase):
 
     def setUp(self):
@@ -107,8 +278,7 @@ class MovieSessionSettingsViewSetTest(TestCase):
         self.assertEqual(response.status_code, 204)
 
     def test_delete_settings_decline_if_ordered(self):
-        order = Order.objects.create(customer=self.user, sits=self.sit)
-        order.save()
+        Order.objects.place(self.user, self.sit.session, [self.sit])
         response = self.client.delete(f'/api/sessionsettings/{self.setting.pk}/')
         self.assertEqual(response.status_code, 400)
 
@@ -120,12 +290,18 @@ class MovieSessionSettingsViewSetTest(TestCase):
         self.assertEqual(data['hall'], MovieSessionSettings.objects.get(pk=self.setting.pk).hall.pk)
 
     def test_update_settings_decline_if_ordered(self):
-        order = Order.objects.create(customer=self.user, sits=self.sit)
-        order.save()
+        Order.objects.place(self.user, self.sit.session, [self.sit])
         self.data['hall'] = self.hall2.pk
         response = self.client.put(f'/api/sessionsettings/{self.setting.pk}/', data=self.data, format='json')
         self.assertEqual(response.status_code, 400)
 
+    def test_generation_status(self):
+        response = self.client.get(f'/api/sessionsettings/{self.setting.pk}/generation/')
+        self.assertEqual(response.data, {'generating': False, 'generated_until': self.setting.date_end, 'progress': 1.0})
+        MovieSessionSettings.objects.filter(pk=self.setting.pk).update(generating=True, generated_until=None)
+        response = self.client.get(f'/api/sessionsettings/{self.setting.pk}/generation/')
+        self.assertEqual(response.data, {'generating': True, 'generated_until': None, 'progress': 0.0})
+
 
 class OrderViewSetTest(TestCase):
 
@@ -160,8 +336,8 @@ class OrderViewSetTest(TestCase):
         self.sit7 = Sit.objects.get(session=self.session, number=7)
         self.sit8 = Sit.objects.get(session=self.session, number=8)
 
-        Order.objects.create(customer=self.user, sits=self.sit7)
-        Order.objects.create(customer=self.user2, sits=self.sit8)
+        Order.objects.place(self.user, self.session, [self.sit7])
+        Order.objects.place(self.user2, self.session, [self.sit8])
 
         self.data = {"session": self.session.pk, "sits": [5, 6]}
 
@@ -170,7 +346,67 @@ class OrderViewSetTest(TestCase):
         response = self.client.post('/api/orders/', data=self.data, format='json')
         self.assertEqual(response.status_code, 201)
         sits = Sit.objects.filter(session=self.session, number__in=self.data['sits'])
-        self.assertTrue(Order.objects.filter(sits__in=sits).exists())
+        self.assertTrue(Order.objects.filter(ticket__sit__in=sits).exists())
+        self.assertEqual(response.data['sits'], [5, 6])
+        self.assertEqual(response.data['total'], 40)
+
+    def test_create_order_idempotent(self):
+        self.client.force_authenticate(user=self.user)
+        first = self.client.post('/api/orders/', data=self.data, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        second = self.client.post('/api/orders/', data=self.data, format='json', HTTP_IDEMPOTENCY_KEY='key-1')
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second.data, json.loads(json.dumps(first.data)))
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.filter(customer=self.user, session=self.session).count(), 2)
+
+    def test_create_order_idempotency_key_reused(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.post('/api/orders/', data=self.data, format='json', HTTP_IDEMPOTENCY_KEY='key-2')
+        self.data['sits'] = [9]
+        response = self.client.post('/api/orders/', data=self.data, format='json', HTTP_IDEMPOTENCY_KEY='key-2')
+        self.assertEqual(response.status_code, 422)
+
+    def test_create_order_idempotency_key_released_on_error(self):
+        self.client.force_authenticate(user=self.user)
+        self.data['sits'] = [7]
+        response = self.client.post('/api/orders/', data=self.data, format='json', HTTP_IDEMPOTENCY_KEY='key-3')
+        self.assertEqual(response.status_code, 400)
+        self.data['sits'] = [9]
+        response = self.client.post('/api/orders/', data=self.data, format='json', HTTP_IDEMPOTENCY_KEY='key-3')
+        self.assertEqual(response.status_code, 201)
+
+    def test_create_order_idempotency_key_invalid(self):
+        self.client.force_authenticate(user=self.user)
+        for key in ['', 'k' * 101]:
+            response = self.client.post('/api/orders/', data=self.data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.filter(customer=self.user, session=self.session).count(), 1)
+        self.assertFalse(IdempotencyKey.objects.filter(customer=self.user).exists())
+
+    def test_create_order_sits_taken_meanwhile(self):
+        self.client.force_authenticate(user=self.user)
+        self.data['sits'] = [7, 9]
+        # sit 7 is ordered by another customer between validation and placing the order
+        conflicts = check_seats(MovieSession.objects.get(pk=self.session.pk), numbers=[7, 9])
+        with mock.patch('api.API.serializers.check_seats', side_effect=[SeatConflicts(), conflicts]):
+            response = self.client.post('/api/orders/', data=self.data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['conflicts']['taken'], ['7'])
+        self.assertFalse(Order.objects.filter(customer=self.user, ticket__number=9).exists())
+
+    def test_create_order_best_sits(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/orders/', data={"session": self.session.pk, "count": 3}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['sits'], [12, 13, 14])
+        self.assertEqual(Order.objects.get(customer=self.user, session=self.session, ticket__number=12).sits,
+                         [12, 13, 14])
+
+    def test_create_order_best_sits_too_many(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.post('/api/orders/', data={"session": self.session.pk, "count": 6}, format='json')
+        self.assertEqual(response.status_code, 400)
 
     def get_orders_admin(self):
         self.client.force_authenticate(user=self.admin)
@@ -187,3 +423,41 @@ class OrderViewSetTest(TestCase):
         expected_qs = Order.objects.filter(customer=self.user)
         serializer = OrderSerializer(expected_qs, many=True)
         self.assertEqual(response.data, serializer.data)
+
+
+class DailySalesViewSetTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+        self.admin = SuperUserFactory()
+        self.admin.save()
+        self.user = UserFactory()
+        self.user.save()
+
+        hall = HallFactory(sits_rows=5, sits_cols=5)
+        hall.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+        today = datetime.now().date()
+        DailySales.objects.create(date=today, hall=hall, movie=self.movie, tickets=5, revenue=100, capacity=25)
+        DailySales.objects.create(date=today + timedelta(days=1), hall=hall, movie=self.movie,
+                                  tickets=10, revenue=200, capacity=25)
+
+    def test_sales_for_admin_only(self):
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/sales/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_sales_filtered(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(f'/api/sales/?movie={self.movie.pk}&date_start={datetime.now().date()}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['tickets'] for row in response.data['results']], [5, 10])
+        self.assertEqual(response.data['results'][1]['occupancy'], 40)
+
+    def test_sales_totals(self):
+        self.client.force_authenticate(user=self.admin)
+        response = self.client.get(f'/api/sales/totals/?by=movie&movie={self.movie.pk}')
+        self.assertEqual(response.data, [{'movie': self.movie.pk, 'tickets': 15, 'revenue': 300,
+                                          'capacity': 50, 'occupancy': 30}])
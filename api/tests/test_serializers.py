@@ -4,8 +4,9 @@ from unittest import TestCase
 from django.utils import timezone
 
 from api.API.serializers import MovieSessionSettingsSerializer, CinemaUserSerializer, OrderSerializer
-from cinema.models import MovieSessionSettings, CinemaUser, Order, Sit
-from cinema.tests.factories import HallFactory, MovieFactory, UserFactory
+from api.API.serializers import MovieSerializer, MovieValuesSerializer, OrderValuesSerializer
+from cinema.models import MovieSessionSettings, CinemaUser, Movie, Order, Sit
+from cinema.tests.factories import HallFactory, MovieFactory, UserFactory, GenreFactory
 
 
 class MovieSessionSettingsSerializerTest(TestCase):
@@ -107,8 +108,7 @@ class OrderSerializerTest(TestCase):
         actual_session = sessions.get(date=datetime.now().date()+timedelta(days=1))
 
         self.sit = Sit.objects.get(session=actual_session, number=7)
-        order = Order.objects.create(customer=customer, sits=self.sit)
-        order.save()
+        Order.objects.place(customer, actual_session, [self.sit])
 
         self.data_dict = {'sits': [5, 6],
                           'session': actual_session.pk
@@ -137,3 +137,51 @@ class OrderSerializerTest(TestCase):
         self.data_dict['sits'] = [self.sit.number]
         serializer = self.serializer(data=self.data_dict)
         self.assertFalse(serializer.is_valid())
+        self.assertEqual(serializer.errors['sits'][0].code, 'taken')
+        self.assertEqual(serializer.errors['conflicts']['taken'], [str(self.sit.number)])
+        self.assertEqual(len(serializer.errors['conflicts']['suggestions']), 5)
+
+
+class ValuesSerializerTest(TestCase):
+    def setUp(self):
+        hall = HallFactory()
+        hall.save()
+        genre = GenreFactory()
+        genre.save()
+        self.movie = MovieFactory(img_standard='img/poster.jpg')
+        self.movie.save()
+        self.movie.genres.add(genre)
+        self.movie_plain = MovieFactory()
+        self.movie_plain.save()
+
+        setting = MovieSessionSettings(hall=hall,
+                                       movie=self.movie,
+                                       price=20,
+                                       date_start=datetime.now().date(),
+                                       date_end=(datetime.now().date() + timedelta(days=2)),
+                                       time_start='18:00',
+                                       time_end='21:00')
+        setting.save()
+        self.user = UserFactory()
+        self.user.save()
+        sits = Sit.objects.filter(session__settings=setting)
+        self.orders = [Order.objects.place(self.user, sits[0].session, [sits[0], sits[1]]),
+                       Order.objects.place(self.user, sits[2].session, [sits[2]])]
+
+    def test_movies_same_as_serializer(self):
+        movies = Movie.objects.filter(pk__in=[self.movie.pk, self.movie_plain.pk])
+        values_serializer = MovieValuesSerializer()
+        self.assertEqual(values_serializer.to_representation(values_serializer.values(movies)),
+                         MovieSerializer(movies, many=True).data)
+
+    def test_orders_same_as_serializer(self):
+        orders = Order.objects.filter(customer=self.user)
+        values_serializer = OrderValuesSerializer()
+        self.assertEqual(values_serializer.to_representation(values_serializer.values(orders)),
+                         OrderSerializer(orders, many=True).data)
+
+    def test_selected_fields(self):
+        orders = Order.objects.filter(customer=self.user)
+        values_serializer = OrderValuesSerializer(fields={'id', 'sits'})
+        self.assertEqual(values_serializer.to_representation(values_serializer.values(orders)),
+                         [{'id': self.orders[0].pk, 'sits': [1, 2]}, {'id': self.orders[1].pk, 'sits': [3]}])
@@ -3,7 +3,9 @@ from rest_framework import routers
 from rest_framework.authtoken import views
 
 from api.API.resources import GenreViewSet, HallViewSet, MovieViewSet, OrderViewSet, UserViewSet
-from api.API.resources import MovieSessionViewSet, MovieSessionSettingsViewSet
+from api.API.resources import MovieSessionViewSet, MovieSessionSettingsViewSet, DailySalesViewSet
+from api.API.batch import BatchView
+from api.API.throttles import TokenThrottle
 
 router = routers.SimpleRouter()
 router.register(r'genres', GenreViewSet)
@@ -13,9 +15,11 @@ router.register(r'sessions', MovieSessionViewSet)
 router.register(r'sessionsettings', MovieSessionSettingsViewSet)
 router.register(r'orders', OrderViewSet)
 router.register(r'users', UserViewSet)
+router.register(r'sales', DailySalesViewSet)
 
 
 urlpatterns = [
-    path('generate-token/', views.obtain_auth_token),
+    path('generate-token/', views.ObtainAuthToken.as_view(throttle_classes=[TokenThrottle])),
+    path('batch/', BatchView.as_view()),
     path('', include(router.urls)),
 ]
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from cinema.models import Genre, Movie, Hall, MovieSessionSettings, MovieSession, CinemaUser, Order, Sit
+from cinema.models import Genre, Movie, Hall, MovieSessionSettings, MovieSession, CinemaUser, Order, Sit, Ticket
+from cinema.models import IdempotencyKey, DailySales
 
 admin.site.register(Genre)
 admin.site.register(Movie)
@@ -9,3 +10,6 @@ admin.site.register(MovieSession)
 admin.site.register(CinemaUser)
 admin.site.register(Order)
 admin.site.register(Sit)
+admin.site.register(Ticket)
+admin.site.register(IdempotencyKey)
+admin.site.register(DailySales)
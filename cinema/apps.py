@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CinemaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cinema'
+
+    def ready(self):
+        from cinema import signals  # noqa: F401
@@ -0,0 +1,160 @@
+import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import F, Func
+from django.utils import timezone
+
+from cinema import tracing
+from cinema.models import Order, Sit, Ticket
+
+BOOKING_ATTEMPTS = 3
+SUGGESTED_SEATS = 5
+
+
+class SeatConflicts:
+    """
+    What is wrong with the requested seats: expired session, duplicated seats, seats out of range
+    (not in the hall, or sit ids of another session) and taken seats, with free seats nearby to suggest.
+    False when the seats can be booked.
+    """
+
+    def __init__(self, expired=False, duplicated=(), out_of_range=(), taken=(), suggestions=()):
+        self.expired = expired
+        self.duplicated = sorted(duplicated)
+        # unparsable values stay strings and go last
+        self.out_of_range = sorted(out_of_range, key=lambda value: (isinstance(value, str), value))
+        self.taken = sorted(taken)
+        self.suggestions = list(suggestions)
+
+    def __bool__(self):
+        return bool(self.expired or self.duplicated or self.out_of_range or self.taken)
+
+    def as_dict(self):
+        return {'expired': self.expired, 'duplicated': self.duplicated, 'out_of_range': self.out_of_range,
+                'taken': self.taken, 'suggestions': self.suggestions}
+
+    def messages(self):
+        """(code, message) pairs to show to customers"""
+        messages = []
+        if self.expired:
+            messages.append(('expired', 'Current session is already expired.'))
+        if self.duplicated:
+            messages.append(('duplicated', f'Sits are duplicated: {join(self.duplicated)}.'))
+        if self.out_of_range:
+            messages.append(('out_of_range', f'Sits {join(self.out_of_range)} are not in the hall of this session.'))
+        if self.taken:
+            messages.append(('taken', f'Sits {join(self.taken)} from your order are not free already. '
+                                      f'Please choose new.'))
+        if self.suggestions:
+            messages.append(('suggestions', f'Free sits nearby: {join(self.suggestions)}.'))
+        return messages
+
+
+def join(values):
+    return ', '.join(f'#{value}' for value in values)
+
+
+def session_expired(session):
+    return timezone.now() > datetime.datetime.combine(session.date, session.settings.time_start)
+
+
+@tracing.traced('booking.check_seats')
+def check_seats(session, numbers=(), sit_ids=()):
+    """
+    Conflicts of seats requested by numbers (API) or by sit ids (order form).
+    The seats are checked with one query on the (session, number) index or on primary keys,
+    free seats nearby are looked up only for requests with taken or out of range seats.
+    """
+    if session_expired(session):
+        return SeatConflicts(expired=True)
+
+    by_number = not sit_ids
+    requested = numbers if by_number else sit_ids
+    seen, duplicated, lookup, out_of_range = set(), set(), set(), set()
+    for value in requested:
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            out_of_range.add(value)
+            continue
+        if value in seen:
+            duplicated.add(value)
+        seen.add(value)
+        if by_number and not 1 <= value <= session.settings.hall.hall_capacity:
+            out_of_range.add(value)
+        else:
+            lookup.add(value)
+    if not lookup:
+        return SeatConflicts(duplicated=duplicated, out_of_range=out_of_range)
+
+    key = 'number' if by_number else 'pk'
+    rows = list(Sit.objects.filter(session=session, **{f'{key}__in': lookup}).values_list(key, 'number', 'ticket'))
+    out_of_range |= lookup - {value for value, _, _ in rows}
+    chosen = {number for _, number, _ in rows}
+    taken = {number for _, number, ticket in rows if ticket is not None}
+    if not by_number:
+        duplicated = {number for value, number, _ in rows if value in duplicated}
+
+    suggestions = []
+    if taken or out_of_range:
+        around = taken or chosen or {(session.settings.hall.hall_capacity + 1) // 2}
+        center = round(sum(around) / len(around))
+        suggestions = Sit.objects.filter(session=session, ticket__isnull=True).exclude(number__in=chosen) \
+            .annotate(distance=Func(F('number') - center, function='ABS')) \
+            .order_by('distance', 'number').values_list('number', flat=True)[:SUGGESTED_SEATS]
+    return SeatConflicts(duplicated=duplicated, out_of_range=out_of_range, taken=taken, suggestions=suggestions)
+
+
+def find_best_seats(hall, taken, count):
+    """
+    Best contiguous block of `count` free seats or None.
+    Rows are laid out like session.html renders them: sits_cols rows of sits_rows seats each.
+    Rows closer to the middle of the hall win, inside a row the block closest to the row center wins.
+    """
+    row_length = hall.sits_rows
+    rows = hall.sits_cols
+    if not 1 <= count <= row_length:
+        return None
+
+    middle_row = (rows - 1) / 2
+    middle_seat = (row_length - 1) / 2
+    best, best_score = None, None
+    for row in range(rows):
+        first = row * row_length + 1
+        run_start = None
+        # one pass per row collecting runs of free seats, the extra step closes the last run
+        for offset in range(row_length + 1):
+            if offset < row_length and first + offset not in taken:
+                if run_start is None:
+                    run_start = offset
+                continue
+            if run_start is not None and offset - run_start >= count:
+                start = min(max(run_start, round(middle_seat - (count - 1) / 2)), offset - count)
+                score = (abs(row - middle_row), abs(start + (count - 1) / 2 - middle_seat))
+                if best_score is None or score < best_score:
+                    best, best_score = list(range(first + start, first + start + count)), score
+            run_start = None
+    return best
+
+
+@tracing.traced('booking.book_best_seats')
+def book_best_seats(customer, session, count, attempts=BOOKING_ATTEMPTS):
+    """Order `count` best seats standing together, retries if someone takes them meanwhile"""
+    hall = session.settings.hall
+    for _ in range(attempts):
+        taken = set(Sit.objects.filter(session=session, ticket__isnull=False).values_list('number', flat=True))
+        numbers = find_best_seats(hall, taken, count)
+        if numbers is None:
+            raise ValidationError(f'There are no {count} free sits together at this session.')
+
+        try:
+            with transaction.atomic():
+                sits = list(Sit.objects.select_for_update().filter(session=session, number__in=numbers))
+                # checked after locking, so tickets committed by concurrent bookings are visible
+                if not Ticket.objects.filter(sit__in=sits).exists():
+                    return Order.objects.place(customer, session, sits)
+        except IntegrityError:
+            pass
+
+    raise ValidationError('Sits are being booked by other customers right now. Please try again.')
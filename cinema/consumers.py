@@ -0,0 +1,30 @@
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import JsonWebsocketConsumer
+
+from cinema import tracing, waiting_room
+
+
+class WaitingRoomConsumer(JsonWebsocketConsumer):
+    """Pushes the queue position to a customer waiting for a movie, position 0 means the customer is admitted"""
+
+    def connect(self):
+        if not self.scope['user'].is_authenticated:
+            self.close()
+            return
+        self.movie_id = int(self.scope['url_route']['kwargs']['movie_id'])
+        self.group_name = waiting_room.group_name(self.movie_id)
+        async_to_sync(self.channel_layer.group_add)(self.group_name, self.channel_name)
+        self.accept()
+        self.send_position()
+
+    def disconnect(self, code):
+        if hasattr(self, 'group_name'):
+            async_to_sync(self.channel_layer.group_discard)(self.group_name, self.channel_name)
+
+    def queue_update(self, event):
+        with tracing.trace('channels.queue.update', traceparent=event.get(tracing.HEADER)):
+            self.send_position()
+
+    def send_position(self):
+        position, _ = waiting_room.status(self.movie_id, self.scope['user'].pk)
+        self.send_json({'position': position})
@@ -0,0 +1,100 @@
+import hashlib
+import json
+
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_time
+
+from cinema import versions
+from cinema.models import Hall, Movie, MovieSession, MovieSessionSettings, sessions_horizon
+
+# schedule filters and the session lookups behind them
+LOOKUPS = {
+    'movie': 'settings__movie__title',
+    'hall': 'settings__hall__name',
+    'time_start': 'settings__time_start__gte',
+    'time_end': 'settings__time_start__lte',
+    'date_start': 'date__gte',
+    'date_end': 'date__lte',
+}
+PARSERS = {'time_start': parse_time, 'time_end': parse_time, 'date_start': parse_date, 'date_end': parse_date}
+
+
+def normalize(filters):
+    """Filters in one canonical form, empty and unparsable values dropped, so equal filter sets share a cache key"""
+    normalized = {}
+    for name in LOOKUPS:
+        value = (filters.get(name) or '').strip()
+        if value and name in PARSERS:
+            try:
+                parsed = PARSERS[name](value)
+            except ValueError:
+                parsed = None
+            value = parsed.isoformat() if parsed else ''
+        if value:
+            normalized[name] = value
+    return normalized
+
+
+def upcoming_sessions():
+    """Sessions which have not started yet"""
+    return MovieSession.objects.filter(date__gte=timezone.now()).exclude(date=timezone.now(),
+                                                                         settings__time_start__lte=timezone.now())
+
+
+def filter_sessions(sessions, filters):
+    """Sessions matching normalized filters"""
+    return sessions.filter(**{LOOKUPS[name]: value for name, value in filters.items()})
+
+
+def prepare_sessions(filters):
+    """
+    (last day, partial) of schedules listed for normalized filters. Lists without date_end end at the horizon
+    and are partial, sessions beyond it asked for by date_end are created first, large schedules by a task;
+    lists are partial until it is over.
+    """
+    until = parse_date(filters['date_end']) if 'date_end' in filters else None
+    if until is None:
+        return sessions_horizon(), True
+    if until <= sessions_horizon():
+        return until, False
+    complete = MovieSessionSettings.objects.materialize_on_demand(until)
+    return complete, complete < until
+
+
+def schedule_facets(filters):
+    """
+    Movies, halls and dates of upcoming sessions matching normalized filters, with session counts:
+    {'movies': [{'id', 'title', 'sessions'}], 'halls': [{'id', 'name', 'sessions'}], 'dates': [{'date', 'sessions'}]}.
+    Built by one aggregate query and cached per filter set until the schedule changes or the minute is over,
+    sessions of today drop out as they start.
+    """
+    state = versions.state(MovieSession, MovieSessionSettings, Movie, Hall)
+    key = None
+    if state is not None:
+        digest = hashlib.md5(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+        key = f"facets:{state[0]}:{timezone.now().strftime('%Y%m%d%H%M')}:{digest}"
+        facets = versions.cached_payload(key)
+        if facets is not None:
+            return facets
+
+    rows = filter_sessions(upcoming_sessions(), filters).order_by()\
+        .values('settings__movie', 'settings__movie__title', 'settings__hall', 'settings__hall__name', 'date')\
+        .annotate(sessions=Count('id'))
+    movies, halls, dates = {}, {}, {}
+    for row in rows:
+        movie = movies.setdefault(row['settings__movie'], {'id': row['settings__movie'],
+                                                           'title': row['settings__movie__title'], 'sessions': 0})
+        movie['sessions'] += row['sessions']
+        hall = halls.setdefault(row['settings__hall'], {'id': row['settings__hall'],
+                                                        'name': row['settings__hall__name'], 'sessions': 0})
+        hall['sessions'] += row['sessions']
+        day = dates.setdefault(row['date'], {'date': row['date'].isoformat(), 'sessions': 0})
+        day['sessions'] += row['sessions']
+    facets = {'movies': sorted(movies.values(), key=lambda movie: movie['title']),
+              'halls': sorted(halls.values(), key=lambda hall: hall['name']),
+              'dates': [dates[day] for day in sorted(dates)]}
+
+    if key is not None:
+        versions.cache_payload(key, facets)
+    return facets
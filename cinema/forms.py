@@ -1,11 +1,9 @@
-import datetime
-
 from django.contrib.auth.forms import UserCreationForm
 from django.core.exceptions import ValidationError
 from django.forms import ModelForm
-from django.utils import timezone
 
-from cinema.models import CinemaUser, Order, MovieSession, Sit
+from cinema.booking import check_seats
+from cinema.models import CinemaUser, Order, MovieSession
 
 
 class CustomUserCreationForm(UserCreationForm):
@@ -35,13 +33,13 @@ class OrderForm(ModelForm):
     def clean(self):
         cleaned_data = super().clean()
         sits = self.request.POST.getlist("sit")
-        sits_set = Sit.objects.filter(id__in=sits)
-        session = MovieSession.objects.get(pk=self.request.POST.get("session"))
-        start = datetime.datetime.combine(session.date, session.settings.time_start)
-
-        if timezone.now() > start:
-            raise ValidationError('Current session is already expired.')
-
-        for sit in sits_set:
-            if sit not in session.free_sits:
-                raise ValidationError(f'Sit #{sit.number} from your order are not free already. Please choose new.')
+        count = self.request.POST.get("count")
+        if not sits and not count:
+            raise ValidationError('Choose sits or number of best sits to book.', code='empty')
+        if count and not (count.isdigit() and int(count) > 0):
+            raise ValidationError('Number of sits has to be positive number.')
+        session = MovieSession.objects.select_related('settings__hall').get(pk=self.request.POST.get("session"))
+        conflicts = check_seats(session, sit_ids=sits)
+        if conflicts:
+            raise ValidationError([ValidationError(message, code=code) for code, message in conflicts.messages()])
+        return cleaned_data
@@ -0,0 +1,49 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from cinema.models import IdempotencyKey
+from moviehouse.settings import MINUTES_IDEMPOTENCY_KEY_LIFE_TIME
+
+KEY_MAX_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+def fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def valid_key(key):
+    """Keys which fit IdempotencyKey.key, longer ones would fail the insert"""
+    return 0 < len(key) <= KEY_MAX_LENGTH
+
+
+def claim(customer, key, request_fingerprint):
+    """
+    None when the request is seen for the first time and has to be processed.
+    Stored IdempotencyKey for retries: its response is empty while the first request is still processed.
+    """
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                IdempotencyKey.objects.create(customer=customer, key=key, fingerprint=request_fingerprint)
+            return None
+        except IntegrityError:
+            stored = IdempotencyKey.objects.filter(customer=customer, key=key).first()
+            expired = timezone.now() - timedelta(minutes=MINUTES_IDEMPOTENCY_KEY_LIFE_TIME)
+            if stored is None or stored.created < expired:
+                IdempotencyKey.objects.filter(customer=customer, key=key, created__lt=expired).delete()
+                continue
+            return stored
+    return None
+
+
+def complete(customer, key, status_code, response):
+    IdempotencyKey.objects.filter(customer=customer, key=key).update(status_code=status_code, response=response)
+
+
+def release(customer, key):
+    """Forget the key of a failed request, so the client may retry it"""
+    IdempotencyKey.objects.filter(customer=customer, key=key, status_code__isnull=True).delete()
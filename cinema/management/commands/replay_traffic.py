@@ -0,0 +1,211 @@
+import json
+import secrets
+import string
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import NoReverseMatch, Resolver404, resolve, reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from cinema.models import CinemaUser, MovieSession
+from moviehouse.settings import MINUTES_DRF_TOKEN_LIFE_TIME
+
+REPLAY_USER = 'replay@example.com'
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, round(share * len(values)) - 1))]
+
+
+def route_model(path):
+    """Model behind the view of the path: Django views have `model`, DRF viewsets a queryset"""
+    try:
+        func = resolve(path).func
+    except Resolver404:
+        return None
+    view = getattr(func, 'view_class', None) or getattr(func, 'cls', None)
+    model = getattr(view, 'model', None)
+    queryset = getattr(view, 'queryset', None)
+    return model or (queryset.model if queryset is not None else None)
+
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Replay:
+    """Maps captured requests onto the local database and sends them, latencies are collected per route"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(NoRedirect)
+        self.pools = {}
+        self.results = defaultdict(list)
+        self.lock = threading.Lock()
+
+        user, _ = CinemaUser.objects.get_or_create(email=REPLAY_USER,
+                                                         defaults={'username': REPLAY_USER, 'first_name': 'Replay'})
+        client = Client()
+        client.force_login(user)
+        self.user = user
+        self.session_cookie = client.cookies[settings.SESSION_COOKIE_NAME].value
+        # any 32 letters and digits make a valid CSRF secret, the same value goes to the cookie and the header
+        self.csrf = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(32))
+        self.refresh_token()
+
+    def refresh_token(self):
+        Token.objects.filter(user=self.user).delete()
+        self.token = Token.objects.create(user=self.user)
+
+    def token_expiring(self):
+        return timezone.now() > self.token.created + timezone.timedelta(minutes=MINUTES_DRF_TOKEN_LIFE_TIME / 2)
+
+    def local_id(self, model, captured):
+        """Captured ids are spread over local rows of the same model, the same id always gets the same row"""
+        if model not in self.pools:
+            queryset = model.objects.all()
+            if model is MovieSession:
+                queryset = queryset.filter(date__gte=timezone.now().date())
+            self.pools[model] = list(queryset.order_by('pk').values_list('pk', flat=True))
+        pool = self.pools[model]
+        return pool[int(captured) % len(pool)] if pool else captured
+
+    def prepare(self, record):
+        """(route, method, url, body, headers) of the local request or None when it can't be mapped"""
+        path = record['path']
+        kwargs = record.get('kwargs') or {}
+        if 'pk' in kwargs and str(kwargs['pk']).isdigit():
+            model = route_model(path)
+            if model is not None:
+                kwargs = {**kwargs, 'pk': self.local_id(model, kwargs['pk'])}
+                try:
+                    path = reverse(record['route'], kwargs=kwargs)
+                except NoReverseMatch:
+                    return None
+
+        query = {name: value for name, value in record.get('query', {}).items() if value != ''}
+        url = f'{self.base_url}{path}'
+        if query:
+            url = f'{url}?{urllib.parse.urlencode(query, doseq=True)}'
+
+        headers = {'Cookie': f'csrftoken={self.csrf}', 'X-CSRFToken': self.csrf}
+        if record['auth'] == 'session':
+            headers['Cookie'] += f'; {settings.SESSION_COOKIE_NAME}={self.session_cookie}'
+        elif record['auth'] in ('token', 'basic'):
+            headers['Authorization'] = f'Token {self.token.key}'
+
+        body = None
+        data = record.get('data')
+        if data is not None:
+            data = {name: value for name, value in data.items() if value != ''}
+            if 'session' in data and str(data['session']).isdigit():
+                data['session'] = self.local_id(MovieSession, data['session'])
+            # seats taken in production mean nothing here, orders book as many best seats instead
+            seats = data.pop('sit', None) or data.pop('sits', None)
+            if seats and 'count' not in data:
+                data['count'] = len(seats) if isinstance(seats, list) else 1
+            if record['path'].startswith('/api/'):
+                body = json.dumps(data).encode()
+                headers['Content-Type'] = 'application/json'
+            else:
+                body = urllib.parse.urlencode(data, doseq=True).encode()
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        return record['route'], record['method'], url, body, headers
+
+    def send(self, route, method, url, body, headers):
+        request = urllib.request.Request(url, data=body, headers=headers, method=method)
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as error:
+            status = error.code
+        except OSError:
+            status = None
+        elapsed = (time.perf_counter() - started) * 1000
+        with self.lock:
+            self.results[route].append((elapsed, status))
+
+
+class Command(BaseCommand):
+    help = 'Plays requests captured by TrafficCaptureMiddleware against a local instance ' \
+           'and reports latency percentiles and error rates per route'
+
+    def add_arguments(self, parser):
+        parser.add_argument('capture', help='file written by TrafficCaptureMiddleware')
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='local instance to drive')
+        parser.add_argument('--concurrency', type=int, default=8, help='requests in flight at most')
+        parser.add_argument('--speedup', type=float, default=1.0,
+                            help='how many times faster than captured, 0 sends everything at once')
+        parser.add_argument('--routes', default='', help='comma separated routes to play, all by default')
+        parser.add_argument('--skip-writes', action='store_true', help='play GET, HEAD and OPTIONS only')
+
+    def handle(self, *args, **options):
+        routes = {route.strip() for route in options['routes'].split(',') if route.strip()}
+        try:
+            with open(options['capture']) as capture:
+                records = [json.loads(line) for line in capture if line.strip()]
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Capture is not readable: {error}')
+        records = [record for record in records
+                   if (not routes or record['route'] in routes)
+                   and not (options['skip_writes'] and record['method'] not in ('GET', 'HEAD', 'OPTIONS'))]
+        if not records:
+            raise CommandError('Nothing to play')
+        records.sort(key=lambda record: record['ts'])
+
+        replay = Replay(options['base_url'])
+        first = records[0]['ts']
+        started = time.monotonic()
+        skipped = 0
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for record in records:
+                if options['speedup'] > 0:
+                    delay = (record['ts'] - first) / options['speedup'] - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+                if replay.token_expiring():
+                    replay.refresh_token()
+                prepared = replay.prepare(record)
+                if prepared is None:
+                    skipped += 1
+                    continue
+                pool.submit(replay.send, *prepared)
+        self.report(replay.results, time.monotonic() - started, skipped)
+
+    def report(self, results, elapsed, skipped):
+        self.stdout.write(f'{"route":<40} {"requests":>8} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} '
+                          f'{"max ms":>8} {"4xx %":>6} {"errors %":>8}')
+        total = []
+        for route in sorted(results):
+            samples = results[route]
+            total.extend(samples)
+            self.stdout.write(self.row(route, samples))
+        self.stdout.write(self.row('all', total))
+        self.stdout.write(f'{len(total)} requests in {elapsed:.1f}s, {len(total) / elapsed:.1f} requests/s, '
+                          f'{skipped} not mapped to local rows')
+
+    @staticmethod
+    def row(route, samples):
+        latencies = sorted(elapsed for elapsed, _ in samples)
+        client_errors = sum(1 for _, status in samples if status is not None and 400 <= status < 500)
+        # server errors and requests which got no response at all
+        errors = sum(1 for _, status in samples if status is None or status >= 500)
+        return f'{route:<40} {len(samples):>8} {percentile(latencies, 0.5):>8.1f} ' \
+               f'{percentile(latencies, 0.9):>8.1f} {percentile(latencies, 0.99):>8.1f} ' \
+               f'{latencies[-1] if latencies else 0:>8.1f} {100 * client_errors / max(len(samples), 1):>6.1f} ' \
+               f'{100 * errors / max(len(samples), 1):>8.1f}'
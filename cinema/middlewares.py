@@ -1,11 +1,30 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import time
+from contextlib import ExitStack
 from datetime import timedelta
 
 from django.contrib.auth import logout
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponseForbidden
+from django.urls import Resolver404, resolve
 from django.utils import timezone
 from django.utils.deprecation import MiddlewareMixin
 from django.core.cache import cache
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
 
-from moviehouse.settings import MINUTES_TO_LOGOUT_IF_INACTIVE
+from cinema import tracing
+from cinema.models import RequestProfile
+from moviehouse.settings import MINUTES_TO_LOGOUT_IF_INACTIVE, TRAFFIC_CAPTURE_FILE, TRAFFIC_CAPTURE_PARAMS
+from moviehouse.settings import PROFILING_PARAM, PROFILING_HEADER, PROFILING_SAMPLE_RATE, PROFILING_SAMPLED_ROUTES
+from moviehouse.settings import PROFILING_STATS_LINES
 
 
 class CustomUserActivityCheckerMiddleware(MiddlewareMixin):
@@ -17,3 +36,166 @@ class CustomUserActivityCheckerMiddleware(MiddlewareMixin):
                 if timezone.now() > (last_activity_at + timedelta(minutes=MINUTES_TO_LOGOUT_IF_INACTIVE)):
                     logout(request)
             cache.set('last_request', timezone.now())
+
+
+def sanitize(params):
+    """Parameter names with values kept only for TRAFFIC_CAPTURE_PARAMS, multiple values stay lists"""
+    if hasattr(params, 'lists'):
+        params = {name: values if len(values) > 1 else values[0] for name, values in params.lists()}
+    return {name: value if name in TRAFFIC_CAPTURE_PARAMS else '' for name, value in params.items()}
+
+
+def auth_kind(request):
+    header = request.headers.get('Authorization')
+    if header:
+        return header.split()[0].lower()
+    user = getattr(request, 'user', None)
+    return 'session' if user is not None and user.is_authenticated else 'anonymous'
+
+
+class TrafficCaptureMiddleware:
+    """
+    Appends the shape of every request to TRAFFIC_CAPTURE_FILE as a JSON line: route, method, path,
+    sanitized query and form or JSON parameters, auth kind, status and milliseconds spent.
+    Cookies, headers and other values are never written. Off while the setting is empty,
+    `manage.py replay_traffic` plays captures back.
+    """
+
+    def __init__(self, get_response):
+        if not TRAFFIC_CAPTURE_FILE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.fd = os.open(TRAFFIC_CAPTURE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    def __call__(self, request):
+        data = None
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            if request.content_type == 'application/json':
+                # read before the view, the body stays available for DRF
+                try:
+                    body = json.loads(request.body or b'{}')
+                except ValueError:
+                    body = {}
+                data = sanitize(body) if isinstance(body, dict) else {}
+            else:
+                data = sanitize(request.POST)
+
+        started = time.time()
+        response = self.get_response(request)
+        match = request.resolver_match
+        if match is not None:
+            record = {'ts': round(started, 3), 'route': match.view_name, 'method': request.method,
+                      'path': request.path, 'kwargs': match.kwargs, 'query': sanitize(request.GET), 'data': data,
+                      'auth': auth_kind(request), 'status': response.status_code,
+                      'ms': round((time.time() - started) * 1000, 1)}
+            # one write of a short line per request, appends of several workers do not interleave
+            os.write(self.fd, (json.dumps(record, separators=(',', ':'), default=str) + '\n').encode())
+        return response
+
+
+def profiling_user(request):
+    """User asking for a profile: logged in, or authenticated by the API credentials the way DRF does it"""
+    if request.user.is_authenticated:
+        return request.user
+    api_request = Request(request)
+    for authentication in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication().authenticate(api_request)
+        except APIException:
+            return None
+        if result is not None:
+            return result[0]
+    return None
+
+
+def route_name(request):
+    try:
+        return resolve(request.path_info).view_name
+    except Resolver404:
+        return None
+
+
+class SqlTimeline:
+    """Database execute wrapper noting when each query started and how long it took"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'start': round((start - self.started) * 1000, 2),
+                                 'duration': round((time.perf_counter() - start) * 1000, 2), 'sql': sql})
+
+
+class ProfilingMiddleware:
+    """
+    Runs a request under cProfile, records its SQL timeline and saves both as a RequestProfile,
+    staff read them at /staff/main/profiles/. Superusers ask for it with the PROFILING_PARAM query
+    parameter or the PROFILING_HEADER header on any page or API call, anybody else gets 403.
+    PROFILING_SAMPLE_RATE of requests to PROFILING_SAMPLED_ROUTES are profiled without asking.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if PROFILING_PARAM in request.GET or PROFILING_HEADER in request.headers:
+            user = profiling_user(request)
+            if user is None or not user.is_superuser:
+                return HttpResponseForbidden('Requests are profiled for superusers only.')
+            return self.profile(request, user)
+
+        if PROFILING_SAMPLE_RATE and random.random() < PROFILING_SAMPLE_RATE \
+                and route_name(request) in PROFILING_SAMPLED_ROUTES:
+            user = request.user if request.user.is_authenticated else None
+            return self.profile(request, user, sampled=True)
+        return self.get_response(request)
+
+    def profile(self, request, user, sampled=False):
+        timeline = SqlTimeline()
+        profiler = cProfile.Profile()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timeline))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = (time.perf_counter() - timeline.started) * 1000
+
+        stats = io.StringIO()
+        pstats.Stats(profiler, stream=stats).sort_stats('cumulative').print_stats(PROFILING_STATS_LINES)
+        match = request.resolver_match
+        RequestProfile.objects.record(method=request.method, path=request.get_full_path()[:2048],
+                                      route=match.view_name if match else '', user=user, sampled=sampled,
+                                      status_code=response.status_code, duration=round(duration, 2),
+                                      sql_duration=round(sum(query['duration'] for query in timeline.queries), 2),
+                                      query_count=len(timeline.queries), stats=stats.getvalue(),
+                                      queries=timeline.queries)
+        return response
+
+
+class TracingMiddleware:
+    """
+    Runs every request in the root span of a trace, or of the trace of its traceparent header,
+    and answers with the traceparent of that span. Not used while tracing is off.
+    """
+
+    def __init__(self, get_response):
+        if not tracing.enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with tracing.trace('http.request', traceparent=request.headers.get(tracing.HEADER),
+                           method=request.method, path=request.path) as span:
+            response = self.get_response(request)
+            match = request.resolver_match
+            span.attributes.update(route=match.view_name if match else '', status=response.status_code)
+        response[tracing.HEADER] = span.traceparent
+        return response
@@ -0,0 +1,133 @@
+# Generated by Django 4.0.6 on 2026-10-19 17:36
+
+from django.conf import settings
+import django.contrib.auth.models
+import django.contrib.auth.validators
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CinemaUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('username', models.CharField(error_messages={'unique': 'A user with that username already exists.'}, help_text='Required. 150 characters or fewer. Letters, digits and @/./+/-/_ only.', max_length=150, unique=True, validators=[django.contrib.auth.validators.UnicodeUsernameValidator()], verbose_name='username')),
+                ('last_name', models.CharField(blank=True, max_length=150, verbose_name='last name')),
+                ('is_staff', models.BooleanField(default=False, help_text='Designates whether the user can log into this admin site.', verbose_name='staff status')),
+                ('is_active', models.BooleanField(default=True, help_text='Designates whether this user should be treated as active. Unselect this instead of deleting accounts.', verbose_name='active')),
+                ('date_joined', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date joined')),
+                ('email', models.EmailField(max_length=150, unique=True)),
+                ('first_name', models.CharField(max_length=150)),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+            ],
+            managers=[
+                ('objects', django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Genre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Hall',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('sits_rows', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('sits_cols', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Movie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=300, unique=True)),
+                ('description', models.TextField()),
+                ('director', models.CharField(max_length=100)),
+                ('starring', models.CharField(max_length=300)),
+                ('trailer', models.CharField(blank=True, max_length=300, null=True)),
+                ('teaser', models.CharField(blank=True, max_length=300, null=True)),
+                ('img_landscape', models.ImageField(blank=True, null=True, upload_to='img/%Y/%m/%d')),
+                ('img_standard', models.ImageField(blank=True, null=True, upload_to='img/%Y/%m/%d')),
+                ('img_small', models.ImageField(blank=True, null=True, upload_to='img/%Y/%m/%d')),
+                ('age_policy', models.PositiveSmallIntegerField(choices=[(1, 'all'), (2, '13+'), (3, '18+')], default=1)),
+                ('advertised', models.BooleanField(default=False)),
+                ('genres', models.ManyToManyField(to='cinema.genre')),
+            ],
+            options={
+                'ordering': ['title'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Sit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cinema.moviesession')),
+            ],
+            options={
+                'unique_together': {('session', 'number')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Order',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('datetime', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('sits', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cinema.sit')),
+            ],
+            options={
+                'ordering': ['datetime'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MovieSessionSettings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_start', models.DateField(default=django.utils.timezone.now)),
+                ('date_end', models.DateField()),
+                ('time_start', models.TimeField()),
+                ('time_end', models.TimeField()),
+                ('price', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('hall', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cinema.hall')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cinema.movie')),
+            ],
+            options={
+                'ordering': ['-date_start'],
+            },
+        ),
+        migrations.AddField(
+            model_name='moviesession',
+            name='settings',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cinema.moviesessionsettings'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.6 on 2026-10-19 17:37
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='session',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='cinema.moviesession'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='datetime',
+            field=models.DateTimeField(auto_now_add=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='sits',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='cinema.sit'),
+        ),
+        migrations.CreateModel(
+            name='Ticket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('price', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cinema.order')),
+                ('sit', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='cinema.sit')),
+            ],
+            options={
+                'ordering': ['number'],
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+import logging
+from datetime import timedelta
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+PURCHASE_WINDOW = timedelta(minutes=1)
+
+
+def group_orders(apps, schema_editor):
+    """
+    Legacy orders are one row per sit. Rows of the same customer and session created within
+    PURCHASE_WINDOW of the first one are merged into a single order carrying their tickets.
+    A sit sold twice gets one ticket, in the order which sold it first. Later sales of the sit are logged
+    for refunds, their orders are dropped when nothing else is left in them.
+    """
+    Order = apps.get_model('cinema', 'Order')
+    Ticket = apps.get_model('cinema', 'Ticket')
+
+    first_sales = set(Order.objects.order_by('sits_id', 'datetime', 'pk').distinct('sits_id')
+                      .values_list('pk', flat=True))
+    purchase, tickets, merged, double_sold = None, [], [], []
+    orders = Order.objects.select_related('sits__session__settings') \
+        .order_by('customer_id', 'sits__session_id', 'datetime', 'pk')
+    for order in orders.iterator():
+        session = order.sits.session
+        if purchase is None or purchase.customer_id != order.customer_id or \
+                purchase.session_id != session.pk or order.datetime - purchase.datetime > PURCHASE_WINDOW:
+            purchase = order
+            purchase.session = session
+            purchase.save(update_fields=['session'])
+        else:
+            merged.append(order.pk)
+        if order.pk in first_sales:
+            tickets.append(Ticket(order=purchase, sit_id=order.sits_id, number=order.sits.number,
+                                  price=session.settings.price))
+        else:
+            double_sold.append(order)
+
+    Ticket.objects.bulk_create(tickets, batch_size=1000)
+    Order.objects.filter(pk__in=merged).delete()
+    Order.objects.filter(ticket__isnull=True).delete()
+    for order in double_sold:
+        logger.warning('Sit %s of session %s is sold twice: order %s of customer %s at %s gets no ticket',
+                       order.sits.number, order.sits.session_id, order.pk, order.customer_id, order.datetime)
+
+
+def split_orders(apps, schema_editor):
+    Order = apps.get_model('cinema', 'Order')
+    Ticket = apps.get_model('cinema', 'Ticket')
+
+    kept = set()
+    for ticket in Ticket.objects.select_related('order').order_by('order_id', 'number').iterator():
+        order = ticket.order
+        if order.pk not in kept:
+            kept.add(order.pk)
+            order.sits_id = ticket.sit_id
+            order.save(update_fields=['sits'])
+        else:
+            split = Order.objects.create(customer_id=order.customer_id, session_id=order.session_id,
+                                         sits_id=ticket.sit_id)
+            Order.objects.filter(pk=split.pk).update(datetime=order.datetime)
+    Ticket.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0002_order_tickets'),
+    ]
+
+    operations = [
+        migrations.RunPython(group_orders, split_orders),
+    ]
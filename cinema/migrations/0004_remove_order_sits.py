@@ -0,0 +1,21 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0003_order_tickets_data'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='order',
+            name='sits',
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='session',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cinema.moviesession'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.0.6 on 2026-10-19 17:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0004_remove_order_sits'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='moviesession',
+            options={'ordering': ['date', 'id']},
+        ),
+        migrations.AddField(
+            model_name='moviesession',
+            name='archived',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='moviesession',
+            name='date',
+            field=models.DateField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='ticket',
+            name='sit',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cinema.sit'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.0.6 on 2026-10-19 17:42
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def fill_generated_until(apps, schema_editor):
+    MovieSessionSettings = apps.get_model('cinema', 'MovieSessionSettings')
+    for setting in MovieSessionSettings.objects.annotate(last=Max('moviesession__date')).iterator():
+        setting.generated_until = setting.last
+        setting.save(update_fields=['generated_until'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0005_session_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moviesessionsettings',
+            name='generated_until',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_generated_until, migrations.RunPython.noop),
+    ]
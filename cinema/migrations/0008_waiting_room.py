@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-19 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0007_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='waiting_room',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='moviesessionsettings',
+            name='waiting_room',
+            field=models.BooleanField(default=False),
+        ),
+    ]
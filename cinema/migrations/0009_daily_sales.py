@@ -0,0 +1,38 @@
+# Generated by Django 4.0.6 on 2026-10-19 17:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0008_waiting_room'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('tickets', models.PositiveIntegerField(default=0)),
+                ('revenue', models.PositiveBigIntegerField(default=0)),
+                ('capacity', models.PositiveIntegerField(default=0)),
+                ('hall', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cinema.hall')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cinema.movie')),
+            ],
+            options={
+                'verbose_name_plural': 'daily sales',
+                'ordering': ['date', 'hall', 'movie'],
+                'unique_together': {('date', 'hall', 'movie')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-19 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0010_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moviesessionsettings',
+            name='generating',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.6 on 2026-10-19 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0011_generating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hall',
+            name='deleted',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='deleted',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='moviesessionsettings',
+            name='deleted',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
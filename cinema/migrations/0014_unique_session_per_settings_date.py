@@ -0,0 +1,42 @@
+# Generated by Django 4.0.6 on 2026-10-19 18:29
+
+from django.db import migrations, models
+from django.db.models import Count, Exists, OuterRef
+
+
+def drop_duplicate_sessions(apps, schema_editor):
+    """
+    Sessions created twice for a day by concurrent requests: the copy without orders goes.
+    Days where several copies have orders are left to staff, the migration stops with their ids.
+    """
+    MovieSession = apps.get_model('cinema', 'MovieSession')
+    Order = apps.get_model('cinema', 'Order')
+
+    days = MovieSession.objects.values('settings_id', 'date').annotate(copies=Count('pk')).filter(copies__gt=1)
+    conflicts = []
+    for day in days.iterator():
+        sessions = list(MovieSession.objects.filter(settings_id=day['settings_id'], date=day['date'])
+                        .annotate(ordered=Exists(Order.objects.filter(session=OuterRef('pk')))).order_by('pk'))
+        ordered = [session.pk for session in sessions if session.ordered]
+        if len(ordered) > 1:
+            conflicts.append(ordered)
+            continue
+        kept = ordered[0] if ordered else sessions[0].pk
+        MovieSession.objects.filter(pk__in=[session.pk for session in sessions if session.pk != kept]).delete()
+    if conflicts:
+        raise RuntimeError(f'Sessions of the same day have orders, merge them before migrating: {conflicts}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0013_requestprofile'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_sessions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='moviesession',
+            constraint=models.UniqueConstraint(fields=('settings', 'date'), name='unique_session_per_settings_date'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.6 on 2026-10-19 18:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0014_unique_session_per_settings_date'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hall',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='title',
+            field=models.CharField(db_index=True, max_length=300),
+        ),
+        migrations.AddConstraint(
+            model_name='hall',
+            constraint=models.UniqueConstraint(condition=models.Q(('deleted', False)), fields=('name',), name='unique_hall_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='movie',
+            constraint=models.UniqueConstraint(condition=models.Q(('deleted', False)), fields=('title',), name='unique_movie_title'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-19 18:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinema', '0015_unique_visible_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='moviesessionsettings',
+            name='requested_until',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+    ]
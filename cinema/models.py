@@ -1,9 +1,18 @@
+import datetime
+
+from celery import current_app
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import CASCADE
+from django.db import models, transaction
+from django.db.models import CASCADE, Count, F, Max, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+from cinema import versions
+from moviehouse.settings import SESSIONS_HORIZON_DAYS, SESSIONS_GENERATE_INLINE_MAX_SITS, SESSIONS_ON_DEMAND_MAX_DAYS
+from moviehouse.settings import PROFILING_MAX_REPORTS
+
 
 AGE_CHOICES = (
     (1, 'all'),
@@ -12,15 +21,55 @@ AGE_CHOICES = (
 )
 
 
+class VisibleManager(models.Manager):
+    """Rows which are not deleted, deleted ones only wait for the purge_deleted task"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted=False)
+
+
+class SoftDeleteMixin:
+    """
+    Halls, movies and session settings are hidden right away together with their session settings,
+    the purge_deleted task deletes them with sessions, sits and orders batch by batch
+    """
+    # lookup of the session settings which go along
+    settings_lookup = None
+    # unique among rows which are not deleted, deleted ones keep their values until the purge
+    unique_field = None
+
+    def validate_unique(self, exclude=None):
+        # conditional constraints are not checked by model validation, so forms would get database errors
+        super().validate_unique(exclude)
+        field = self.unique_field
+        if field is None or field in (exclude or ()):
+            return
+        if type(self).objects.filter(**{field: getattr(self, field)}).exclude(pk=self.pk).exists():
+            raise ValidationError({field: self.unique_error_message(type(self), (field,))})
+
+    def soft_delete(self):
+        settings = MovieSessionSettings.all_objects.filter(**{self.settings_lookup: self.pk})
+        with transaction.atomic():
+            type(self).all_objects.filter(pk=self.pk).update(deleted=True)
+            movies = set(settings.values_list('movie_id', flat=True))
+            settings.update(deleted=True)
+            # updates send no signals, so versions are bumped here
+            versions.changed(type(self), MovieSessionSettings,
+                             *(versions.scoped(MovieSessionSettings, movie) for movie in movies))
+            transaction.on_commit(lambda: current_app.send_task('staff.tasks.purge_deleted'))
+        self.deleted = True
+
+
 class Genre(models.Model):
     name = models.CharField(max_length=100, unique=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
 
-class Movie(models.Model):
-    title = models.CharField(max_length=300, unique=True)
+class Movie(SoftDeleteMixin, models.Model):
+    title = models.CharField(max_length=300, db_index=True)
     genres = models.ManyToManyField(Genre)
     description = models.TextField()
     director = models.CharField(max_length=100)
@@ -32,18 +81,39 @@ class Movie(models.Model):
     img_small = models.ImageField(upload_to='img/%Y/%m/%d', blank=True, null=True)
     age_policy = models.PositiveSmallIntegerField(choices=AGE_CHOICES, default=1)
     advertised = models.BooleanField(default=False)
+    # customers queue before booking any of its sessions
+    waiting_room = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    deleted = models.BooleanField(default=False, editable=False)
+
+    objects = VisibleManager()
+    all_objects = models.Manager()
+    settings_lookup = 'movie_id'
+    unique_field = 'title'
 
     class Meta:
         ordering = ['title']
+        constraints = [models.UniqueConstraint(fields=['title'], condition=Q(deleted=False),
+                                               name='unique_movie_title')]
 
     def __str__(self):
         return self.title
 
 
-class Hall(models.Model):
-    name = models.CharField(max_length=100, unique=True)
+class Hall(SoftDeleteMixin, models.Model):
+    name = models.CharField(max_length=100, db_index=True)
     sits_rows = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
     sits_cols = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
+    updated_at = models.DateTimeField(auto_now=True)
+    deleted = models.BooleanField(default=False, editable=False)
+
+    objects = VisibleManager()
+    all_objects = models.Manager()
+    settings_lookup = 'hall_id'
+    unique_field = 'name'
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['name'], condition=Q(deleted=False), name='unique_hall_name')]
 
     @property
     def hall_capacity(self):
@@ -53,31 +123,118 @@ class Hall(models.Model):
         return f'{self.name} {self.hall_capacity} sits'
 
 
+class MovieSessionQuerySet(models.QuerySet):
+    def with_seat_counts(self):
+        """sold_seats and free_seats of every session in the same query, without reading sits"""
+        # a grouped subquery keeps the outer query ungrouped, so ordering and other joins stay as they are
+        sold = Ticket.objects.filter(order__session=OuterRef('pk')).order_by().values('order__session')\
+            .annotate(count=Count('pk')).values('count')
+        return self.annotate(sold_seats=Coalesce(Subquery(sold), 0))\
+            .annotate(free_seats=F('settings__hall__sits_rows') * F('settings__hall__sits_cols') - F('sold_seats'))
+
+
+class VisibleSessionManager(models.Manager):
+    """Sessions of session settings which are not deleted"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(settings__deleted=False)
+
+
 class MovieSession(models.Model):
     settings = models.ForeignKey('MovieSessionSettings', on_delete=CASCADE)
-    date = models.DateField()
+    date = models.DateField(db_index=True)
+    archived = models.BooleanField(default=False)
+
+    objects = VisibleSessionManager.from_queryset(MovieSessionQuerySet)()
+    all_objects = MovieSessionQuerySet.as_manager()
 
     class Meta:
-        ordering = ['date']
+        ordering = ['date', 'id']
+        constraints = [models.UniqueConstraint(fields=['settings', 'date'], name='unique_session_per_settings_date')]
 
     @property
     def free_sits(self):
-        return Sit.objects.filter(session=self, order__isnull=True)
+        return Sit.objects.filter(session=self, ticket__isnull=True)
 
     @property
     def free_sits_number(self):
         return len(self.free_sits)
 
+    @property
+    def waiting_room(self):
+        return self.settings.waiting_room or self.settings.movie.waiting_room
+
     @property
     def sold(self):
-         return self.settings.hall.hall_capacity - self.free_sits_number
+        # tickets keep sit numbers, so it is counted right for archived sessions without sits as well
+        return Ticket.objects.filter(order__session=self).count()
 
     def __str__(self):
         return f'{self.settings.hall.name}: {self.date} ' \
                f'{self.settings.time_start} - "{self.settings.movie.title[:20]}..."'
 
 
-class MovieSessionSettings(models.Model):
+def sessions_horizon():
+    """Last day sessions and sits are created for in advance"""
+    return timezone.now().date() + timezone.timedelta(days=SESSIONS_HORIZON_DAYS)
+
+
+def sessions_on_demand_limit():
+    """Last day sessions are created for when a client asks beyond the horizon"""
+    return timezone.now().date() + timezone.timedelta(days=SESSIONS_ON_DEMAND_MAX_DAYS)
+
+
+def as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+class MovieSessionSettingsQuerySet(models.QuerySet):
+    def pending(self, until):
+        """Settings which have days without sessions up to `until`"""
+        return self.filter(Q(generated_until__isnull=True) | Q(generated_until__lt=until),
+                           Q(generated_until__isnull=True) | Q(generated_until__lt=F('date_end')))
+
+    def materialize(self, until):
+        """Create missing sessions up to `until` for settings which are not generated so far yet"""
+        for pk in self.pending(until).values_list('pk', flat=True):
+            with transaction.atomic():
+                # locked and read again, so concurrent calls and the generating task do not create a day twice
+                setting = MovieSessionSettings.all_objects.select_for_update(of=('self',)).select_related('hall')\
+                    .filter(pk=pk).first()
+                if setting is not None:
+                    setting.generate_sessions(until)
+
+    def requested(self):
+        """Settings with days requested beyond the horizon which have no sessions yet"""
+        return self.filter(Q(generated_until__isnull=True) | Q(generated_until__lt=F('requested_until')),
+                           Q(generated_until__isnull=True) | Q(generated_until__lt=F('date_end')),
+                           requested_until__isnull=False)
+
+    def materialize_on_demand(self, until):
+        """
+        Sessions asked for beyond the horizon up to `until`, at most SESSIONS_ON_DEMAND_MAX_DAYS ahead.
+        Up to SESSIONS_GENERATE_INLINE_MAX_SITS sits are created right away, more are requested from
+        the materialize_sessions task. Last day all sessions up to `until` are there for.
+        """
+        limit = min(until, sessions_on_demand_limit())
+        pending = list(self.pending(limit).select_related('hall'))
+        if sum(setting.pending_sits(limit) for setting in pending) <= SESSIONS_GENERATE_INLINE_MAX_SITS:
+            if pending:
+                MovieSessionSettings.objects.filter(pk__in=[setting.pk for setting in pending]).materialize(limit)
+            complete = limit
+        else:
+            # raised only once per day asked for, so other requests queue nothing meanwhile
+            if MovieSessionSettings.objects.filter(pk__in=[setting.pk for setting in pending])\
+                    .filter(Q(requested_until__isnull=True) | Q(requested_until__lt=limit))\
+                    .update(requested_until=limit):
+                transaction.on_commit(lambda: current_app.send_task('staff.tasks.materialize_sessions'))
+            complete = min(setting.pending_days(limit)[0] for setting in pending) - timezone.timedelta(days=1)
+        if complete == limit < until and not self.pending(until).exists():
+            complete = until
+        return complete
+
+
+class MovieSessionSettings(SoftDeleteMixin, models.Model):
     hall = models.ForeignKey(Hall, on_delete=CASCADE)
     movie = models.ForeignKey(Movie, on_delete=CASCADE)
     date_start = models.DateField(default=timezone.now)
@@ -85,21 +242,126 @@ class MovieSessionSettings(models.Model):
     time_start = models.TimeField()
     time_end = models.TimeField()
     price = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
+    generated_until = models.DateField(blank=True, null=True, editable=False)
+    # last day clients asked for beyond the horizon, the materialize_sessions task generates sessions up to it
+    requested_until = models.DateField(blank=True, null=True, editable=False)
+    # sessions of large schedules are generated in the background, see schedule_sessions()
+    generating = models.BooleanField(default=False, editable=False)
+    # customers queue before booking these sessions, the queue is shared by the whole movie
+    waiting_room = models.BooleanField(default=False)
+    deleted = models.BooleanField(default=False, editable=False)
+
+    objects = VisibleManager.from_queryset(MovieSessionSettingsQuerySet)()
+    all_objects = MovieSessionSettingsQuerySet.as_manager()
+    settings_lookup = 'pk'
 
     class Meta:
         ordering = ['-date_start']
 
     def save(self, **kwargs):
-        if self.id:
-            MovieSession.objects.filter(settings=self).delete()
-        super().save(**kwargs)
-        delta = self.date_end - self.date_start
-        for day in range(delta.days + 1):
-            session = MovieSession.objects.create(settings=self, date=self.date_start + timezone.timedelta(days=day))
-            seats = []
-            for sit in range(1, self.hall.hall_capacity + 1):
-                seats.append(Sit(session=session, number=sit))
-            Sit.objects.bulk_create(seats)
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                # locked, so the generating task does not add sessions in the middle of the update
+                previous = MovieSessionSettings.objects.select_for_update().filter(pk=self.pk) \
+                    .values('movie_id', 'hall_id', 'date_start', 'generated_until', 'requested_until', 'generating')\
+                    .first()
+            # moved settings change the timeline of the previous movie too, see cinema.signals
+            self._previous_movie_id = previous and previous['movie_id']
+            if previous is not None:
+                self.generated_until = previous['generated_until']
+                self.requested_until = previous['requested_until']
+                self.generating = previous['generating']
+            super().save(**kwargs)
+            if previous is not None:
+                self.update_sessions(previous)
+            self.schedule_sessions(sessions_horizon())
+
+    def update_sessions(self, previous):
+        """
+        Fit generated sessions to edited settings: days out of the new dates are dropped, days before
+        the previous start are added and sits follow the hall capacity. Price and time edits touch nothing.
+        """
+        start, end = as_date(self.date_start), as_date(self.date_end)
+        MovieSession.objects.filter(settings=self).exclude(date__range=(start, end)).delete()
+
+        if self.hall_id != previous['hall_id']:
+            old_capacity = Hall.objects.get(pk=previous['hall_id']).hall_capacity
+            capacity = self.hall.hall_capacity
+            if capacity < old_capacity:
+                Sit.objects.filter(session__settings=self, number__gt=capacity).delete()
+            elif capacity > old_capacity:
+                Sit.objects.bulk_create([Sit(session_id=session, number=number)
+                                         for session in MovieSession.objects.filter(settings=self)
+                                         .values_list('pk', flat=True)
+                                         for number in range(old_capacity + 1, capacity + 1)])
+
+        generated_until = self.generated_until
+        if generated_until is not None and generated_until >= start:
+            old_start = as_date(previous['date_start'])
+            if start < old_start:
+                self.create_sessions(start, min(old_start - timezone.timedelta(days=1), end))
+            generated_until = min(generated_until, end)
+        else:
+            generated_until = None
+        if generated_until != self.generated_until:
+            MovieSessionSettings.objects.filter(pk=self.pk).update(generated_until=generated_until)
+            self.generated_until = generated_until
+
+    @property
+    def generation_progress(self):
+        """Share of the days up to the horizon which have sessions"""
+        first, last = as_date(self.date_start), min(as_date(self.date_end), sessions_horizon())
+        if first > last or (self.generated_until is not None and self.generated_until >= last):
+            return 1.0
+        if self.generated_until is None:
+            return 0.0
+        return ((self.generated_until - first).days + 1) / ((last - first).days + 1)
+
+    def pending_days(self, until):
+        """First and last day to generate sessions for up to `until`, first is after last when nothing is left"""
+        first = as_date(self.date_start) if self.generated_until is None \
+            else self.generated_until + timezone.timedelta(days=1)
+        return first, min(as_date(self.date_end), until)
+
+    def pending_sits(self, until):
+        """Number of sits to create for the sessions up to `until`"""
+        first, last = self.pending_days(until)
+        return max(0, (last - first).days + 1) * self.hall.hall_capacity
+
+    def schedule_sessions(self, until):
+        """Generate sessions up to `until` right away or, for large schedules, by the background task"""
+        sits = self.pending_sits(until)
+        if not sits:
+            return
+        if sits <= SESSIONS_GENERATE_INLINE_MAX_SITS:
+            self.generate_sessions(until)
+            return
+        if self.generating:
+            # the running task reads pending days again for every batch, it takes the new ones as well
+            return
+
+        MovieSessionSettings.objects.filter(pk=self.pk).update(generating=True)
+        self.generating = True
+        # sent after commit, so the task finds the settings
+        transaction.on_commit(lambda: current_app.send_task('staff.tasks.generate_settings_sessions', args=[self.pk]))
+
+    def generate_sessions(self, until):
+        """Sessions with their sits from the last generated day to `until`, the rest is left for later"""
+        first, last = self.pending_days(until)
+        if first > last:
+            return
+
+        self.create_sessions(first, last)
+        MovieSessionSettings.objects.filter(pk=self.pk).update(generated_until=last)
+        self.generated_until = last
+        versions.changed(versions.scoped(MovieSessionSettings, self.movie_id), MovieSession)
+
+    def create_sessions(self, first, last):
+        sessions = MovieSession.objects.bulk_create([MovieSession(settings=self, date=first + timezone.timedelta(days=day))
+                                                     for day in range((last - first).days + 1)])
+        Sit.objects.bulk_create([Sit(session=session, number=number)
+                                 for session in sessions for number in range(1, self.hall.hall_capacity + 1)])
 
     def __str__(self):
         return f'{self.movie} ({self.hall.name}) {self.date_start} to ' \
@@ -121,16 +383,64 @@ class CinemaUser(AbstractUser):
         return f'{self.first_name or self.email}'
 
 
+class OrderManager(models.Manager):
+    def place(self, customer, session, sits):
+        """One order row per purchase, its tickets capture sit numbers and current price"""
+        with transaction.atomic():
+            order = self.create(customer=customer, session=session)
+            Ticket.objects.bulk_create([Ticket(order=order, sit=sit, number=sit.number, price=session.settings.price)
+                                        for sit in sits])
+        return order
+
+
 class Order(models.Model):
     customer = models.ForeignKey(CinemaUser, on_delete=CASCADE)
-    datetime = models.DateTimeField(auto_now=True)
-    sits = models.ForeignKey('Sit', on_delete=CASCADE)
+    datetime = models.DateTimeField(auto_now_add=True)
+    session = models.ForeignKey(MovieSession, on_delete=CASCADE)
+
+    objects = OrderManager()
 
     class Meta:
         ordering = ['datetime']
 
+    @property
+    def sits(self):
+        return [ticket.number for ticket in self.ticket_set.all()]
+
+    @property
+    def total(self):
+        return sum(ticket.price for ticket in self.ticket_set.all())
+
     def __str__(self):
-        return f'{self.customer} #{self.sits.number} for {self.datetime}'
+        return f'{self.customer} #{", ".join(map(str, self.sits))} for {self.datetime}'
+
+
+class Ticket(models.Model):
+    order = models.ForeignKey(Order, on_delete=CASCADE)
+    sit = models.OneToOneField('Sit', on_delete=models.SET_NULL, null=True, blank=True)
+    number = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
+    price = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
+
+    class Meta:
+        ordering = ['number']
+
+    def __str__(self):
+        return f'#{self.number} {self.price}$'
+
+
+class IdempotencyKey(models.Model):
+    customer = models.ForeignKey(CinemaUser, on_delete=CASCADE)
+    key = models.CharField(max_length=100)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response = models.JSONField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ['customer', 'key']
+
+    def __str__(self):
+        return f'{self.customer} {self.key} ({self.status_code})'
 
 
 class Sit(models.Model):
@@ -139,3 +449,121 @@ class Sit(models.Model):
 
     class Meta:
         unique_together = ['session', 'number']
+
+
+class DailySalesWatermark(models.Model):
+    """Id of the last order counted into DailySales, a single row"""
+    last_order = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'Sales counted up to order {self.last_order}'
+
+
+class DailySalesQuerySet(models.QuerySet):
+    def rollup(self):
+        """Count orders placed since the previous run into the rollup, number of new orders"""
+        with transaction.atomic():
+            watermark, _ = DailySalesWatermark.objects.select_for_update().get_or_create(pk=1)
+            # orders of the last minute may still be committing under lower ids, they are left for the next run
+            # together with all orders after the first of them, so the watermark never passes an uncounted order
+            orders = Order.objects.filter(pk__gt=watermark.last_order)
+            first_recent = orders.filter(datetime__gte=timezone.now() - timezone.timedelta(minutes=1))\
+                .aggregate(first=Min('pk'))['first']
+            if first_recent is not None:
+                orders = orders.filter(pk__lt=first_recent)
+            last = orders.aggregate(last=Max('pk'))['last']
+            if last is None:
+                return 0
+            orders = orders.filter(pk__lte=last)
+
+            sales = Ticket.objects.filter(order__in=orders)\
+                .values(day=F('order__session__date'), hall=F('order__session__settings__hall'),
+                        movie=F('order__session__settings__movie'))\
+                .annotate(sold=Count('pk'), income=Sum('price')).order_by()
+            halls = Hall.objects.in_bulk({row['hall'] for row in sales})
+            for row in sales:
+                key = {'date': row['day'], 'hall_id': row['hall'], 'movie_id': row['movie']}
+                sessions = MovieSession.objects.filter(date=row['day'], settings__hall=row['hall'],
+                                                       settings__movie=row['movie']).count()
+                capacity = sessions * halls[row['hall']].hall_capacity
+                updated = self.filter(**key).update(tickets=F('tickets') + row['sold'],
+                                                    revenue=F('revenue') + row['income'],
+                                                    capacity=capacity)
+                if not updated:
+                    self.create(**key, tickets=row['sold'], revenue=row['income'], capacity=capacity)
+
+            counted = orders.count()
+            watermark.last_order = last
+            watermark.save()
+        return counted
+
+    def totals(self, by='date'):
+        """Sums of tickets, revenue and capacity per value of `by`: 'date', 'hall', 'movie__title' etc."""
+        return self.values(by).order_by(by).annotate(total_tickets=Sum('tickets'),
+                                                     total_revenue=Sum('revenue'),
+                                                     total_capacity=Sum('capacity'))
+
+
+def occupancy(tickets, capacity):
+    return round(100 * tickets / capacity, 1) if capacity else 0
+
+
+class DailySales(models.Model):
+    """Tickets sold and revenue per session date, hall and movie, filled by staff.tasks.rollup_daily_sales"""
+    date = models.DateField()
+    hall = models.ForeignKey(Hall, on_delete=CASCADE)
+    movie = models.ForeignKey(Movie, on_delete=CASCADE)
+    tickets = models.PositiveIntegerField(default=0)
+    revenue = models.PositiveBigIntegerField(default=0)
+    # sits of all sessions of the movie in the hall that day
+    capacity = models.PositiveIntegerField(default=0)
+
+    objects = DailySalesQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['date', 'hall', 'movie']
+        unique_together = ['date', 'hall', 'movie']
+        verbose_name_plural = 'daily sales'
+
+    @property
+    def occupancy(self):
+        return occupancy(self.tickets, self.capacity)
+
+    def __str__(self):
+        return f'{self.date} {self.hall.name} "{self.movie.title[:20]}": {self.tickets} tickets, {self.revenue}$'
+
+
+class RequestProfileManager(models.Manager):
+    def record(self, **fields):
+        """Save a report, the oldest ones over PROFILING_MAX_REPORTS are dropped"""
+        profile = self.create(**fields)
+        stale = self.order_by('-pk').values_list('pk', flat=True)[PROFILING_MAX_REPORTS:]
+        self.filter(pk__in=list(stale)).delete()
+        return profile
+
+
+class RequestProfile(models.Model):
+    """cProfile stats and SQL timeline of one request, saved by cinema.middlewares.ProfilingMiddleware"""
+    created = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=2048)
+    route = models.CharField(max_length=100, blank=True)
+    user = models.ForeignKey(CinemaUser, on_delete=models.SET_NULL, blank=True, null=True)
+    # profiled by PROFILING_SAMPLE_RATE, not asked for
+    sampled = models.BooleanField(default=False)
+    status_code = models.PositiveSmallIntegerField()
+    # milliseconds
+    duration = models.FloatField()
+    sql_duration = models.FloatField()
+    query_count = models.PositiveIntegerField()
+    stats = models.TextField()
+    # [{"start": ms since the request began, "duration": ms, "sql": ...}, ...]
+    queries = models.JSONField(default=list)
+
+    objects = RequestProfileManager()
+
+    class Meta:
+        ordering = ['-created']
+
+    def __str__(self):
+        return f'{self.method} {self.path} ({self.duration:.0f} ms, {self.query_count} queries)'
@@ -0,0 +1,8 @@
+from django.urls import re_path
+
+from cinema.consumers import WaitingRoomConsumer
+
+
+websocket_urlpatterns = [
+    re_path(r'ws/waiting-room/(?P<movie_id>\d+)/$', WaitingRoomConsumer.as_asgi()),
+]
@@ -0,0 +1,43 @@
+from celery.signals import before_task_publish, task_postrun, task_prerun
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from cinema import tracing, versions
+from cinema.models import Genre, Hall, Movie, MovieSessionSettings
+
+# collections changed by saving or deleting a row of the model, movies are served with their genres;
+# receivers are connected per model, so deletes of other models stay fast deletes
+VERSIONED_MODELS = {
+    Genre: (Genre, Movie),
+    Hall: (Hall,),
+    Movie: (Movie,),
+    MovieSessionSettings: (MovieSessionSettings,),
+}
+
+
+def bump_versions(sender, **kwargs):
+    versions.changed(*VERSIONED_MODELS[sender])
+
+
+def bump_movie_genres(sender, action, **kwargs):
+    if action.startswith('post_'):
+        versions.changed(Movie)
+
+
+def bump_movie_timeline(sender, instance, **kwargs):
+    # settings moved to another movie change the timelines of both movies
+    movies = {instance.movie_id, getattr(instance, '_previous_movie_id', None)} - {None}
+    versions.changed(*(versions.scoped(MovieSessionSettings, movie_id) for movie_id in movies))
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(bump_versions, sender=model, dispatch_uid=f'versions-save-{model._meta.label_lower}')
+    post_delete.connect(bump_versions, sender=model, dispatch_uid=f'versions-delete-{model._meta.label_lower}')
+m2m_changed.connect(bump_movie_genres, sender=Movie.genres.through, dispatch_uid='versions-movie-genres')
+post_save.connect(bump_movie_timeline, sender=MovieSessionSettings, dispatch_uid='versions-save-timeline')
+post_delete.connect(bump_movie_timeline, sender=MovieSessionSettings, dispatch_uid='versions-delete-timeline')
+
+connection_created.connect(tracing.install_query_spans)
+before_task_publish.connect(tracing.inject_task_headers)
+task_prerun.connect(tracing.start_task_trace)
+task_postrun.connect(tracing.finish_task_trace)
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+
+from cinema.booking import check_seats, find_best_seats
+from cinema.models import MovieSession, MovieSessionSettings, Order, Sit
+from cinema.tests.factories import HallFactory, MovieFactory, UserFactory
+
+
+class FindBestSeatsTest(TestCase):
+    def setUp(self):
+        self.hall = HallFactory(sits_rows=6, sits_cols=5)
+
+    def test_empty_hall_center(self):
+        self.assertEqual(find_best_seats(self.hall, set(), 2), [15, 16])
+
+    def test_taken_center_moves_inside_row(self):
+        self.assertEqual(find_best_seats(self.hall, {14, 15, 16}, 2), [17, 18])
+
+    def test_full_row_moves_to_next_row(self):
+        self.assertEqual(find_best_seats(self.hall, set(range(13, 19)), 4), [8, 9, 10, 11])
+
+    def test_no_contiguous_block(self):
+        taken = {number for number in range(1, 31) if number % 3 == 0}
+        self.assertIsNone(find_best_seats(self.hall, taken, 3))
+
+    def test_more_than_row(self):
+        self.assertIsNone(find_best_seats(self.hall, set(), 7))
+
+
+class CheckSeatsTest(TestCase):
+    def setUp(self):
+        hall = HallFactory(sits_rows=5, sits_cols=2)
+        hall.save()
+        movie = MovieFactory()
+        movie.save()
+        setting = MovieSessionSettings(hall=hall,
+                                       movie=movie,
+                                       price=20,
+                                       date_start=(datetime.now().date() - timedelta(days=1)),
+                                       date_end=(datetime.now().date() + timedelta(days=1)),
+                                       time_start='18:00',
+                                       time_end='21:00')
+        setting.save()
+        self.session = MovieSession.objects.select_related('settings__hall') \
+            .get(settings=setting, date=datetime.now().date() + timedelta(days=1))
+        self.past_session = MovieSession.objects.get(settings=setting, date=datetime.now().date() - timedelta(days=1))
+        customer = UserFactory()
+        customer.save()
+        Order.objects.place(customer, self.session, Sit.objects.filter(session=self.session, number__in=[5, 6]))
+
+    def test_free_seats_in_one_query(self):
+        with self.assertNumQueries(1):
+            conflicts = check_seats(self.session, numbers=[1, 2, 3])
+        self.assertFalse(conflicts)
+
+    def test_conflicts(self):
+        conflicts = check_seats(self.session, numbers=[1, 1, 5, 11, 'x'])
+        self.assertTrue(conflicts)
+        self.assertEqual(conflicts.as_dict(), {'expired': False, 'duplicated': [1], 'out_of_range': [11, 'x'],
+                                               'taken': [5], 'suggestions': [4, 3, 7, 2, 8]})
+        self.assertEqual([code for code, _ in conflicts.messages()],
+                         ['duplicated', 'out_of_range', 'taken', 'suggestions'])
+
+    def test_sit_ids_of_other_session(self):
+        own = Sit.objects.get(session=self.session, number=6)
+        other = Sit.objects.filter(session=self.past_session).first()
+        conflicts = check_seats(self.session, sit_ids=[str(own.pk), str(other.pk)])
+        self.assertEqual((conflicts.taken, conflicts.out_of_range), ([6], [other.pk]))
+
+    def test_expired_session(self):
+        self.assertTrue(check_seats(self.past_session, numbers=[1]).expired)
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+
+from cinema.facets import normalize, schedule_facets
+from cinema.models import MovieSessionSettings
+from cinema.tests.factories import HallFactory, MovieFactory
+
+
+class ScheduleFacetsTest(TestCase):
+    def setUp(self):
+        self.today = datetime.now().date()
+        self.hall = HallFactory(sits_rows=2, sits_cols=2)
+        self.hall.save()
+        self.hall_other = HallFactory(sits_rows=2, sits_cols=2)
+        self.hall_other.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+        self.movie_other = MovieFactory()
+        self.movie_other.save()
+        self.setting = self.settings(self.hall, self.movie, days=3)
+        self.settings(self.hall_other, self.movie, days=1)
+        self.settings(self.hall_other, self.movie_other, days=2)
+
+    def settings(self, hall, movie, days):
+        setting = MovieSessionSettings(hall=hall, movie=movie, price=20,
+                                       date_start=self.today + timedelta(days=1),
+                                       date_end=self.today + timedelta(days=days),
+                                       time_start='18:00', time_end='21:00')
+        setting.save()
+        return setting
+
+    def test_counts(self):
+        facets = schedule_facets({})
+        # ordered by titles and names, which come from factory sequences
+        self.assertEqual([(movie['title'], movie['sessions']) for movie in facets['movies']],
+                         sorted([(self.movie.title, 4), (self.movie_other.title, 2)]))
+        self.assertEqual([(hall['name'], hall['sessions']) for hall in facets['halls']],
+                         sorted([(self.hall.name, 3), (self.hall_other.name, 3)]))
+        self.assertEqual(facets['dates'], [{'date': (self.today + timedelta(days=day)).isoformat(), 'sessions': count}
+                                           for day, count in ((1, 3), (2, 2), (3, 1))])
+
+    def test_filtered(self):
+        facets = schedule_facets(normalize({'hall': self.hall_other.name,
+                                            'date_end': str(self.today + timedelta(days=1))}))
+        self.assertEqual([(movie['id'], movie['sessions']) for movie in facets['movies']],
+                         [(self.movie.pk, 1), (self.movie_other.pk, 1)])
+        self.assertEqual([hall['id'] for hall in facets['halls']], [self.hall_other.pk])
+
+    def test_one_query_cached_until_schedule_changes(self):
+        with self.assertNumQueries(1):
+            schedule_facets({'movie': self.movie.title})
+        with self.assertNumQueries(0):
+            self.assertEqual(schedule_facets({'movie': self.movie.title})['movies'][0]['sessions'], 4)
+
+        self.setting.date_end = self.today + timedelta(days=1)
+        self.setting.save()
+        self.assertEqual(schedule_facets({'movie': self.movie.title})['movies'][0]['sessions'], 2)
+
+    def test_normalize(self):
+        self.assertEqual(normalize({'hall': ' red ', 'movie': '', 'time_start': '9:05', 'date_start': '2022-7-5'}),
+                         {'hall': 'red', 'time_start': '09:05:00', 'date_start': '2022-07-05'})
+        self.assertEqual(normalize({'date_end': '2022-02-30', 'date_start': 'tomorrow', 'time_end': '25:00',
+                                    'other': 'x'}), {})
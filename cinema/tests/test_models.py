@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+
+from cinema.models import MovieSession, MovieSessionSettings, Order, Sit
+from cinema.tests.factories import UserFactory, HallFactory, MovieFactory
+
+
+class SeatCountsTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.user.save()
+        hall = HallFactory(sits_rows=3, sits_cols=2)
+        hall.save()
+        movie = MovieFactory()
+        movie.save()
+        self.setting = MovieSessionSettings(hall=hall,
+                                            movie=movie,
+                                            price=20,
+                                            date_start=datetime.now().date(),
+                                            date_end=(datetime.now().date() + timedelta(days=2)),
+                                            time_start='18:00',
+                                            time_end='21:00')
+        self.setting.save()
+        self.sessions = list(MovieSession.objects.filter(settings=self.setting))
+        first = self.sessions[0]
+        Order.objects.place(self.user, first, Sit.objects.filter(session=first, number__in=[1, 2]))
+        Order.objects.place(self.user, first, Sit.objects.filter(session=first, number=5))
+
+    def test_counts_match_sits(self):
+        sessions = MovieSession.objects.filter(settings=self.setting).with_seat_counts()
+        self.assertEqual([(session.sold_seats, session.free_seats) for session in sessions],
+                         [(3, 3), (0, 6), (0, 6)])
+        for session in sessions:
+            self.assertEqual(session.free_seats, session.free_sits_number)
+
+    def test_one_query(self):
+        with self.assertNumQueries(1):
+            list(MovieSession.objects.filter(settings=self.setting).with_seat_counts())
+
+    def test_keeps_ordering(self):
+        sessions = MovieSession.objects.filter(settings=self.setting)
+        self.assertEqual(list(sessions.with_seat_counts()), list(sessions))
+
+
+class SessionsUpdateTest(TestCase):
+    def setUp(self):
+        self.today = datetime.now().date()
+        self.hall = HallFactory(sits_rows=3, sits_cols=2)
+        self.hall.save()
+        movie = MovieFactory()
+        movie.save()
+        self.setting = MovieSessionSettings(hall=self.hall,
+                                            movie=movie,
+                                            price=20,
+                                            date_start=self.today + timedelta(days=2),
+                                            date_end=self.today + timedelta(days=4),
+                                            time_start='18:00',
+                                            time_end='21:00')
+        self.setting.save()
+        self.sessions = dict(MovieSession.objects.filter(settings=self.setting).values_list('date', 'pk'))
+
+    def dates(self):
+        return dict(MovieSession.objects.filter(settings=self.setting).values_list('date', 'pk'))
+
+    def test_price_and_time_keep_sessions(self):
+        self.setting.price = 30
+        self.setting.time_end = '22:00'
+        self.setting.save()
+        self.assertEqual(self.dates(), self.sessions)
+        self.assertEqual(Sit.objects.filter(session__settings=self.setting).count(), 18)
+
+    def test_changed_dates(self):
+        self.setting.date_start = self.today + timedelta(days=1)
+        self.setting.date_end = self.today + timedelta(days=3)
+        self.setting.save()
+        dates = self.dates()
+        self.assertEqual(sorted(dates), [self.today + timedelta(days=day) for day in (1, 2, 3)])
+        self.assertEqual(dates[self.today + timedelta(days=2)], self.sessions[self.today + timedelta(days=2)])
+        self.assertEqual(self.setting.generated_until, self.today + timedelta(days=3))
+
+        self.setting.date_end = self.today + timedelta(days=5)
+        self.setting.save()
+        self.assertEqual(len(self.dates()), 5)
+        self.assertEqual(Sit.objects.filter(session__settings=self.setting).count(), 30)
+
+    def test_moved_past_generated_days(self):
+        self.setting.date_start = self.today + timedelta(days=6)
+        self.setting.date_end = self.today + timedelta(days=7)
+        self.setting.save()
+        self.assertEqual(sorted(self.dates()), [self.today + timedelta(days=6), self.today + timedelta(days=7)])
+
+    def test_hall_capacity(self):
+        smaller = HallFactory(sits_rows=2, sits_cols=2)
+        smaller.save()
+        self.setting.hall = smaller
+        self.setting.save()
+        self.assertEqual(self.dates(), self.sessions)
+        self.assertEqual(set(Sit.objects.filter(session__settings=self.setting).values_list('number', flat=True)),
+                         {1, 2, 3, 4})
+
+        self.setting.hall = self.hall
+        self.setting.save()
+        self.assertEqual(Sit.objects.filter(session__settings=self.setting).count(), 18)
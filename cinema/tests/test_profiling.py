@@ -0,0 +1,82 @@
+from unittest import mock
+
+from django.test import TestCase, Client
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from cinema.models import RequestProfile
+from cinema.tests.factories import UserFactory, SuperUserFactory, GenreFactory
+
+
+class ProfilingMiddlewareTest(TestCase):
+    def setUp(self):
+        self.admin = SuperUserFactory()
+        self.admin.save()
+        self.customer = UserFactory()
+        self.customer.save()
+        GenreFactory().save()
+
+    def test_superuser_profiles_a_page(self):
+        c = Client()
+        c.force_login(self.admin)
+        response = c.get('/schedule/?profile=1')
+        self.assertEqual(response.status_code, 200)
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual((profile.method, profile.path, profile.route), ('GET', '/schedule/?profile=1', 'schedule'))
+        self.assertEqual(profile.user, self.admin)
+        self.assertFalse(profile.sampled)
+        self.assertIn('cumulative', profile.stats)
+        self.assertEqual(profile.query_count, len(profile.queries))
+        self.assertTrue(profile.queries)
+        self.assertEqual(sorted(profile.queries[0]), ['duration', 'sql', 'start'])
+
+    def test_superuser_profiles_an_api_call_by_token(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.admin).key}')
+        response = client.get('/api/genres/', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(RequestProfile.objects.get().route, 'genre-list')
+
+    def test_rejected_for_others(self):
+        c = Client()
+        self.assertEqual(c.get('/schedule/?profile=1').status_code, 403)
+        c.force_login(self.customer)
+        self.assertEqual(c.get('/schedule/', HTTP_X_PROFILE='1').status_code, 403)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token forged')
+        self.assertEqual(client.get('/api/genres/?profile=1').status_code, 403)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_sampled_routes(self):
+        c = Client()
+        with mock.patch('cinema.middlewares.PROFILING_SAMPLE_RATE', 1):
+            c.get('/contact/')
+            self.assertFalse(RequestProfile.objects.exists())
+            c.get('/schedule/')
+        profile = RequestProfile.objects.get()
+        self.assertTrue(profile.sampled)
+        self.assertIsNone(profile.user)
+
+    def test_oldest_reports_dropped(self):
+        c = Client()
+        c.force_login(self.admin)
+        with mock.patch('cinema.models.PROFILING_MAX_REPORTS', 2):
+            for _ in range(3):
+                c.get('/contact/?profile=1')
+        self.assertEqual(RequestProfile.objects.count(), 2)
+
+    def test_staff_reads_reports(self):
+        c = Client()
+        c.force_login(self.admin)
+        c.get('/schedule/?profile=1')
+        profile = RequestProfile.objects.get()
+
+        response = c.get('/staff/main/profiles/')
+        self.assertEqual(list(response.context['object_list']), [profile])
+        response = c.get(f'/staff/main/profiles/{profile.pk}/')
+        self.assertContains(response, 'SQL timeline')
+        self.assertContains(response, 'cumulative')
+
+        c.force_login(self.customer)
+        self.assertEqual(c.get(f'/staff/main/profiles/{profile.pk}/').status_code, 403)
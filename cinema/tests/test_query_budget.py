@@ -0,0 +1,251 @@
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from django.db import connection
+from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from cinema import throttling, versions
+from cinema.models import DailySales, MovieSession, MovieSessionSettings, Order, RequestProfile
+from cinema.booking import book_best_seats
+from cinema.tests.factories import UserFactory, SuperUserFactory, GenreFactory, MovieFactory, HallFactory
+
+PASSWORD = 'topsecret007'
+
+# (label, url name, who asks, method, path, data), paths are formatted with ids of the first rows
+CASES = [
+    ('index', 'index', 'anonymous', 'get', '/', None),
+    ('login', 'login', 'anonymous', 'get', '/login/', None),
+    ('register', 'register', 'anonymous', 'get', '/register/', None),
+    ('logout', 'logout', 'customer', 'get', '/logout/', None),
+    ('account', 'account', 'customer', 'get', '/account/', None),
+    ('schedule', 'schedule', 'anonymous', 'get', '/schedule/', None),
+    ('contact', 'contact', 'anonymous', 'get', '/contact/', None),
+    ('about', 'about', 'anonymous', 'get', '/about/', None),
+    ('movie', 'movie', 'customer', 'get', '/movie/{movie}/', None),
+    ('waiting-room', 'waiting-room', 'customer', 'get', '/movie/{movie}/queue/?next=/', None),
+    ('session', 'session', 'customer', 'get', '/session/{session}/', None),
+    ('order', 'order', 'customer', 'post', '/order/', {'count': 2, 'session': '{session}'}),
+
+    ('main', 'main', 'admin', 'get', '/staff/main/', None),
+    ('genre', 'genre', 'admin', 'get', '/staff/main/genre/', None),
+    ('genre-create', 'genre-create', 'admin', 'post', '/staff/main/genre/create/', {'name': 'measured{run}'}),
+    ('genre-delete', 'genre-delete', 'admin', 'post', '/staff/main/genre/delete/{spare_genre}/', None),
+    ('genre-edit', 'genre-edit', 'admin', 'get', '/staff/main/genre/edit/{genre}/', None),
+    ('hall', 'hall', 'admin', 'get', '/staff/main/hall/', None),
+    ('hall-create', 'hall-create', 'admin', 'post', '/staff/main/hall/create/',
+     {'name': 'measured{run}', 'sits_rows': 2, 'sits_cols': 2}),
+    ('hall-delete', 'hall-delete', 'admin', 'post', '/staff/main/hall/delete/{spare_hall}/', None),
+    ('hall-edit', 'hall-edit', 'admin', 'get', '/staff/main/hall/edit/{hall}/', None),
+    ('allmovies', 'allmovies', 'admin', 'get', '/staff/main/movie-list/', None),
+    ('movie-create', 'movie-create', 'admin', 'get', '/staff/main/movie/create/', None),
+    ('movie-delete', 'movie-delete', 'admin', 'post', '/staff/main/movie/delete/{spare_movie}/', None),
+    ('movie-edit', 'movie-edit', 'admin', 'get', '/staff/main/movie/edit/{movie}/', None),
+    ('settings-list', 'settings-list', 'admin', 'get', '/staff/main/session-settings-list/', None),
+    ('settings-create', 'settings-create', 'admin', 'get', '/staff/main/session-settings/create/', None),
+    ('settings-delete', 'settings-delete', 'admin', 'post',
+     '/staff/main/session-settings/delete/{spare_setting}/', None),
+    ('settings-edit', 'settings-edit', 'admin', 'get', '/staff/main/session-settings/edit/{setting}/', None),
+    ('sessions-list', 'sessions-list', 'admin', 'get', '/staff/main/sessions-list/', None),
+    ('profiles', 'profiles', 'admin', 'get', '/staff/main/profiles/', None),
+    ('profile', 'profile', 'admin', 'get', '/staff/main/profiles/{profile}/', None),
+
+    ('api-generate-token', 'generate-token/', 'anonymous', 'post', '/api/generate-token/',
+     {'username': '{email}', 'password': PASSWORD}),
+    ('api-batch', 'batch/', 'customer', 'post', '/api/batch/', {'requests': ['/api/sessions/todays/']}),
+    ('api-genre-list', 'genre-list', 'customer', 'get', '/api/genres/', None),
+    ('api-genre-detail', 'genre-detail', 'customer', 'get', '/api/genres/{genre}/', None),
+    ('api-hall-list', 'hall-list', 'customer', 'get', '/api/halls/', None),
+    ('api-hall-detail', 'hall-detail', 'customer', 'get', '/api/halls/{hall}/', None),
+    ('api-movie-list', 'movie-list', 'customer', 'get', '/api/movies/', None),
+    ('api-movie-list-expanded', 'movie-list', 'customer', 'get', '/api/movies/?expand=genres', None),
+    ('api-movie-detail', 'movie-detail', 'customer', 'get', '/api/movies/{movie}/', None),
+    ('api-movie-queue', 'movie-queue', 'customer', 'get', '/api/movies/{movie}/queue/', None),
+    ('api-movie-sessions', 'movie-sessions', 'customer', 'get', '/api/movies/{movie}/sessions/', None),
+    ('api-session-list', 'moviesession-list', 'customer', 'get', '/api/sessions/', None),
+    ('api-session-availability', 'moviesession-availability', 'customer', 'get',
+     '/api/sessions/availability/?ids={session}', None),
+    ('api-session-todays', 'moviesession-todays', 'customer', 'get', '/api/sessions/todays/', None),
+    ('api-session-facets', 'moviesession-facets', 'customer', 'get', '/api/sessions/facets/', None),
+    ('api-session-detail', 'moviesession-detail', 'customer', 'get', '/api/sessions/{session}/', None),
+    ('api-settings-list', 'moviesessionsettings-list', 'admin', 'get', '/api/sessionsettings/', None),
+    ('api-settings-detail', 'moviesessionsettings-detail', 'admin', 'get', '/api/sessionsettings/{setting}/', None),
+    ('api-settings-generation', 'moviesessionsettings-generation', 'admin', 'get',
+     '/api/sessionsettings/{setting}/generation/', None),
+    ('api-order-list', 'order-list', 'customer', 'get', '/api/orders/', None),
+    ('api-order-list-admin', 'order-list', 'admin', 'get', '/api/orders/', None),
+    ('api-order-create', 'order-list', 'customer', 'post', '/api/orders/', {'count': 2, 'session': '{session}'}),
+    ('api-order-detail', 'order-detail', 'customer', 'get', '/api/orders/{order}/', None),
+    ('api-user-list', 'cinemauser-list', 'admin', 'get', '/api/users/', None),
+    ('api-user-detail', 'cinemauser-detail', 'customer', 'get', '/api/users/{customer}/', None),
+    ('api-sales-list', 'dailysales-list', 'admin', 'get', '/api/sales/', None),
+    ('api-sales-totals', 'dailysales-totals', 'admin', 'get', '/api/sales/totals/', None),
+    ('api-sales-detail', 'dailysales-detail', 'admin', 'get', '/api/sales/{sales}/', None),
+]
+
+# queries per request, lower the budget when a view gets cheaper
+BUDGETS = {
+    'index': 4, 'login': 0, 'register': 0, 'logout': 4, 'account': 8, 'schedule': 3, 'contact': 0, 'about': 0,
+    'movie': 5, 'waiting-room': 3, 'session': 9, 'order': 15, 'main': 4, 'genre': 3, 'genre-create': 4,
+    'genre-delete': 5, 'genre-edit': 3, 'hall': 4, 'hall-create': 4, 'hall-delete': 8, 'hall-edit': 3,
+    'allmovies': 6, 'movie-create': 3, 'movie-delete': 8, 'movie-edit': 5, 'settings-list': 5, 'settings-create': 4,
+    'settings-delete': 8, 'settings-edit': 5, 'sessions-list': 5, 'profiles': 4, 'profile': 3,
+    'api-generate-token': 2, 'api-batch': 2, 'api-genre-list': 2, 'api-genre-detail': 2, 'api-hall-list': 2,
+    'api-hall-detail': 2, 'api-movie-list': 4, 'api-movie-list-expanded': 4, 'api-movie-detail': 3,
+    'api-movie-queue': 3, 'api-movie-sessions': 4, 'api-session-list': 3, 'api-session-availability': 2,
+    'api-session-todays': 2, 'api-session-facets': 2, 'api-session-detail': 2, 'api-settings-list': 3,
+    'api-settings-detail': 2, 'api-settings-generation': 2, 'api-order-list': 5, 'api-order-list-admin': 5,
+    'api-order-create': 16, 'api-order-detail': 3, 'api-user-list': 3, 'api-user-detail': 2, 'api-sales-list': 3,
+    'api-sales-totals': 2, 'api-sales-detail': 2,
+}
+
+# url patterns of the apps which are not requested by the suite and why, none so far
+NOT_MEASURED = {
+}
+
+
+def url_keys(urlconf):
+    """Names of the url patterns of `urlconf`, routes of unnamed ones"""
+    def walk(patterns):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from walk(pattern.url_patterns)
+            else:
+                yield pattern.name or str(pattern.pattern)
+    return set(walk(get_resolver(urlconf).url_patterns))
+
+
+def report_path():
+    return os.environ.get('QUERY_BUDGET_REPORT') or os.path.join(tempfile.gettempdir(), 'moviehouse-query-budget.json')
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Every page and API action is requested on a small dataset and on a larger one:
+    the number of queries has to fit the budget and must not grow with the data.
+    Query counts and wall time of both runs are written to a JSON report (QUERY_BUDGET_REPORT).
+    """
+
+    def setUp(self):
+        self.admin = SuperUserFactory()
+        self.admin.save()
+        self.customer = UserFactory()
+        self.customer.set_password(PASSWORD)
+        self.customer.save()
+        # obtained up front, so generate-token and token authentication only read them
+        for user in (self.admin, self.customer):
+            Token.objects.create(user=user)
+        self.first = None
+        self.grow(1)
+
+    def grow(self, count):
+        """`count` more genres, halls and movies, each shown by its own settings and ordered twice"""
+        today = datetime.now().date()
+        for _ in range(count):
+            genre = GenreFactory()
+            genre.save()
+            hall = HallFactory(sits_rows=5, sits_cols=4)
+            hall.save()
+            # pages render poster urls, files themselves are not read
+            movie = MovieFactory(img_landscape='img/poster.jpg', img_standard='img/poster.jpg',
+                                 img_small='img/poster.jpg')
+            movie.save()
+            movie.genres.add(genre)
+            setting = MovieSessionSettings(hall=hall, movie=movie, price=20,
+                                           date_start=today, date_end=today + timedelta(days=3),
+                                           time_start='23:59', time_end='23:59')
+            setting.save()
+            session = MovieSession.objects.get(settings=setting, date=today + timedelta(days=1))
+            orders = [book_best_seats(self.customer, session, 2) for _ in range(2)]
+            if self.first is None:
+                self.first = {'genre': genre.pk, 'hall': hall.pk, 'movie': movie.pk, 'setting': setting.pk,
+                              'session': session.pk, 'order': orders[0].pk}
+
+        # orders of the last minute are not counted into sales
+        Order.objects.update(datetime=timezone.now() - timedelta(hours=1))
+        DailySales.objects.rollup()
+
+    def client_for(self, role, api):
+        client = APIClient() if api else Client()
+        if role == 'anonymous':
+            return client
+        user = self.admin if role == 'admin' else self.customer
+        if api:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.get(user=user).key}')
+        else:
+            client.force_login(user)
+        return client
+
+    def ids(self, run):
+        """Ids formatted into paths and data, delete views get rows of their own"""
+        genre = GenreFactory()
+        genre.save()
+        hall = HallFactory(sits_rows=2, sits_cols=2)
+        hall.save()
+        movie = MovieFactory()
+        movie.save()
+        today = datetime.now().date()
+        setting = MovieSessionSettings(hall=hall, movie=movie, price=20, date_start=today, date_end=today,
+                                       time_start='23:59', time_end='23:59')
+        setting.save()
+        other_hall = HallFactory(sits_rows=2, sits_cols=2)
+        other_hall.save()
+        other_movie = MovieFactory()
+        other_movie.save()
+        profile = RequestProfile.objects.record(method='GET', path='/', route='index', status_code=200, duration=1,
+                                                sql_duration=1, query_count=1, stats='',
+                                                queries=[{'start': 0, 'duration': 1, 'sql': 'SELECT 1'}])
+        return dict(self.first, run=run, profile=profile.pk, customer=self.customer.pk, email=self.customer.email,
+                    sales=DailySales.objects.values_list('pk', flat=True).first(),
+                    spare_genre=genre.pk, spare_hall=other_hall.pk, spare_movie=other_movie.pk,
+                    spare_setting=setting.pk)
+
+    def measure(self, run):
+        ids = self.ids(run)
+        results = {}
+        for label, _, role, method, path, data in CASES:
+            api = path.startswith('/api/')
+            client = self.client_for(role, api)
+            if data is not None:
+                data = {key: value.format(**ids) if isinstance(value, str) else value for key, value in data.items()}
+            # cold caches: every request pays for what it reads
+            versions.reset()
+            throttling.reset()
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(client, method)(path.format(**ids), data, **({'format': 'json'} if api else {}))
+                elapsed = time.perf_counter() - started
+            self.assertLess(response.status_code, 400, f'{label}: {response.status_code}')
+            results[label] = {'status': response.status_code, 'queries': len(queries),
+                              'milliseconds': round(elapsed * 1000, 2)}
+        return results
+
+    def test_queries_fit_budget_and_do_not_grow(self):
+        small = self.measure('small')
+        self.grow(4)
+        large = self.measure('large')
+
+        report = {label: {'budget': BUDGETS.get(label), 'small': small[label], 'large': large[label]}
+                  for label in small}
+        with open(report_path(), 'w') as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+
+        for label, result in report.items():
+            with self.subTest(label):
+                self.assertIn(label, BUDGETS)
+                self.assertLessEqual(result['large']['queries'], BUDGETS[label])
+                self.assertEqual(result['large']['queries'], result['small']['queries'])
+
+    def test_every_url_is_measured(self):
+        measured = {name for _, name, _, _, _, _ in CASES}
+        for urlconf in ('cinema.urls', 'staff.urls', 'api.urls'):
+            for key in url_keys(urlconf):
+                with self.subTest(key):
+                    self.assertTrue(key in measured or key in NOT_MEASURED, f'{key} is not measured')
@@ -0,0 +1,70 @@
+from unittest import mock
+
+from django.conf import settings
+from django.test import TestCase, RequestFactory, Client
+from rest_framework.test import APIClient
+
+from cinema import throttling
+from cinema.throttling import TokenBucket
+from cinema.tests.factories import UserFactory
+from moviehouse.settings import TOKEN_BUCKETS
+
+
+@mock.patch.dict(TOKEN_BUCKETS, {'login': {'capacity': 2, 'refill_rate': 0.01},
+                                 'order': {'capacity': 1, 'refill_rate': 0.01}})
+class TokenBucketTest(TestCase):
+    def setUp(self):
+        throttling.reset()
+        self.factory = RequestFactory()
+        self.c = Client()
+
+    def tearDown(self):
+        throttling.reset()
+
+    def test_burst_then_wait(self):
+        bucket = TokenBucket('login', key='ip')
+        request = self.factory.post('/login/')
+        self.assertEqual(bucket.consume(request), (True, 0))
+        self.assertEqual(bucket.consume(request), (True, 0))
+        allowed, wait = bucket.consume(request)
+        self.assertFalse(allowed)
+        self.assertGreater(wait, 90)
+
+    def test_identities_counted_apart(self):
+        bucket = TokenBucket('login', key='ip')
+        for _ in range(2):
+            bucket.consume(self.factory.post('/login/', REMOTE_ADDR='10.0.0.1'))
+        self.assertFalse(bucket.consume(self.factory.post('/login/', REMOTE_ADDR='10.0.0.1'))[0])
+        self.assertTrue(bucket.consume(self.factory.post('/login/', REMOTE_ADDR='10.0.0.2'))[0])
+
+    def test_forwarded_for_spoofing(self):
+        data = {'username': 'nobody@gmail.com', 'password': 'wrong'}
+        for number in range(2):
+            self.assertEqual(self.c.post('/login/', data, HTTP_X_FORWARDED_FOR=f'10.0.0.{number}').status_code, 200)
+        self.assertEqual(self.c.post('/login/', data, HTTP_X_FORWARDED_FOR='10.0.0.9').status_code, 429)
+
+    def test_forwarded_for_behind_proxy(self):
+        bucket = TokenBucket('login', key='ip')
+        with self.settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, NUM_PROXIES=1)):
+            for _ in range(2):
+                bucket.consume(self.factory.post('/login/', HTTP_X_FORWARDED_FOR='1.1.1.1, 10.0.0.1'))
+            # the address the proxy saw counts, not what the client put in front of it
+            self.assertFalse(bucket.consume(self.factory.post('/login/', HTTP_X_FORWARDED_FOR='2.2.2.2, 10.0.0.1'))[0])
+            self.assertTrue(bucket.consume(self.factory.post('/login/', HTTP_X_FORWARDED_FOR='10.0.0.2'))[0])
+
+    def test_login_view_limited(self):
+        data = {'username': 'nobody@gmail.com', 'password': 'wrong'}
+        self.assertEqual(self.c.post('/login/', data).status_code, 200)
+        self.assertEqual(self.c.post('/login/', data).status_code, 200)
+        response = self.c.post('/login/', data)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.c.get('/login/').status_code, 200)
+
+    def test_api_order_limited_per_user(self):
+        user = UserFactory()
+        user.save()
+        client = APIClient()
+        client.force_authenticate(user=user)
+        self.assertEqual(client.post('/api/orders/', {}).status_code, 400)
+        self.assertEqual(client.post('/api/orders/', {}).status_code, 429)
@@ -0,0 +1,72 @@
+import json
+from datetime import datetime, time, timedelta
+
+from django.test import TestCase
+
+from cinema import versions
+from cinema.models import MovieSessionSettings
+from cinema.tests.factories import HallFactory, MovieFactory
+from cinema.timeline import movie_timeline
+
+
+class MovieTimelineTest(TestCase):
+    def setUp(self):
+        self.hall = HallFactory(sits_rows=2, sits_cols=2)
+        self.hall.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+        self.setting = MovieSessionSettings(hall=self.hall,
+                                            movie=self.movie,
+                                            price=20,
+                                            date_start=(datetime.now().date() - timedelta(days=2)),
+                                            date_end=(datetime.now().date() + timedelta(days=3)),
+                                            time_start='23:59',
+                                            time_end='23:59')
+        self.setting.save()
+
+    def test_split(self):
+        timeline = movie_timeline(self.movie.pk)
+        today = datetime.now().date()
+        self.assertEqual([session.date for session in timeline['today']],
+                         [today] if datetime.now().strftime('%H:%M') < '23:59' else [])
+        self.assertEqual([session.date for session in timeline['tomorrow']], [today + timedelta(days=1)])
+        self.assertEqual([session.date for session in timeline['later']],
+                         [today + timedelta(days=2), today + timedelta(days=3)])
+
+    def test_cached_until_settings_change(self):
+        with self.assertNumQueries(1):
+            movie_timeline(self.movie.pk)
+        with self.assertNumQueries(0):
+            movie_timeline(self.movie.pk)
+
+        self.setting.date_end = datetime.now().date() + timedelta(days=1)
+        self.setting.save()
+        self.assertEqual(movie_timeline(self.movie.pk)['later'], [])
+
+    def test_cached_as_plain_rows(self):
+        movie_timeline(self.movie.pk)
+        client = versions.get_client()
+        key, = client.scan_iter(versions.payload_key(f'timeline:{self.movie.pk}:*'))
+        rows = json.loads(client.get(key))
+        self.assertEqual(rows[-1]['settings__hall__name'], self.hall.name)
+
+        with self.assertNumQueries(0):
+            session = movie_timeline(self.movie.pk)['later'][-1]
+        self.assertEqual((session.pk, session.date), (rows[-1]['id'], datetime.now().date() + timedelta(days=3)))
+        self.assertEqual(session.settings.time_start, time(23, 59))
+        self.assertEqual((session.settings.price, session.settings.hall.name), (20, self.hall.name))
+
+    def test_cached_until_hall_changes(self):
+        movie_timeline(self.movie.pk)
+        self.hall.name = f'{self.hall.name}-renamed'
+        self.hall.save()
+        self.assertEqual(movie_timeline(self.movie.pk)['later'][0].settings.hall.name, self.hall.name)
+
+    def test_moved_settings_leave_timeline(self):
+        movie_timeline(self.movie.pk)
+        other = MovieFactory()
+        other.save()
+        self.setting.movie = other
+        self.setting.save()
+        self.assertEqual(movie_timeline(self.movie.pk), {'today': [], 'tomorrow': [], 'later': []})
+        self.assertEqual(len(movie_timeline(other.pk)['later']), 2)
@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+from celery.app.task import Context
+from django.test import TestCase, Client
+
+from cinema import tracing
+from cinema.tests.factories import GenreFactory
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+class TracingTest(TestCase):
+    def setUp(self):
+        self.exporter = ListExporter()
+        patchers = [mock.patch('cinema.tracing.TRACING_ENABLED', True),
+                    mock.patch('cinema.tracing._exporter', self.exporter)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        GenreFactory().save()
+
+    def named(self, name):
+        return [span for span in self.exporter.spans if span['name'] == name]
+
+    def test_request_spans(self):
+        response = Client().get('/schedule/')
+        root, = self.named('http.request')
+        self.assertEqual(response[tracing.HEADER], f"00-{root['trace_id']}-{root['span_id']}-01")
+        self.assertEqual(root['attributes']['route'], 'schedule')
+        self.assertIsNone(root['parent_id'])
+
+        queries = self.named('db.query')
+        self.assertTrue(queries)
+        template, = self.named('template.render')
+        self.assertEqual(template['attributes']['template'], 'movie-session-list.html')
+        for span in queries + [template]:
+            self.assertEqual(span['trace_id'], root['trace_id'])
+        self.assertEqual(template['parent_id'], root['span_id'])
+
+    def test_incoming_trace_goes_on(self):
+        traceparent = f'00-{"a" * 32}-{"b" * 16}-01'
+        Client().get('/contact/', HTTP_TRACEPARENT=traceparent)
+        root, = self.named('http.request')
+        self.assertEqual((root['trace_id'], root['parent_id']), ('a' * 32, 'b' * 16))
+
+        Client().get('/contact/', HTTP_TRACEPARENT='forged')
+        self.assertEqual(len(self.named('http.request')[1]['trace_id']), 32)
+
+    def test_task_headers_and_task_trace(self):
+        headers = {}
+        with tracing.trace('http.request') as root:
+            tracing.inject_task_headers(headers=headers)
+            message = tracing.inject({'type': 'queue.update'})
+        self.assertEqual(headers, {tracing.HEADER: root.traceparent})
+        self.assertEqual(message[tracing.HEADER], root.traceparent)
+
+        task = mock.Mock(request=Context(headers), spec=['request', 'name'])
+        task.name = 'staff.tasks.purge_deleted'
+        tracing.start_task_trace(task=task)
+        with tracing.span('db.query'):
+            pass
+        tracing.finish_task_trace(task=task, state='SUCCESS')
+
+        query, = self.named('db.query')
+        task_span, = self.named('celery.task')
+        self.assertEqual(task_span['trace_id'], root.trace_id)
+        self.assertEqual(task_span['parent_id'], root.span_id)
+        self.assertEqual(task_span['attributes'], {'task': 'staff.tasks.purge_deleted', 'state': 'SUCCESS'})
+        self.assertEqual(query['parent_id'], task_span['span_id'])
+
+    def test_errors_recorded(self):
+        with self.assertRaises(ValueError):
+            with tracing.trace('celery.task'):
+                raise ValueError('broken')
+        self.assertEqual(self.named('celery.task')[0]['error'], 'ValueError: broken')
+
+    def test_nothing_recorded_outside_of_traces(self):
+        with tracing.span('db.query'):
+            pass
+        with mock.patch('cinema.tracing.TRACING_ENABLED', False):
+            Client().get('/contact/')
+        self.assertEqual(self.exporter.spans, [])
+
+    def test_json_file_exporter(self):
+        path = os.path.join(tempfile.mkdtemp(), 'traces.jsonl')
+        with mock.patch('cinema.tracing._exporter', tracing.JsonFileExporter(path)):
+            with tracing.trace('http.request', path='/'):
+                with tracing.span('cache.get'):
+                    pass
+        with open(path) as file:
+            spans = [json.loads(line) for line in file]
+        self.assertEqual([span['name'] for span in spans], ['cache.get', 'http.request'])
+        self.assertEqual(spans[1]['attributes'], {'path': '/'})
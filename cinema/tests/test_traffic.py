@@ -0,0 +1,65 @@
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import Client, LiveServerTestCase
+
+from cinema.models import MovieSession, MovieSessionSettings
+from cinema.tests.factories import HallFactory, MovieFactory, UserFactory
+
+
+class TrafficCaptureTest(LiveServerTestCase):
+    def setUp(self):
+        hall = HallFactory(sits_rows=2, sits_cols=2)
+        hall.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+        setting = MovieSessionSettings(hall=hall,
+                                       movie=self.movie,
+                                       price=20,
+                                       date_start=(datetime.now().date() + timedelta(days=1)),
+                                       date_end=(datetime.now().date() + timedelta(days=2)),
+                                       time_start='18:00',
+                                       time_end='21:00')
+        setting.save()
+        self.session = MovieSession.objects.filter(settings=setting).first()
+        self.customer = UserFactory()
+        self.customer.save()
+
+        handle, self.capture = tempfile.mkstemp(suffix='.jsonl')
+        os.close(handle)
+        self.addCleanup(os.remove, self.capture)
+
+    def captured(self):
+        with mock.patch('cinema.middlewares.TRAFFIC_CAPTURE_FILE', self.capture):
+            client = Client()
+            client.get('/')
+            client.get(f'/movie/{self.movie.pk}/')
+            client.get('/api/movies/?fields=id,title&secret=value')
+            client.force_login(self.customer)
+            client.post('/order/', {'session': self.session.pk, 'sit': [1, 2], 'email': 'private@example.com'},
+                        HTTP_REFERER='/')
+        with open(self.capture) as capture:
+            return [json.loads(line) for line in capture]
+
+    def test_sanitized_shapes(self):
+        records = self.captured()
+        self.assertEqual([record['route'] for record in records], ['index', 'movie', 'movie-list', 'order'])
+        self.assertEqual(records[1]['kwargs'], {'pk': self.movie.pk})
+        self.assertEqual(records[2]['query'], {'fields': 'id,title', 'secret': ''})
+        self.assertEqual(records[3]['data'], {'session': str(self.session.pk), 'sit': ['1', '2'], 'email': ''})
+        self.assertEqual([record['auth'] for record in records], ['anonymous', 'anonymous', 'anonymous', 'session'])
+
+    def test_replay(self):
+        self.captured()
+        out = StringIO()
+        call_command('replay_traffic', self.capture, base_url=self.live_server_url, speedup=0, stdout=out)
+        report = {line.split()[0]: line.split() for line in out.getvalue().splitlines()[1:-1]}
+        self.assertEqual(set(report), {'index', 'movie', 'movie-list', 'order', 'all'})
+        self.assertEqual(report['all'][1], '4')
+        # no server errors
+        self.assertEqual(report['all'][-1], '0.0')
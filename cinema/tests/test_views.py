@@ -1,12 +1,16 @@
 from datetime import datetime, date, timedelta
+from unittest import mock
 
 from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages import get_messages
 from django.db.models import Sum
 from django.test import TestCase, RequestFactory, Client
 from django.utils import timezone
 
+from cinema import idempotency
+from cinema.booking import SeatConflicts
 from cinema.forms import CustomUserCreationForm
-from cinema.models import CinemaUser, MovieSessionSettings, MovieSession, Order, Sit
+from cinema.models import CinemaUser, IdempotencyKey, MovieSessionSettings, MovieSession, Order, Sit, Ticket
 from cinema.tests.factories import UserFactory, MovieFactory, GenreFactory, MovieSessionSettingsFactory, HallFactory
 from cinema.views import IndexView, LoginView, AccountView, MovieView, SessionView, OrderView, MovieSessionsListView
 
@@ -96,9 +100,10 @@ class AccountViewTest(TestCase):
         self.customer2 = UserFactory()
         self.customer2.save()
 
-        self.order_sit1 = Order.objects.create(customer=self.customer1, sits=Sit.objects.all()[0])
-        self.order_sit2 = Order.objects.create(customer=self.customer1, sits=Sit.objects.all()[1])
-        self.order_sit3 = Order.objects.create(customer=self.customer2, sits=Sit.objects.all()[2])
+        session = MovieSession.objects.filter(settings=self.setting).first()
+        sits = Sit.objects.filter(session=session).order_by('number')
+        self.order1 = Order.objects.place(self.customer1, session, sits[0:2])
+        self.order2 = Order.objects.place(self.customer2, session, sits[2:3])
 
     def test_decline_for_unauthorized(self):
         request = self.factory.get('/account')
@@ -127,19 +132,21 @@ class AccountViewTest(TestCase):
         request.user = self.customer1
         response = AccountView.as_view()(request)
         context = response.context_data
-        orders = Order.objects.filter(customer=self.customer1)
+        tickets = Ticket.objects.filter(order__customer=self.customer1)
         self.assertIn('count', context)
-        self.assertEqual(context['count'], len(orders))
+        self.assertEqual(context['count'], len(tickets))
+        self.assertEqual(context['count'], 2)
 
     def test_get_context_data_sum_spent(self):
         request = self.factory.get('/account')
         request.user = self.customer1
         response = AccountView.as_view()(request)
         context = response.context_data
-        orders = Order.objects.filter(customer=self.customer1)
-        total_spent = orders.aggregate(Sum('sits__session__settings__price'))
+        tickets = Ticket.objects.filter(order__customer=self.customer1)
+        total_spent = tickets.aggregate(Sum('price'))
         self.assertIn('sum', context)
         self.assertEqual(context['sum'], total_spent)
+        self.assertEqual(context['sum']['price__sum'], 40)
 
 
 class MovieViewTest(TestCase):
@@ -228,6 +235,22 @@ class MovieViewTest(TestCase):
         self.assertIn('all_sessions', context)
         self.assertQuerysetEqual(context['all_sessions'], all_sessions)
 
+    def test_not_modified_without_queries(self):
+        request = self.factory.get(f'/movie/{self.movie.pk}/')
+        request.user = self.customer1
+        etag = MovieView.as_view()(request, **{'pk': self.movie.pk})['ETag']
+
+        request = self.factory.get(f'/movie/{self.movie.pk}/', HTTP_IF_NONE_MATCH=etag)
+        request.user = self.customer1
+        with self.assertNumQueries(0):
+            response = MovieView.as_view()(request, **{'pk': self.movie.pk})
+        self.assertEqual(response.status_code, 304)
+
+        self.setting.price = 25
+        self.setting.save()
+        response = MovieView.as_view()(request, **{'pk': self.movie.pk})
+        self.assertEqual(response.status_code, 200)
+
 
 class SessionViewTest(TestCase):
     def setUp(self):
@@ -326,9 +349,10 @@ class OrderViewTest(TestCase):
         self.customer2 = UserFactory()
         self.customer2.save()
 
-        self.sit1 = Sit.objects.all()[0]
-        self.sit2 = Sit.objects.all()[1]
-        self.sit3 = Sit.objects.all()[2]
+        session = MovieSession.objects.get(settings=self.setting, date=(datetime.now() + timedelta(days=1)))
+        self.sit1 = Sit.objects.get(session=session, number=1)
+        self.sit2 = Sit.objects.get(session=session, number=2)
+        self.sit3 = Sit.objects.get(session=session, number=3)
 
         self.c = Client()
         self.c.force_login(self.customer1)
@@ -348,9 +372,72 @@ class OrderViewTest(TestCase):
     def test_order_tickets(self):
         self.c.post('/order', self.data)
         orders_by_user = Order.objects.filter(customer=self.customer1)
-        orders_by_sits = Order.objects.filter(sits__in=self.data['sit'])
+        orders_by_sits = Order.objects.filter(ticket__sit__in=self.data['sit']).distinct()
         self.assertQuerysetEqual(orders_by_user, orders_by_sits)
 
+    def test_order_tickets_one_order_per_purchase(self):
+        self.c.post('/order/', self.data)
+        order = Order.objects.get(customer=self.customer1)
+        self.assertEqual(order.session, self.sit1.session)
+        self.assertEqual(order.sits, [1, 2])
+        self.assertEqual(order.total, 2 * self.setting.price)
+
+    def test_order_nothing_chosen(self):
+        response = self.c.post('/order/', {"session": self.sit1.session.pk}, HTTP_REFERER='/schedule/')
+        self.assertRedirects(response, '/schedule/', fetch_redirect_response=False)
+        self.assertIn('Choose sits', str(list(get_messages(response.wsgi_request))[0]))
+        self.assertFalse(Order.objects.exists())
+
+    def test_order_tickets_resubmit(self):
+        self.data['idempotency_key'] = 'form-key'
+        self.c.post('/order/', self.data)
+        response = self.c.post('/order/', self.data)
+        self.assertRedirects(response, '/account/')
+        self.assertEqual(Order.objects.filter(customer=self.customer1).count(), 1)
+
+    def test_order_tickets_resubmit_while_processed(self):
+        self.data['idempotency_key'] = 'form-key'
+        idempotency.claim(self.customer1, 'form-key', idempotency.fingerprint(
+            {'sit': [str(self.sit1.pk), str(self.sit2.pk)], 'session': [str(self.sit1.session.pk)]}))
+        response = self.c.post('/order/', self.data, HTTP_REFERER='/schedule/')
+        self.assertRedirects(response, '/schedule/', fetch_redirect_response=False)
+        self.assertIn('still being processed', str(list(get_messages(response.wsgi_request))[0]))
+        self.assertFalse(Order.objects.filter(customer=self.customer1).exists())
+
+    def test_order_tickets_key_too_long(self):
+        self.data['idempotency_key'] = 'k' * 101
+        response = self.c.post('/order/', self.data, HTTP_REFERER='/schedule/')
+        self.assertRedirects(response, '/schedule/', fetch_redirect_response=False)
+        self.assertIn('Please reload the page', str(list(get_messages(response.wsgi_request))[0]))
+        self.assertFalse(Order.objects.exists())
+
+    def test_order_tickets_key_released_on_error(self):
+        self.data['idempotency_key'] = 'form-key'
+        with mock.patch('cinema.views.OrderView.place_order', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.c.post('/order/', self.data)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.c.post('/order/', self.data)
+        self.assertEqual(Order.objects.filter(customer=self.customer1).count(), 1)
+
+    def test_order_tickets_taken_meanwhile(self):
+        Order.objects.place(self.customer2, self.sit1.session, [self.sit1])
+        # the form saw the sits free, the order of the other customer came between
+        with mock.patch('cinema.forms.check_seats', return_value=SeatConflicts()):
+            response = self.c.post('/order/', self.data, HTTP_REFERER='/schedule/')
+        self.assertRedirects(response, '/schedule/', fetch_redirect_response=False)
+        self.assertIn('just taken', str(list(get_messages(response.wsgi_request))[0]))
+        self.assertFalse(Order.objects.filter(customer=self.customer1).exists())
+
+    def test_order_best_sits(self):
+        session = MovieSession.objects.get(settings=self.setting, date=(datetime.now() + timedelta(days=1)))
+        data = {"count": 3, "session": session.pk}
+        response = self.c.post('/order/', data)
+        self.assertRedirects(response, '/account/')
+        numbers = Order.objects.get(customer=self.customer1).sits
+        self.assertEqual(len(numbers), 3)
+        self.assertEqual(max(numbers) - min(numbers), 2)
+
 
 class MovieSessionsListViewTest(TestCase):
     def setUp(self):
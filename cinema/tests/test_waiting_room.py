@@ -0,0 +1,104 @@
+from datetime import datetime, timedelta
+
+from django.test import TestCase, Client, RequestFactory
+from rest_framework.test import APIClient
+
+from cinema import waiting_room
+from cinema.models import MovieSession, MovieSessionSettings, Order
+from cinema.tests.factories import UserFactory, HallFactory, MovieFactory
+from cinema.views import SessionView
+from staff.tasks import admit_waiting_rooms
+
+
+class WaitingRoomTest(TestCase):
+    def setUp(self):
+        waiting_room.reset()
+        hall = HallFactory(sits_rows=5, sits_cols=5)
+        hall.save()
+        self.movie = MovieFactory(waiting_room=True)
+        self.movie.save()
+        setting = MovieSessionSettings(hall=hall,
+                                       movie=self.movie,
+                                       price=20,
+                                       date_start=datetime.now().date(),
+                                       date_end=(datetime.now().date() + timedelta(days=2)),
+                                       time_start='18:00',
+                                       time_end='21:00')
+        setting.save()
+        self.session = MovieSession.objects.get(settings=setting, date=(datetime.now().date() + timedelta(days=1)))
+
+        self.customer1 = UserFactory()
+        self.customer1.save()
+        self.customer2 = UserFactory()
+        self.customer2.save()
+        self.c = Client()
+        self.c.force_login(self.customer1)
+
+    def tearDown(self):
+        waiting_room.reset()
+
+    def test_queue_positions(self):
+        self.assertEqual(waiting_room.join(self.movie.pk, self.customer1.pk), (1, None))
+        self.assertEqual(waiting_room.join(self.movie.pk, self.customer2.pk), (2, None))
+        # rejoining keeps the place
+        self.assertEqual(waiting_room.join(self.movie.pk, self.customer1.pk), (1, None))
+        self.assertEqual(waiting_room.status(self.movie.pk, self.customer2.pk + 1), (None, None))
+
+    def test_admit_first_customers(self):
+        waiting_room.join(self.movie.pk, self.customer1.pk)
+        waiting_room.join(self.movie.pk, self.customer2.pk)
+        self.assertEqual(waiting_room.admit(self.movie.pk, 1), 1)
+        position, token = waiting_room.status(self.movie.pk, self.customer1.pk)
+        self.assertEqual(position, 0)
+        self.assertTrue(waiting_room.is_admitted(self.movie.pk, self.customer1.pk, token))
+        self.assertFalse(waiting_room.is_admitted(self.movie.pk, self.customer1.pk, 'forged'))
+        self.assertEqual(waiting_room.status(self.movie.pk, self.customer2.pk), (1, None))
+
+    def test_task_admits_movies_with_waiting_room(self):
+        waiting_room.join(self.movie.pk, self.customer1.pk)
+        self.assertEqual(admit_waiting_rooms(), 'Customers admitted: 1')
+        self.assertEqual(waiting_room.status(self.movie.pk, self.customer1.pk)[0], 0)
+
+    def test_session_redirects_to_waiting_room(self):
+        response = self.c.get(f'/session/{self.session.pk}/')
+        self.assertRedirects(response, f'/movie/{self.movie.pk}/queue/?next=/session/{self.session.pk}/',
+                             fetch_redirect_response=False)
+        response = self.c.get(response.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['position'], 1)
+
+    def test_admitted_customer_gets_session(self):
+        waiting_room.join(self.movie.pk, self.customer1.pk)
+        waiting_room.admit(self.movie.pk, 1)
+        response = self.c.get(f'/movie/{self.movie.pk}/queue/?next=/session/{self.session.pk}/')
+        self.assertRedirects(response, f'/session/{self.session.pk}/', fetch_redirect_response=False)
+        request = RequestFactory().get(f'/session/{self.session.pk}/')
+        request.user = self.customer1
+        response = SessionView.as_view()(request, **{'pk': self.session.pk})
+        token = waiting_room.status(self.movie.pk, self.customer1.pk)[1]
+        self.assertEqual(response.context_data['admission_token'], token)
+
+    def test_order_needs_admission_token(self):
+        data = {'count': 2, 'session': self.session.pk}
+        self.c.post('/order/', data, HTTP_REFERER=f'/session/{self.session.pk}/')
+        self.assertFalse(Order.objects.filter(customer=self.customer1).exists())
+
+        waiting_room.join(self.movie.pk, self.customer1.pk)
+        waiting_room.admit(self.movie.pk, 1)
+        data['admission_token'] = waiting_room.status(self.movie.pk, self.customer1.pk)[1]
+        response = self.c.post('/order/', data)
+        self.assertRedirects(response, '/account/')
+        self.assertTrue(Order.objects.filter(customer=self.customer1).exists())
+
+    def test_api_order_needs_admission_token(self):
+        client = APIClient()
+        client.force_authenticate(user=self.customer1)
+        data = {'session': self.session.pk, 'count': 2}
+        self.assertEqual(client.post('/api/orders/', data).status_code, 403)
+
+        response = client.post(f'/api/movies/{self.movie.pk}/queue/')
+        self.assertEqual(response.data, {'position': 1, 'admission_token': None})
+        waiting_room.admit(self.movie.pk, 1)
+        token = client.get(f'/api/movies/{self.movie.pk}/queue/').data['admission_token']
+        response = client.post('/api/orders/', data, HTTP_ADMISSION_TOKEN=token)
+        self.assertEqual(response.status_code, 201)
@@ -0,0 +1,116 @@
+import logging
+import math
+from functools import wraps
+
+import redis
+from django.http import HttpResponse
+from rest_framework.throttling import BaseThrottle
+
+from moviehouse.settings import THROTTLE_REDIS_URL, TOKEN_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'throttle'
+
+# refill and take tokens in one step, so buckets stay right with many workers;
+# time comes from Redis for all of them
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * refill_rate)
+
+local allowed = 0
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+    allowed = 1
+else
+    wait = (requested - tokens) / refill_rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill_rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+_client = None
+_script = None
+
+
+def get_client():
+    global _client, _script
+    if _client is None:
+        _client = redis.Redis.from_url(THROTTLE_REDIS_URL, socket_timeout=0.2, socket_connect_timeout=0.2)
+        _script = _client.register_script(TOKEN_BUCKET_SCRIPT)
+    return _client
+
+
+def get_script():
+    get_client()
+    return _script
+
+
+def reset():
+    """Drop all buckets under the current KEY_PREFIX"""
+    try:
+        client = get_client()
+        for key in client.scan_iter(f'{KEY_PREFIX}:*'):
+            client.delete(key)
+    except redis.RedisError:
+        logger.warning('Rate limit buckets are not reset: Redis is not available')
+
+
+def ip_identity(request):
+    # X-Forwarded-For counts only behind REST_FRAMEWORK['NUM_PROXIES'] trusted proxies
+    return f'ip:{BaseThrottle().get_ident(request)}'
+
+
+def user_identity(request):
+    return f'user:{request.user.pk}' if request.user.is_authenticated else ip_identity(request)
+
+
+IDENTITIES = {
+    'ip': ip_identity,
+    'user': user_identity,
+}
+
+
+class TokenBucket:
+    def __init__(self, scope, key='ip'):
+        self.scope = scope
+        self.identity = IDENTITIES[key]
+
+    def consume(self, request, tokens=1):
+        """(allowed, seconds to wait), everything is allowed while Redis is not available"""
+        config = TOKEN_BUCKETS[self.scope]
+        try:
+            allowed, wait = get_script()(keys=[f'{KEY_PREFIX}:{self.scope}:{self.identity(request)}'],
+                                    args=[config['capacity'], config['refill_rate'], tokens])
+        except redis.RedisError:
+            logger.warning('Rate limit %s is not checked: Redis is not available', self.scope)
+            return True, 0
+        return bool(allowed), float(wait)
+
+
+def rate_limited(scope, key='ip', methods=('POST', )):
+    """View decorator answering 429 when the bucket of the scope is empty for the client"""
+    bucket = TokenBucket(scope, key)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method in methods:
+                allowed, wait = bucket.consume(request)
+                if not allowed:
+                    response = HttpResponse('Too many requests. Please try again later.', status=429)
+                    response['Retry-After'] = math.ceil(wait)
+                    return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
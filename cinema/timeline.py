@@ -0,0 +1,54 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_time
+
+from cinema import versions
+from cinema.models import Hall, MovieSession, MovieSessionSettings
+
+# what timeline sessions carry: the session, its settings and hall
+FIELDS = ('id', 'date', 'settings_id', 'settings__time_start', 'settings__time_end', 'settings__price',
+          'settings__hall_id', 'settings__hall__name')
+
+
+def as_session(row, movie_id):
+    """Unsaved MovieSession with its settings and hall from a cached row"""
+    hall = Hall(id=row['settings__hall_id'], name=row['settings__hall__name'])
+    settings = MovieSessionSettings(id=row['settings_id'], movie_id=movie_id, hall=hall,
+                                    time_start=parse_time(row['settings__time_start']),
+                                    time_end=parse_time(row['settings__time_end']), price=row['settings__price'])
+    return MovieSession(id=row['id'], date=parse_date(row['date']), settings=settings)
+
+
+def upcoming_sessions(movie_id):
+    """
+    Sessions of the movie from today on, ordered by start, with their settings and halls.
+    Built by one query and cached as plain rows until session settings of the movie or halls change.
+    """
+    state = versions.state(versions.scoped(MovieSessionSettings, movie_id), Hall)
+    key = None if state is None else f'timeline:{movie_id}:{state[0]}'
+    rows = None if key is None else versions.cached_payload(key)
+    if rows is None:
+        rows = [dict(row, date=row['date'].isoformat(), settings__time_start=row['settings__time_start'].isoformat(),
+                     settings__time_end=row['settings__time_end'].isoformat())
+                for row in MovieSession.objects.filter(settings__movie_id=movie_id, date__gte=timezone.now().date())
+                .order_by('date', 'settings__time_start', 'id').values(*FIELDS)]
+        if key is not None:
+            versions.cache_payload(key, rows)
+    return [as_session(row, movie_id) for row in rows]
+
+
+def movie_timeline(movie_id):
+    """Sessions of the movie which have not started yet: {'today': [...], 'tomorrow': [...], 'later': [...]}"""
+    now = timezone.now()
+    today = now.date()
+    tomorrow = today + timezone.timedelta(days=1)
+    timeline = {'today': [], 'tomorrow': [], 'later': []}
+    # the cached list is split on every call, sessions drop out of it as they start
+    for session in upcoming_sessions(movie_id):
+        if session.date == today:
+            if session.settings.time_start > now.time():
+                timeline['today'].append(session)
+        elif session.date == tomorrow:
+            timeline['tomorrow'].append(session)
+        elif session.date > tomorrow:
+            timeline['later'].append(session)
+    return timeline
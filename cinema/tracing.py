@@ -0,0 +1,185 @@
+"""
+Lightweight tracing: a trace per web request, Celery task or channel layer message, with spans around
+queries, cache calls and template rendering inside. Trace ids travel in W3C `traceparent` values of HTTP
+headers, Celery task headers and channel layer messages, so the spans of one checkout can be put together
+across processes. Finished spans are given to TRACING_EXPORTER, nothing is recorded unless TRACING_ENABLED.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import secrets
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.module_loading import import_string
+
+from moviehouse.settings import TRACING_ENABLED, TRACING_EXPORTER, TRACING_FILE
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'traceparent'
+
+_current = contextvars.ContextVar('tracing_span', default=None)
+_exporter = None
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, **attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    @property
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def as_dict(self):
+        return {'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_id': self.parent_id, 'name': self.name,
+                'start': round(self.start, 6), 'ms': round(self.duration * 1000, 3), 'error': self.error,
+                'attributes': self.attributes}
+
+
+class JsonFileExporter:
+    """Appends spans to TRACING_FILE as JSON lines, a line is written at once, so processes do not interleave"""
+
+    def __init__(self, path=None):
+        self.fd = os.open(path or TRACING_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+    def export(self, span):
+        os.write(self.fd, (json.dumps(span, separators=(',', ':'), default=str) + '\n').encode())
+
+
+def enabled():
+    return TRACING_ENABLED
+
+
+def get_exporter():
+    global _exporter
+    if _exporter is None:
+        _exporter = import_string(TRACING_EXPORTER)()
+    return _exporter
+
+
+def current():
+    return _current.get()
+
+
+def parse(traceparent):
+    """(trace id, parent span id) of a traceparent value, None for missing or malformed ones"""
+    parts = (traceparent or '').split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+def inject(message):
+    """Message with the traceparent of the current span, for Celery headers and channel layer messages"""
+    span = _current.get()
+    return message if span is None else dict(message, **{HEADER: span.traceparent})
+
+
+@contextmanager
+def _activated(span):
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as error:
+        span.error = f'{type(error).__name__}: {error}'
+        raise
+    finally:
+        span.duration = time.time() - span.start
+        _current.reset(token)
+        try:
+            get_exporter().export(span.as_dict())
+        except Exception:
+            # a broken exporter never breaks requests and tasks
+            logger.exception('Span %s is not exported', span.name)
+
+
+@contextmanager
+def trace(name, traceparent=None, **attributes):
+    """Root span of a request, task or message, continues the trace of `traceparent` when there is one"""
+    if not enabled():
+        yield None
+        return
+    trace_id, parent_id = parse(traceparent) or (secrets.token_hex(16), None)
+    with _activated(Span(name, trace_id, parent_id, **attributes)) as span:
+        yield span
+
+
+@contextmanager
+def span(name, **attributes):
+    """Child of the current span, nothing is recorded outside of traces"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    with _activated(Span(name, parent.trace_id, parent.span_id, **attributes)) as child:
+        yield child
+
+
+def traced(name):
+    """Decorator running the function in a span"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def query_span(execute, sql, params, many, context):
+    if _current.get() is None:
+        return execute(sql, params, many, context)
+    with span('db.query', sql=sql, many=many, alias=context['connection'].alias):
+        return execute(sql, params, many, context)
+
+
+def install_query_spans(sender, connection, **kwargs):
+    """connection_created receiver; inserted first, so wrappers pushed and popped around it stay balanced"""
+    if query_span not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, query_span)
+
+
+def inject_task_headers(headers=None, **kwargs):
+    """before_task_publish receiver"""
+    if headers is not None:
+        headers.update(inject({}))
+
+
+def start_task_trace(task=None, **kwargs):
+    """task_prerun receiver, the trace of the request or task which sent the task goes on"""
+    stack = ExitStack()
+    stack.enter_context(trace('celery.task', traceparent=task.request.get(HEADER), task=task.name))
+    task.request.tracing = stack
+
+
+def finish_task_trace(task=None, state=None, **kwargs):
+    """task_postrun receiver"""
+    stack = getattr(task.request, 'tracing', None)
+    if stack is not None:
+        if _current.get() is not None:
+            _current.get().attributes['state'] = state
+        stack.close()
+
+
+class TracedTemplate(Template):
+    def render(self, context=None, request=None):
+        with span('template.render', template=self.template.name):
+            return super().render(context, request)
+
+
+class TracedDjangoTemplates(DjangoTemplates):
+    """Django templates backend rendering templates in spans"""
+
+    def get_template(self, template_name):
+        return TracedTemplate(super().get_template(template_name).template, self)
@@ -1,7 +1,7 @@
 from django.urls import path
 from cinema.views import IndexView, LoginView, RegisterView, LogoutView, AccountView
 from cinema.views import SessionView, OrderView, MovieSessionsListView
-from cinema.views import ContactView, AboutView, MovieView
+from cinema.views import ContactView, AboutView, MovieView, WaitingRoomView
 
 
 urlpatterns = [
@@ -14,6 +14,7 @@ urlpatterns = [
     path('contact/', ContactView.as_view(), name='contact'),
     path('about/', AboutView.as_view(), name='about'),
     path('movie/<int:pk>/', MovieView.as_view(), name='movie'),
+    path('movie/<int:pk>/queue/', WaitingRoomView.as_view(), name='waiting-room'),
     path('session/<int:pk>/', SessionView.as_view(), name='session'),
     path('order/', OrderView.as_view(), name='order'),
 ]
\ No newline at end of file
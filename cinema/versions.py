@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import time
+
+import redis
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from cinema import tracing
+from moviehouse.settings import VERSIONS_REDIS_URL, MINUTES_VERSIONED_PAYLOAD_LIFE_TIME
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'versions'
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(VERSIONS_REDIS_URL, socket_timeout=0.2, socket_connect_timeout=0.2)
+    return _client
+
+
+def reset():
+    """Drop all versions and cached payloads under the current KEY_PREFIX"""
+    try:
+        client = get_client()
+        for key in client.scan_iter(f'{KEY_PREFIX}:*'):
+            client.delete(key)
+    except redis.RedisError:
+        logger.warning('Versions are not reset: Redis is not available')
+
+
+def scoped(model, scope):
+    """Collection of the model rows related to one object, e.g. session settings of a movie"""
+    return f'{model._meta.label_lower}:{scope}'
+
+
+def collection_name(collection):
+    return collection if isinstance(collection, str) else collection._meta.label_lower
+
+
+def version_key(collection):
+    return f'{KEY_PREFIX}:version:{collection_name(collection)}'
+
+
+def modified_key(collection):
+    return f'{KEY_PREFIX}:modified:{collection_name(collection)}'
+
+
+def payload_key(key):
+    return f'{KEY_PREFIX}:payload:{key}'
+
+
+def _initial(pipe, collection):
+    # lost counters start from the clock, so a version is never handed out twice
+    pipe.set(version_key(collection), time.time_ns(), nx=True)
+    pipe.set(modified_key(collection), time.time(), nx=True)
+
+
+def bump(*collections):
+    """New versions of the collections: models or scoped() ones"""
+    try:
+        pipe = get_client().pipeline()
+        for collection in collections:
+            _initial(pipe, collection)
+            pipe.incr(version_key(collection))
+            pipe.set(modified_key(collection), time.time())
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning('Versions of %s are not bumped: Redis is not available',
+                       ', '.join(collection_name(collection) for collection in collections))
+
+
+def changed(*collections):
+    """
+    Bumps versions right away, so the changing transaction sees them, and once more after commit,
+    so payloads cached from the not yet committed rows by other requests are never served
+    """
+    bump(*collections)
+    transaction.on_commit(lambda: bump(*collections))
+
+
+@tracing.traced('cache.versions')
+def state(*collections):
+    """(version tag, last modified unix time) of the collections, None while Redis is not available"""
+    try:
+        pipe = get_client().pipeline()
+        for collection in collections:
+            _initial(pipe, collection)
+            pipe.get(version_key(collection))
+            pipe.get(modified_key(collection))
+        replies = pipe.execute()
+    except redis.RedisError:
+        logger.warning('Versions are not read: Redis is not available')
+        return None
+
+    # every collection adds two initial sets, its version and its modification time
+    tags = [replies[index].decode() for index in range(2, len(replies), 4)]
+    modified = max(float(replies[index]) for index in range(3, len(replies), 4))
+    return '.'.join(tags), int(modified)
+
+
+def etag(tag, *variant):
+    """Strong ETag of a resource variant at the version tag"""
+    digest = hashlib.md5('|'.join(str(part) for part in variant).encode()).hexdigest()
+    return f'"{tag}-{digest}"'
+
+
+@tracing.traced('cache.get')
+def cached_payload(key):
+    """Payload stored by cache_payload(), dates and times come back as ISO strings"""
+    try:
+        payload = get_client().get(payload_key(key))
+    except redis.RedisError:
+        logger.warning('Cached payload is not read: Redis is not available')
+        return None
+    return None if payload is None else json.loads(payload)
+
+
+@tracing.traced('cache.set')
+def cache_payload(key, payload):
+    """
+    Payloads are keyed by versions, so they are never invalidated and just expire.
+    They are stored as JSON: plain data only, nothing read from Redis is ever executed.
+    """
+    try:
+        get_client().set(payload_key(key), json.dumps(payload, cls=DjangoJSONEncoder),
+                         ex=MINUTES_VERSIONED_PAYLOAD_LIFE_TIME * 60)
+    except redis.RedisError:
+        logger.warning('Payload is not cached: Redis is not available')
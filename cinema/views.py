@@ -1,17 +1,27 @@
 from datetime import timedelta
+from uuid import uuid4
 
 from django.contrib import messages
 from django.contrib.auth import login
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import LogoutView, LoginView
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError
 from django.db.models import Sum
 from django.shortcuts import redirect
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
+from django.utils.decorators import method_decorator
 from django.utils import timezone
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView, CreateView, ListView, DetailView
 
+from cinema import facets, idempotency, versions, waiting_room
+from cinema.booking import book_best_seats
 from cinema.forms import CustomUserCreationForm, OrderForm
-from cinema.models import CinemaUser, Movie, MovieSession, Order, Sit
+from cinema.models import CinemaUser, Genre, Movie, MovieSession, MovieSessionSettings, Order, Sit, Ticket
+from cinema.throttling import rate_limited
+from cinema.timeline import movie_timeline
 
 
 class IndexView(ListView):
@@ -28,21 +38,24 @@ class IndexView(ListView):
         context['title'] = 'Head | Popcorn cinema'
         context['todays_sessions'] = MovieSession.objects.filter(date=timezone.now().date(),
                                                                  settings__time_start__gte=timezone.now()). \
-            order_by('settings__time_start')
+            order_by('settings__time_start').select_related('settings__movie', 'settings__hall').with_seat_counts()
         context['tomorrows_sessions'] = MovieSession.objects.filter(date=(timezone.now() + timedelta(1))). \
-            order_by('settings__time_start')
+            order_by('settings__time_start').select_related('settings__movie', 'settings__hall').with_seat_counts()
 
         # calculating bestsellers
-        orders_last_30_days = Order.objects.filter(datetime__lte=timezone.now(),
-                                                   datetime__gte=(timezone.now() - timedelta(minutes=60 * 24 * 30)))
+        tickets_last_30_days = Ticket.objects.filter(order__datetime__lte=timezone.now(),
+                                                     order__datetime__gte=(timezone.now() - timedelta(minutes=60 * 24 * 30)))\
+            .select_related('order__session__settings__movie')
         movies = {}
-        for order in orders_last_30_days:
-            movies[order.sits.session.settings.movie] = movies.get(order.sits.session.settings.movie, 0) + 1
+        for ticket in tickets_last_30_days:
+            movie = ticket.order.session.settings.movie
+            movies[movie] = movies.get(movie, 0) + 1
         context['bestsellers'] = {k: v for k, v in sorted(movies.items(), key=lambda item: item[1], reverse=True)}
 
         return context
 
 
+@method_decorator(rate_limited('login', key='ip'), name='dispatch')
 class LoginView(LoginView):
     success_url = '/'
     template_name = 'login.html'
@@ -54,6 +67,7 @@ class LoginView(LoginView):
         return self.success_url
 
 
+@method_decorator(rate_limited('register', key='ip'), name='dispatch')
 class RegisterView(CreateView):
     model = CinemaUser
     form_class = CustomUserCreationForm
@@ -82,16 +96,17 @@ class AccountView(LoginRequiredMixin, ListView):
     login_url = reverse_lazy('login')
 
     def get_queryset(self):
-        return self.model.objects.filter(customer=self.request.user).order_by('-sits__session__date')
+        return self.model.objects.filter(customer=self.request.user).order_by('-session__date')\
+            .select_related('session__settings__movie', 'session__settings__hall').prefetch_related('ticket_set')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        orders = Order.objects.filter(customer=self.request.user)
-        context['count'] = len(orders)
-        context['sum'] = orders.aggregate(Sum('sits__session__settings__price'))
+        tickets = Ticket.objects.filter(order__customer=self.request.user)
+        context['count'] = tickets.count()
+        context['sum'] = tickets.aggregate(Sum('price'))
         context['today'] = timezone.now().date()
         fresh_interval = timezone.now() - timedelta(minutes=15)
-        context['recent_orders'] = Order.objects.filter(customer=self.request.user, datetime__gte=fresh_interval)
+        context['recent_orders'] = self.get_queryset().filter(datetime__gte=fresh_interval)
         return context
 
 
@@ -101,31 +116,22 @@ class MovieSessionsListView(ListView):
     paginate_by = 30
     extra_context = {'title': 'Schedule | Popcorn cinema'}
 
+    def get_filters(self):
+        return facets.normalize({'movie': self.request.GET.get('filter_movie'),
+                                 'hall': self.request.GET.get('filter_hall'),
+                                 'time_start': self.request.GET.get('time_start'),
+                                 'time_end': self.request.GET.get('time_end'),
+                                 'date_start': self.request.GET.get('date_start'),
+                                 'date_end': self.request.GET.get('date_end')})
+
     def get_queryset(self):
-        movie = self.request.GET.get('filter_movie')
-        hall = self.request.GET.get('filter_hall')
-        time_start = self.request.GET.get('time_start')
-        time_end = self.request.GET.get('time_end')
-        date_start = self.request.GET.get('date_start')
-        date_end = self.request.GET.get('date_end')
         orderprice = self.request.GET.get('orderprice')
         ordertime = self.request.GET.get('ordertime')
 
-        new_context = self.model.objects.filter(date__gte=timezone.now()).exclude(date=timezone.now(),
-                                                                                  settings__time_start__lte=timezone.now())
-
-        if movie:
-            new_context = new_context.filter(settings__movie__title=movie)
-        if hall:
-            new_context = new_context.filter(settings__hall__name=hall)
-        if time_start:
-            new_context = new_context.filter(settings__time_start__gte=time_start)
-        if time_end:
-            new_context = new_context.filter(settings__time_start__lte=time_end)
-        if date_start:
-            new_context = new_context.filter(date__gte=date_start)
-        if date_end:
-            new_context = new_context.filter(date__lte=date_end)
+        filters = self.get_filters()
+        # days beyond the horizon are created first, the list tells when it is not complete yet
+        self.sessions_until, self.sessions_partial = facets.prepare_sessions(filters)
+        new_context = facets.filter_sessions(facets.upcoming_sessions(), filters)
 
         if orderprice == "asc":
             new_context = new_context.order_by('settings__price')
@@ -136,14 +142,15 @@ class MovieSessionsListView(ListView):
         elif ordertime == "desc":
             new_context = new_context.order_by('-settings__time_start')
 
-        return new_context
+        return new_context.select_related('settings__movie', 'settings__hall').with_seat_counts()
 
     def get_context_data(self, **kwargs):
         context = super(MovieSessionsListView, self).get_context_data(**kwargs)
-        qs = self.get_queryset()
-        context['unique_halls'] = qs.order_by().distinct('settings__hall')
-        context['unique_movies'] = qs.order_by().distinct('settings__movie')
+        # movies, halls and dates offered by the filters, with session counts
+        context['facets'] = facets.schedule_facets(self.get_filters())
         context['previous'] = self.request.GET
+        context['sessions_until'] = self.sessions_until
+        context['sessions_partial'] = self.sessions_partial
         return context
 
 
@@ -157,6 +164,21 @@ class AboutView(TemplateView):
     extra_context = {'title': 'About | Popcorn cinema'}
 
 
+def movie_etag(request, pk):
+    """
+    Movie page ETag from versions of movies, genres and session settings of the movie. Today sessions run out
+    every minute, so the minute is in it as well; pages carrying messages are always rendered.
+    There is no Last-Modified, the page differs from customer to customer.
+    """
+    if len(messages.get_messages(request)):
+        return None
+    state = versions.state(Movie, Genre, versions.scoped(MovieSessionSettings, pk))
+    if state is None:
+        return None
+    return versions.etag(state[0], pk, request.user.pk, timezone.now().strftime('%Y-%m-%d %H:%M'))
+
+
+@method_decorator(condition(etag_func=movie_etag), name='get')
 class MovieView(DetailView):
     model = Movie
     template_name = 'movie.html'
@@ -164,37 +186,70 @@ class MovieView(DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = f'{self.object.title} | Popcorn cinema'
-        context['today_sessions'] = MovieSession.objects.filter(settings__movie=self.object,
-                                                                date=timezone.now(),
-                                                                settings__time_start__gt=timezone.now()) \
-            .order_by('settings__time_start')
-        next_day = timezone.now() + timedelta(1)
-        context['tomorrow_sessions'] = MovieSession.objects.filter(settings__movie=self.object, date=next_day) \
-            .order_by('settings__time_start')
-        context['all_sessions'] = MovieSession.objects.filter(settings__movie=self.object, date__gte=timezone.now()) \
-            .exclude(settings__movie=self.object, date=timezone.now(), settings__time_start__lte=timezone.now()) \
-            .order_by('date', 'settings__time_start')
+        timeline = movie_timeline(self.object.pk)
+        context['today_sessions'] = timeline['today']
+        context['tomorrow_sessions'] = timeline['tomorrow']
+        context['all_sessions'] = timeline['today'] + timeline['tomorrow'] + timeline['later']
 
         return context
 
 
+class WaitingRoomView(LoginRequiredMixin, DetailView):
+    model = Movie
+    template_name = 'waiting-room.html'
+    login_url = reverse_lazy('login')
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        position, _ = waiting_room.join(self.object.pk, request.user.pk)
+        if not position:
+            next_url = request.GET.get('next')
+            if not url_has_allowed_host_and_scheme(next_url, allowed_hosts={request.get_host()}):
+                next_url = reverse('movie', args=[self.object.pk])
+            return redirect(next_url)
+        context = self.get_context_data(object=self.object, position=position)
+        return self.render_to_response(context)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['title'] = f'Waiting room: {self.object.title} | Popcorn cinema'
+        return context
+
+
 class SessionView(DetailView):
     model = MovieSession
     template_name = 'session.html'
     extra_context = {'title': 'Order | Popcorn cinema', 'orderform': OrderForm}
 
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        self.admission_token = None
+        if self.object.waiting_room:
+            movie_id = self.object.settings.movie_id
+            position = None
+            if request.user.is_authenticated:
+                position, self.admission_token = waiting_room.status(movie_id, request.user.pk)
+            if position != 0:
+                return redirect(f"{reverse('waiting-room', args=[movie_id])}?next={request.path}")
+        context = self.get_context_data(object=self.object)
+        return self.render_to_response(context)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        current_movie = self.get_object().settings.movie
-        context['all_sessions'] = MovieSession.objects.filter(settings__movie=current_movie,
-                                                              date__gte=timezone.now()) \
-            .exclude(date=timezone.now(), settings__time_start__lte=timezone.now())
+        timeline = movie_timeline(self.object.settings.movie_id)
+        context['all_sessions'] = timeline['today'] + timeline['tomorrow'] + timeline['later']
         cols = self.object.settings.hall.sits_cols
         rows = self.object.settings.hall.sits_rows
         context['last_col_sits'] = [rows * col for col in range(1, cols + 1)]
+        # tickets come with the sits, the seat map is rendered without a query per sit
+        context['sits'] = list(self.object.sit_set.select_related('ticket').order_by('number'))
+        context['free_sits_number'] = sum(1 for sit in context['sits'] if not hasattr(sit, 'ticket'))
+        context['idempotency_key'] = uuid4().hex
+        context['admission_token'] = self.admission_token
         return context
 
 
+@method_decorator(rate_limited('order', key='user'), name='dispatch')
 class OrderView(LoginRequiredMixin, CreateView):
     form_class = OrderForm
     success_url = 'account'
@@ -205,14 +260,73 @@ class OrderView(LoginRequiredMixin, CreateView):
             messages.error(self.request, "Login, please, before order")
             return redirect('login')
 
-        form = self.form_class(request.POST, request=request)
-        if form.is_valid():
-            sits = request.POST.getlist("sit", [])
-            for sit in sits:
-                Order.objects.create(customer=self.request.user, sits=Sit.objects.get(pk=sit))
-            messages.success(self.request, "Your purchase is done. Tickets are in your account")
+        # the form carries a key per page load, resubmits and double clicks reuse it
+        key = request.POST.get("idempotency_key")
+        if key is not None and not idempotency.valid_key(key):
+            messages.error(self.request, "This order form is broken. Please reload the page")
+            return redirect(self.request.META.get('HTTP_REFERER'))
+        if key:
+            data = {name: values for name, values in request.POST.lists()
+                    if name not in ('csrfmiddlewaretoken', 'idempotency_key')}
+            stored = idempotency.claim(self.request.user, key, idempotency.fingerprint(data))
+            if stored is not None:
+                if stored.fingerprint != idempotency.fingerprint(data):
+                    messages.error(self.request, "This order form was already used. Please reload the page")
+                    return redirect(self.request.META.get('HTTP_REFERER'))
+                if stored.status_code is None:
+                    messages.info(self.request, "Your order is still being processed. Please check your account "
+                                                "in a moment")
+                    return redirect(self.request.META.get('HTTP_REFERER'))
+                messages.info(self.request, "Your order is already accepted. Tickets are in your account")
+                return redirect('account')
+
+        try:
+            order = self.place_order(request)
+        except Exception:
+            if key:
+                idempotency.release(self.request.user, key)
+            raise
+        if key:
+            if order:
+                idempotency.complete(self.request.user, key, 302, {'order': order.pk})
+            else:
+                idempotency.release(self.request.user, key)
+        if order:
             return redirect('account')
-        else:
+        return redirect(self.request.META.get('HTTP_REFERER'))
+
+    def place_order(self, request):
+        """Placed order or None, errors are passed to messages"""
+        # checked before anything else, so customers out of the waiting room don't load the database
+        session = MovieSession.objects.select_related('settings__movie').filter(pk=request.POST.get("session")).first()
+        if session and session.waiting_room and not waiting_room.is_admitted(
+                session.settings.movie_id, self.request.user.pk, request.POST.get("admission_token")):
+            messages.error(self.request, "Your turn in the waiting room is over or has not come yet")
+            return None
+
+        form = self.form_class(request.POST, request=request)
+        if not form.is_valid():
             for msg in form.errors.as_data().get("__all__"):
                 messages.error(self.request, msg.message)
-            return redirect(self.request.META.get('HTTP_REFERER'), kwargs={'orderform': form})
+            return None
+
+        count = request.POST.get("count")
+        if count:
+            try:
+                order = book_best_seats(self.request.user, session, int(count))
+            except ValidationError as error:
+                messages.error(self.request, error.message)
+                return None
+            messages.success(self.request, f"Your purchase is done. Sits: {', '.join(map(str, order.sits))}. "
+                                           f"Tickets are in your account")
+            return order
+
+        sits = Sit.objects.filter(pk__in=request.POST.getlist("sit", []), session=session)
+        try:
+            order = Order.objects.place(self.request.user, session, sits)
+        except IntegrityError:
+            # the sits were free when the form was checked, a concurrent order took them since
+            messages.error(self.request, "Sits from your order were just taken by another customer. Please choose new")
+            return None
+        messages.success(self.request, "Your purchase is done. Tickets are in your account")
+        return order
@@ -0,0 +1,104 @@
+import logging
+import secrets
+import time
+
+import redis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from cinema import tracing
+from moviehouse.settings import WAITING_ROOM_REDIS_URL, MINUTES_WAITING_ROOM_ADMISSION_LIFE_TIME
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'waiting-room'
+
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(WAITING_ROOM_REDIS_URL, socket_timeout=0.2, socket_connect_timeout=0.2)
+    return _client
+
+
+def reset():
+    """Drop all queues and admissions under the current KEY_PREFIX"""
+    try:
+        client = get_client()
+        for key in client.scan_iter(f'{KEY_PREFIX}:*'):
+            client.delete(key)
+    except redis.RedisError:
+        logger.warning('Waiting rooms are not reset: Redis is not available')
+
+
+def queue_key(movie_id):
+    return f'{KEY_PREFIX}:queue:{movie_id}'
+
+
+def admission_key(movie_id, user_id):
+    return f'{KEY_PREFIX}:admitted:{movie_id}:{user_id}'
+
+
+def group_name(movie_id):
+    return f'waiting_room_{movie_id}'
+
+
+def status(movie_id, user_id):
+    """
+    (position, admission token): position is 0 for admitted customers and None for not queued ones.
+    Everybody is admitted without a token while Redis is not available.
+    """
+    try:
+        client = get_client()
+        token = client.get(admission_key(movie_id, user_id))
+        if token is not None:
+            return 0, token.decode()
+        rank = client.zrank(queue_key(movie_id), user_id)
+    except redis.RedisError:
+        logger.warning('Waiting room of movie %s is not checked: Redis is not available', movie_id)
+        return 0, None
+    return (None if rank is None else rank + 1), None
+
+
+def join(movie_id, user_id):
+    """Queue the customer unless already queued or admitted, (position, admission token) like status()"""
+    position, token = status(movie_id, user_id)
+    if position is None:
+        try:
+            # nx keeps the place of customers who reload the page
+            pipe = get_client().pipeline()
+            pipe.zadd(queue_key(movie_id), {user_id: time.time()}, nx=True)
+            pipe.zrank(queue_key(movie_id), user_id)
+            position = pipe.execute()[-1] + 1
+        except redis.RedisError:
+            logger.warning('Waiting room of movie %s is not joined: Redis is not available', movie_id)
+            return 0, None
+    return position, token
+
+
+def admit(movie_id, count):
+    """Give admission tokens to `count` first customers of the queue, customers still waiting get notified"""
+    client = get_client()
+    admitted = client.zpopmin(queue_key(movie_id), count)
+    if not admitted:
+        return 0
+
+    pipe = client.pipeline()
+    for user_id, _ in admitted:
+        pipe.set(admission_key(movie_id, user_id.decode()), secrets.token_urlsafe(16),
+                 ex=MINUTES_WAITING_ROOM_ADMISSION_LIFE_TIME * 60)
+    pipe.execute()
+    async_to_sync(get_channel_layer().group_send)(group_name(movie_id), tracing.inject({'type': 'queue.update'}))
+    return len(admitted)
+
+
+def is_admitted(movie_id, user_id, token):
+    """Token check for booking, everybody is let in while Redis is not available"""
+    try:
+        stored = get_client().get(admission_key(movie_id, user_id))
+    except redis.RedisError:
+        logger.warning('Waiting room of movie %s is not checked: Redis is not available', movie_id)
+        return True
+    return bool(token) and stored is not None and secrets.compare_digest(stored.decode(), token)
@@ -3,12 +3,15 @@ import os
 from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
-import cinema.routing
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "chatsite.settings")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "moviehouse.settings")
+# sets Django up before the consumers import models
+django_asgi_app = get_asgi_application()
+
+import cinema.routing  # noqa: E402
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             cinema.routing.websocket_urlpatterns
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 import os
 from celery import Celery
 from celery.schedules import crontab
+from kombu import Queue
 
 from django.conf import settings
 
@@ -16,15 +17,73 @@ app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 app.conf.timezone = settings.TIME_ZONE
 app.conf.enable_utc = False   # !!!important for crontab
 
+# booking-critical tasks never wait behind batch work: every queue has workers of its own (see COMMANDS),
+# a worker consuming several queues drains them in this order. Unrouted tasks go to the default queue.
+BOOKING_QUEUE = 'booking'
+DEFAULT_QUEUE = 'default'
+BATCH_QUEUE = 'batch'
+app.conf.task_queues = [Queue(name, routing_key=name) for name in (BOOKING_QUEUE, DEFAULT_QUEUE, BATCH_QUEUE)]
+app.conf.task_default_queue = DEFAULT_QUEUE
+app.conf.task_default_routing_key = DEFAULT_QUEUE
+# priorities inside a queue, with the Redis broker 0 goes first
+app.conf.task_default_priority = 5
+app.conf.broker_transport_options = {'priority_steps': list(range(10)), 'queue_order_strategy': 'priority'}
+app.conf.task_routes = {
+    'staff.tasks.admit_waiting_rooms': {'queue': BOOKING_QUEUE, 'priority': 0},
+    'staff.tasks.sessions_checker': {'queue': BOOKING_QUEUE, 'priority': 3},
+    'staff.tasks.generate_settings_sessions': {'queue': BATCH_QUEUE, 'priority': 3},
+    'staff.tasks.extend_sessions_horizon': {'queue': BATCH_QUEUE},
+    'staff.tasks.materialize_sessions': {'queue': BATCH_QUEUE},
+    'staff.tasks.purge_deleted': {'queue': BATCH_QUEUE},
+    'staff.tasks.archive_past_sessions': {'queue': BATCH_QUEUE},
+    'staff.tasks.purge_idempotency_keys': {'queue': BATCH_QUEUE},
+    'staff.tasks.rollup_daily_sales': {'queue': BATCH_QUEUE},
+}
+# a worker reserves one task per process at a time, long batch tasks do not hold back others behind them
+app.conf.worker_prefetch_multiplier = 1
+
 app.conf.beat_schedule = {
     'check-sessions-periodically': {
         'task': 'staff.tasks.sessions_checker',
         'schedule': 15.0,
         'args': ()
     },
+    'extend-sessions-horizon-daily': {
+        'task': 'staff.tasks.extend_sessions_horizon',
+        'schedule': crontab(hour=3, minute=0),
+        'args': ()
+    },
+    'purge-idempotency-keys-hourly': {
+        'task': 'staff.tasks.purge_idempotency_keys',
+        'schedule': crontab(minute=30),
+        'args': ()
+    },
+    'admit-waiting-rooms-periodically': {
+        'task': 'staff.tasks.admit_waiting_rooms',
+        'schedule': float(settings.WAITING_ROOM_ADMIT_INTERVAL),
+        'args': ()
+    },
+    'rollup-daily-sales-periodically': {
+        'task': 'staff.tasks.rollup_daily_sales',
+        'schedule': crontab(minute='*/5'),
+        'args': ()
+    },
+    'purge-deleted-hourly': {
+        'task': 'staff.tasks.purge_deleted',
+        'schedule': crontab(minute=45),
+        'args': ()
+    },
+    'archive-past-sessions-daily': {
+        'task': 'staff.tasks.archive_past_sessions',
+        'schedule': crontab(hour=4, minute=0),
+        'args': ()
+    },
 }
 
 
 #COMMANDS
-#celery -A moviehouse worker --loglevel=INFO
+#celery -A moviehouse worker -Q booking -c 4 -n booking@%h --loglevel=INFO
+#celery -A moviehouse worker -Q default -c 2 -n default@%h --loglevel=INFO
+#celery -A moviehouse worker -Q batch -c 1 -n batch@%h --loglevel=INFO
+#one worker for development: celery -A moviehouse worker -Q booking,default,batch --loglevel=INFO
 #celery -A moviehouse beat -l info
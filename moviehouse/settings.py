@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -36,11 +37,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'cinema.middlewares.TracingMiddleware',
+    'cinema.middlewares.TrafficCaptureMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'cinema.middlewares.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'cinema.middlewares.CustomUserActivityCheckerMiddleware',
@@ -50,7 +54,7 @@ ROOT_URLCONF = 'moviehouse.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'cinema.tracing.TracedDjangoTemplates',
         'DIRS': ['templates', ],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -142,10 +146,79 @@ CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 MINUTES_TO_LOGOUT_IF_INACTIVE = 1
 MINUTES_DRF_TOKEN_LIFE_TIME = 1
+MINUTES_IDEMPOTENCY_KEY_LIFE_TIME = 60 * 24
+
+# rate limits: burst capacity and tokens refilled per second
+THROTTLE_REDIS_URL = 'redis://localhost:6379/1'
+TOKEN_BUCKETS = {
+    'order': {'capacity': 10, 'refill_rate': 10 / 60},
+    'login': {'capacity': 5, 'refill_rate': 5 / 60},
+    'register': {'capacity': 5, 'refill_rate': 5 / 3600},
+    'token': {'capacity': 5, 'refill_rate': 5 / 60},
+}
+
+# waiting room of high-demand movies: customers admitted per minute for each movie,
+# seconds between admission rounds and minutes an admission token stays valid
+WAITING_ROOM_REDIS_URL = 'redis://localhost:6379/1'
+WAITING_ROOM_ADMIT_PER_MINUTE = 120
+WAITING_ROOM_ADMIT_INTERVAL = 10
+MINUTES_WAITING_ROOM_ADMISSION_LIFE_TIME = 10
+
+# versions of genres, halls, movies and session settings behind ETags and cached API payloads,
+# minutes a cached payload lives
+VERSIONS_REDIS_URL = 'redis://localhost:6379/1'
+MINUTES_VERSIONED_PAYLOAD_LIFE_TIME = 60
+
+# request shapes are appended to this file when set, see cinema.middlewares.TrafficCaptureMiddleware;
+# only values of these parameters are kept, others are captured as empty strings
+TRAFFIC_CAPTURE_FILE = os.environ.get('TRAFFIC_CAPTURE_FILE')
+TRAFFIC_CAPTURE_PARAMS = {'page', 'limit', 'offset', 'fields', 'expand', 'format', 'date', 'hall', 'movie',
+                          'ids', 'by', 'session', 'sit', 'sits', 'count', 'genre'}
+
+# spans of requests, Celery tasks, channel layer messages, queries, cache calls and template rendering,
+# see cinema.tracing; the exporter is any class with export(span), the default one appends JSON lines to TRACING_FILE
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED') == '1'
+TRACING_EXPORTER = os.environ.get('TRACING_EXPORTER', 'cinema.tracing.JsonFileExporter')
+TRACING_FILE = os.environ.get('TRACING_FILE', os.path.join(tempfile.gettempdir(), 'moviehouse-traces.jsonl'))
+
+# superusers profile any request with ?profile=1 or the X-Profile header, see cinema.middlewares.ProfilingMiddleware;
+# this share of requests to the hottest routes is profiled for everybody, 0 turns sampling off
+PROFILING_PARAM = 'profile'
+PROFILING_HEADER = 'X-Profile'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_SAMPLED_ROUTES = {'index', 'schedule', 'movie', 'session', 'movie-list', 'movie-sessions',
+                            'moviesession-list', 'moviesession-todays', 'moviesession-availability'}
+# functions shown per report, reports kept
+PROFILING_STATS_LINES = 60
+PROFILING_MAX_REPORTS = 200
+
+# /api/batch/: GET requests per batch and how many of them run at the same time
+API_BATCH_MAX_REQUESTS = 20
+API_BATCH_WORKERS = 4
+
+# sessions per /api/sessions/availability/ request
+API_AVAILABILITY_MAX_SESSIONS = 500
+
+# sits of sessions older than this are dropped, tickets keep their numbers and prices
+DAYS_TO_ARCHIVE_PAST_SESSIONS = 7
+ARCHIVE_SESSIONS_BATCH_SIZE = 100
+# sessions of deleted halls, movies and session settings purged per transaction
+PURGE_SESSIONS_BATCH_SIZE = 100
+
+# sessions and sits are created this many days ahead, a daily task moves the horizon
+SESSIONS_HORIZON_DAYS = 21
+# clients asking beyond the horizon get sessions created by a background task up to this many days ahead
+SESSIONS_ON_DEMAND_MAX_DAYS = 366
+# settings with more sits than this to generate are generated by a background task in batches of days,
+# smaller schedules right when they are saved
+SESSIONS_GENERATE_INLINE_MAX_SITS = 5000
+SESSIONS_GENERATION_BATCH_DAYS = 3
 
 # Channels
 ASGI_APPLICATION = 'moviehouse.asgi.application'
 
+TEST_RUNNER = 'moviehouse.test_runner.TestRunner'
+
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
@@ -153,12 +226,24 @@ REST_FRAMEWORK = {
 
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
+        'api.API.renderers.MessagePackRenderer',
+    ],
+
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'api.API.parsers.MessagePackParser',
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.BasicAuthentication',
         'api.API.authetication.TokenWithLifeTimeAuthentication',
     ],
+
+    # reverse proxies in front of the app: client ips of rate limits come from REMOTE_ADDR with none,
+    # from X-Forwarded-For as the last proxy saw them otherwise, so clients can not send their own
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
 }
 
 
@@ -0,0 +1,16 @@
+from django.test.runner import DiscoverRunner
+
+from cinema import throttling, versions, waiting_room
+
+
+class TestRunner(DiscoverRunner):
+    """Keeps rate limit buckets, waiting rooms and versions of tests apart from the running site and from previous runs"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        throttling.KEY_PREFIX = 'test-throttle'
+        throttling.reset()
+        waiting_room.KEY_PREFIX = 'test-waiting-room'
+        waiting_room.reset()
+        versions.KEY_PREFIX = 'test-versions'
+        versions.reset()
@@ -1,5 +1,11 @@
-from celery import Celery
-from cinema.models import MovieSession
+from datetime import timedelta
+
+from cinema import waiting_room
+from cinema.models import DailySales, Hall, IdempotencyKey, Movie, MovieSession, MovieSessionSettings, Order, Sit
+from cinema.models import Ticket
+from cinema.models import sessions_horizon, sessions_on_demand_limit
+from django.db import connection, transaction
+from django.db.models import Q
 from django.utils import timezone
 
 import logging
@@ -7,11 +13,9 @@ from asgiref.sync import async_to_sync
 from celery import shared_task
 from channels.layers import get_channel_layer
 
-broker_url = 'redis://localhost'
-app = Celery('tasks', broker=broker_url, backend=broker_url)
-
-
-channel_layer = get_channel_layer()
+from moviehouse.settings import DAYS_TO_ARCHIVE_PAST_SESSIONS, ARCHIVE_SESSIONS_BATCH_SIZE, PURGE_SESSIONS_BATCH_SIZE
+from moviehouse.settings import MINUTES_IDEMPOTENCY_KEY_LIFE_TIME, SESSIONS_GENERATION_BATCH_DAYS
+from moviehouse.settings import WAITING_ROOM_ADMIT_PER_MINUTE, WAITING_ROOM_ADMIT_INTERVAL
 
 
 @shared_task
@@ -19,7 +23,123 @@ def sessions_checker():
     current_sessions = MovieSession.objects.filter(date=timezone.now().date(),
                                                    settings__time_start__lte=timezone.now(),
                                                    settings__time_end__gte=timezone.now())
-    async_to_sync(channel_layer.group_send)(
+    async_to_sync(get_channel_layer().group_send)(
         "jokes", {"type": "jokes.joke", "text": current_sessions}
     )
     return f'Sessions running: {current_sessions}'
+
+
+@shared_task
+def extend_sessions_horizon():
+    MovieSessionSettings.objects.materialize(sessions_horizon())
+    return f'Sessions generated until {sessions_horizon()}'
+
+
+@shared_task
+def materialize_sessions():
+    """Sessions requested beyond the horizon, see MovieSessionSettingsQuerySet.materialize_on_demand()"""
+    batches = 0
+    for settings_id in MovieSessionSettings.objects.requested().values_list('pk', flat=True):
+        batches += generate_batches(settings_id, lambda setting: min(setting.requested_until,
+                                                                     sessions_on_demand_limit()))
+    return f'Session batches generated: {batches}'
+
+
+@shared_task
+def generate_settings_sessions(settings_id):
+    """Sessions of a large schedule batch by batch of days, progress of committed batches shows up in the meantime"""
+    until = sessions_horizon()
+    try:
+        batches = generate_batches(settings_id, lambda setting: until)
+    finally:
+        MovieSessionSettings.objects.filter(pk=settings_id).update(generating=False)
+    return f'Session batches generated: {batches}'
+
+
+def generate_batches(settings_id, until):
+    """
+    Sessions of the settings up to until(settings) in batches of SESSIONS_GENERATION_BATCH_DAYS,
+    each batch under the lock of the settings read again. Number of generated batches.
+    """
+    batches = 0
+    while True:
+        with transaction.atomic():
+            setting = MovieSessionSettings.objects.select_for_update(of=('self',)).select_related('hall') \
+                .filter(pk=settings_id).first()
+            if setting is None:
+                break
+            first, last = setting.pending_days(until(setting))
+            if first > last:
+                break
+            setting.generate_sessions(min(last, first + timedelta(days=SESSIONS_GENERATION_BATCH_DAYS - 1)))
+        batches += 1
+    return batches
+
+
+@shared_task
+def archive_past_sessions():
+    """Drop sits of old sessions batch by batch, orders and tickets stay for history and reports"""
+    border = timezone.now().date() - timedelta(days=DAYS_TO_ARCHIVE_PAST_SESSIONS)
+    archived = 0
+    while True:
+        ids = list(MovieSession.objects.filter(date__lt=border, archived=False)
+                   .values_list('pk', flat=True)[:ARCHIVE_SESSIONS_BATCH_SIZE])
+        if not ids:
+            break
+        with transaction.atomic():
+            Ticket.objects.filter(sit__session__in=ids).update(sit=None)
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {Sit._meta.db_table} WHERE session_id = ANY(%s)', [ids])
+            MovieSession.objects.filter(pk__in=ids).update(archived=True)
+        archived += len(ids)
+    return f'Sessions archived: {archived}'
+
+
+@shared_task
+def purge_deleted():
+    """
+    Delete hidden halls, movies and session settings. Orders, tickets, sits and sessions go first,
+    batch by batch with plain SQL, so the ORM is left with rows which have nothing to collect.
+    """
+    purged = 0
+    for setting in MovieSessionSettings.all_objects.filter(deleted=True).values_list('pk', flat=True):
+        while True:
+            ids = list(MovieSession.all_objects.filter(settings=setting)
+                       .values_list('pk', flat=True)[:PURGE_SESSIONS_BATCH_SIZE])
+            if not ids:
+                break
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {Ticket._meta.db_table} WHERE order_id IN '
+                               f'(SELECT id FROM {Order._meta.db_table} WHERE session_id = ANY(%s))', [ids])
+                cursor.execute(f'DELETE FROM {Order._meta.db_table} WHERE session_id = ANY(%s)', [ids])
+                cursor.execute(f'DELETE FROM {Sit._meta.db_table} WHERE session_id = ANY(%s)', [ids])
+                cursor.execute(f'DELETE FROM {MovieSession._meta.db_table} WHERE id = ANY(%s)', [ids])
+            purged += len(ids)
+        MovieSessionSettings.all_objects.filter(pk=setting).delete()
+    Movie.all_objects.filter(deleted=True).delete()
+    Hall.all_objects.filter(deleted=True).delete()
+    return f'Sessions purged: {purged}'
+
+
+@shared_task
+def purge_idempotency_keys():
+    expired = timezone.now() - timedelta(minutes=MINUTES_IDEMPOTENCY_KEY_LIFE_TIME)
+    deleted, _ = IdempotencyKey.objects.filter(created__lt=expired).delete()
+    return f'Idempotency keys purged: {deleted}'
+
+
+@shared_task
+def rollup_daily_sales():
+    return f'Orders counted into daily sales: {DailySales.objects.rollup()}'
+
+
+@shared_task
+def admit_waiting_rooms():
+    """Let next customers of every waiting room in, WAITING_ROOM_ADMIT_PER_MINUTE per movie"""
+    movies = Movie.objects.filter(Q(waiting_room=True) |
+                                  Q(moviesessionsettings__waiting_room=True,
+                                    moviesessionsettings__date_end__gte=timezone.now().date()))\
+        .distinct().values_list('pk', flat=True)
+    count = max(1, round(WAITING_ROOM_ADMIT_PER_MINUTE * WAITING_ROOM_ADMIT_INTERVAL / 60))
+    admitted = sum(waiting_room.admit(movie, count) for movie in movies)
+    return f'Customers admitted: {admitted}'
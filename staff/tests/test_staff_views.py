@@ -4,10 +4,35 @@ from django.core.exceptions import PermissionDenied
 from django.test import TestCase, RequestFactory
 from django.urls import reverse
 
-from cinema.models import Hall, Order, MovieSessionSettings, Sit, Movie
+from cinema.models import Hall, Order, MovieSessionSettings, Sit, Movie, DailySales
 from cinema.views import IndexView
 from cinema.tests.factories import UserFactory, SuperUserFactory, HallFactory, MovieFactory
-from staff.views import HallListView, MovieListView, MovieSessionSettingsListView
+from staff.views import HallListView, MovieListView, MovieSessionSettingsListView, MainView
+
+
+class MainViewTest(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.superuser = SuperUserFactory()
+
+        hall = HallFactory()
+        hall.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+        DailySales.objects.create(date=date.today(), hall=hall, movie=self.movie, tickets=3, revenue=60, capacity=10)
+        DailySales.objects.create(date=date.today() - timedelta(days=1), hall=hall, movie=self.movie,
+                                  tickets=6, revenue=120, capacity=10)
+        DailySales.objects.create(date=date.today() - timedelta(days=40), hall=hall, movie=self.movie,
+                                  tickets=10, revenue=200, capacity=10)
+
+    def test_get_context_data_sales(self):
+        request = self.factory.get(reverse('main'))
+        request.user = self.superuser
+        response = MainView.as_view()(request)
+        context = response.context_data
+        self.assertEqual([(day['total_revenue'], day['bar'], day['occupancy']) for day in context['sales_days']],
+                         [(120, 100, 60), (60, 50, 30)])
+        self.assertEqual(context['sales_movies'][0]['total_tickets'], 9)
 
 
 class HallListViewTest(TestCase):
@@ -47,9 +72,9 @@ class HallListViewTest(TestCase):
 
         sits = Sit.objects.filter(session__settings=self.setting)
 
-        self.order1 = Order.objects.create(customer=self.user, sits=sits[0])
-        self.order2 = Order.objects.create(customer=self.user, sits=sits[1])
-        self.order3 = Order.objects.create(customer=self.user, sits=sits[2])
+        self.order1 = Order.objects.place(self.user, sits[0].session, [sits[0]])
+        self.order2 = Order.objects.place(self.user, sits[1].session, [sits[1]])
+        self.order3 = Order.objects.place(self.user, sits[2].session, [sits[2]])
 
 
     def test_availability_non_auth(self):
@@ -76,7 +101,7 @@ class HallListViewTest(TestCase):
         response = HallListView.as_view()(request)
         context = response.context_data
         ordered_halls = [hall for hall in Hall.objects.all() if
-                         Order.objects.filter(sits__session__settings__hall=hall)]
+                         Order.objects.filter(session__settings__hall=hall)]
         self.assertIn('ordered', context)
         self.assertEqual(context['ordered'], ordered_halls)
 
@@ -118,9 +143,9 @@ class MovieListViewTest(TestCase):
 
         sits = Sit.objects.filter(session__settings=self.setting)
 
-        self.order1 = Order.objects.create(customer=self.user, sits=sits[0])
-        self.order2 = Order.objects.create(customer=self.user, sits=sits[1])
-        self.order3 = Order.objects.create(customer=self.user, sits=sits[2])
+        self.order1 = Order.objects.place(self.user, sits[0].session, [sits[0]])
+        self.order2 = Order.objects.place(self.user, sits[1].session, [sits[1]])
+        self.order3 = Order.objects.place(self.user, sits[2].session, [sits[2]])
 
 
     def test_availability_non_auth(self):
@@ -147,7 +172,7 @@ class MovieListViewTest(TestCase):
         response = MovieListView.as_view()(request)
         context = response.context_data
         ordered_halls = [movie for movie in Movie.objects.all() if
-                         Order.objects.filter(sits__session__settings__movie=movie)]
+                         Order.objects.filter(session__settings__movie=movie)]
         self.assertIn('ordered', context)
         self.assertEqual(context['ordered'], ordered_halls)
 
@@ -189,9 +214,9 @@ class MovieSessionSettingsListViewTest(TestCase):
 
         sits = Sit.objects.filter(session__settings=self.setting)
 
-        self.order1 = Order.objects.create(customer=self.user, sits=sits[0])
-        self.order2 = Order.objects.create(customer=self.user, sits=sits[1])
-        self.order3 = Order.objects.create(customer=self.user, sits=sits[2])
+        self.order1 = Order.objects.place(self.user, sits[0].session, [sits[0]])
+        self.order2 = Order.objects.place(self.user, sits[1].session, [sits[1]])
+        self.order3 = Order.objects.place(self.user, sits[2].session, [sits[2]])
 
 
     def test_availability_non_auth(self):
@@ -218,7 +243,7 @@ class MovieSessionSettingsListViewTest(TestCase):
         response = MovieSessionSettingsListView.as_view()(request)
         context = response.context_data
         ordered_halls = [setting for setting in MovieSessionSettings.objects.all() if
-                         Order.objects.filter(sits__session__settings=setting)]
+                         Order.objects.filter(session__settings=setting)]
         self.assertIn('ordered', context)
         self.assertEqual(context['ordered'], ordered_halls)
 
@@ -0,0 +1,351 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, Client
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.API.serializers import HallSerializer
+from cinema.models import MovieSessionSettings, MovieSession, Order, Sit, Ticket, DailySales, sessions_horizon
+from cinema.models import Hall, Movie
+from cinema.tests.factories import UserFactory, SuperUserFactory, HallFactory, MovieFactory
+from moviehouse.celery import app, BATCH_QUEUE, BOOKING_QUEUE
+from moviehouse.settings import DAYS_TO_ARCHIVE_PAST_SESSIONS, SESSIONS_HORIZON_DAYS, SESSIONS_ON_DEMAND_MAX_DAYS
+from staff.tasks import archive_past_sessions, extend_sessions_horizon, generate_settings_sessions, purge_deleted
+from staff.forms import HallCreateForm
+from staff.tasks import materialize_sessions, rollup_daily_sales
+
+
+class ArchivePastSessionsTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.user.save()
+        hall = HallFactory(sits_rows=5, sits_cols=5)
+        hall.save()
+        movie = MovieFactory()
+        movie.save()
+
+        self.setting = MovieSessionSettings(hall=hall,
+                                            movie=movie,
+                                            price=20,
+                                            date_start=(datetime.now().date() - timedelta(days=10)),
+                                            date_end=(datetime.now().date() + timedelta(days=2)),
+                                            time_start='18:00',
+                                            time_end='21:00')
+        self.setting.save()
+
+        self.old_session = MovieSession.objects.get(settings=self.setting,
+                                                    date=datetime.now().date() - timedelta(days=10))
+        self.order = Order.objects.place(self.user, self.old_session,
+                                         Sit.objects.filter(session=self.old_session, number__in=[3, 4]))
+
+    def test_old_sits_dropped(self):
+        archive_past_sessions()
+        border = datetime.now().date() - timedelta(days=DAYS_TO_ARCHIVE_PAST_SESSIONS)
+        self.assertFalse(Sit.objects.filter(session__date__lt=border).exists())
+        self.assertTrue(MovieSession.objects.get(pk=self.old_session.pk).archived)
+
+    def test_recent_sits_kept(self):
+        archive_past_sessions()
+        session = MovieSession.objects.get(settings=self.setting, date=datetime.now().date())
+        self.assertFalse(session.archived)
+        self.assertEqual(Sit.objects.filter(session=session).count(), 25)
+
+    def test_history_kept(self):
+        archive_past_sessions()
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual(order.sits, [3, 4])
+        self.assertEqual(order.total, 40)
+        self.assertFalse(Ticket.objects.filter(sit__isnull=False).exists())
+        self.assertEqual(MovieSession.objects.get(pk=self.old_session.pk).sold, 2)
+
+
+class ExtendSessionsHorizonTest(TestCase):
+    def setUp(self):
+        hall = HallFactory(sits_rows=2, sits_cols=2)
+        hall.save()
+        movie = MovieFactory()
+        movie.save()
+
+        self.setting = MovieSessionSettings(hall=hall,
+                                            movie=movie,
+                                            price=20,
+                                            date_start=datetime.now().date(),
+                                            date_end=(datetime.now().date() + timedelta(days=SESSIONS_HORIZON_DAYS + 10)),
+                                            time_start='18:00',
+                                            time_end='21:00')
+        self.setting.save()
+
+    def test_generated_until_horizon(self):
+        sessions = MovieSession.objects.filter(settings=self.setting)
+        self.assertEqual(sessions.count(), SESSIONS_HORIZON_DAYS + 1)
+        self.assertEqual(sessions.last().date, sessions_horizon())
+        self.assertEqual(Sit.objects.filter(session__settings=self.setting).count(), 4 * (SESSIONS_HORIZON_DAYS + 1))
+
+    def test_extend_horizon(self):
+        with mock.patch('cinema.models.SESSIONS_HORIZON_DAYS', SESSIONS_HORIZON_DAYS + 3):
+            extend_sessions_horizon()
+        self.assertEqual(MovieSession.objects.filter(settings=self.setting).count(), SESSIONS_HORIZON_DAYS + 4)
+        self.assertEqual(MovieSessionSettings.objects.get(pk=self.setting.pk).generated_until,
+                         datetime.now().date() + timedelta(days=SESSIONS_HORIZON_DAYS + 3))
+
+    def test_extend_horizon_stops_at_date_end(self):
+        MovieSessionSettings.objects.materialize(datetime.now().date() + timedelta(days=100))
+        self.assertEqual(MovieSession.objects.filter(settings=self.setting).count(), SESSIONS_HORIZON_DAYS + 11)
+        extend_sessions_horizon()
+        self.assertEqual(MovieSession.objects.filter(settings=self.setting).count(), SESSIONS_HORIZON_DAYS + 11)
+
+    def test_small_request_generated_inline(self):
+        until = datetime.now().date() + timedelta(days=SESSIONS_HORIZON_DAYS + 5)
+        with mock.patch('cinema.models.current_app') as celery, self.captureOnCommitCallbacks(execute=True):
+            response = Client().get('/schedule/', {'date_end': until.isoformat()})
+        celery.send_task.assert_not_called()
+        self.assertEqual(MovieSession.objects.filter(settings=self.setting).count(), SESSIONS_HORIZON_DAYS + 6)
+        self.assertEqual(response.context['sessions_until'], until)
+        self.assertFalse(response.context['sessions_partial'])
+
+    def test_large_request_queued_once(self):
+        # generation of the settings is running, days asked for are requested all the same
+        MovieSessionSettings.objects.filter(pk=self.setting.pk).update(generating=True)
+        until = datetime.now().date() + timedelta(days=SESSIONS_HORIZON_DAYS + 5)
+        with mock.patch('cinema.models.SESSIONS_GENERATE_INLINE_MAX_SITS', 8), \
+                mock.patch('cinema.models.current_app') as celery, self.captureOnCommitCallbacks(execute=True):
+            response = Client().get('/schedule/', {'date_end': until.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        celery.send_task.assert_called_once_with('staff.tasks.materialize_sessions')
+        self.assertEqual(MovieSession.objects.filter(settings=self.setting).count(), SESSIONS_HORIZON_DAYS + 1)
+        self.assertEqual(response.context['sessions_until'], sessions_horizon())
+        self.assertTrue(response.context['sessions_partial'])
+        setting = MovieSessionSettings.objects.get(pk=self.setting.pk)
+        self.assertEqual(setting.requested_until, until)
+        self.assertTrue(setting.generating)
+
+        # requested already, the task is not sent again
+        with mock.patch('cinema.models.SESSIONS_GENERATE_INLINE_MAX_SITS', 8), \
+                mock.patch('cinema.models.current_app') as celery, self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().get('/api/sessions/', {'date_range': f',{until}'})
+        celery.send_task.assert_not_called()
+        self.assertEqual(response['Sessions-Until'], sessions_horizon().isoformat())
+        self.assertEqual(response['Sessions-Partial'], 'true')
+
+        with mock.patch('cinema.models.SESSIONS_GENERATE_INLINE_MAX_SITS', 8), \
+                mock.patch('cinema.models.current_app') as celery, self.captureOnCommitCallbacks(execute=True):
+            APIClient().get('/api/sessions/', {'date_range': f',{datetime.now().date() + timedelta(days=1000)}'})
+        celery.send_task.assert_called_once_with('staff.tasks.materialize_sessions')
+        self.assertEqual(MovieSessionSettings.objects.get(pk=self.setting.pk).requested_until,
+                         datetime.now().date() + timedelta(days=SESSIONS_ON_DEMAND_MAX_DAYS))
+
+    def test_materialize_sessions_batched(self):
+        MovieSessionSettings.objects.filter(pk=self.setting.pk).update(generating=True,
+                                                                       requested_until=self.setting.date_end)
+        with mock.patch('staff.tasks.SESSIONS_GENERATION_BATCH_DAYS', 3):
+            self.assertEqual(materialize_sessions(), 'Session batches generated: 4')
+        self.assertEqual(MovieSession.objects.filter(settings=self.setting).count(), SESSIONS_HORIZON_DAYS + 11)
+        # the flag belongs to generate_settings_sessions
+        self.assertTrue(MovieSessionSettings.objects.get(pk=self.setting.pk).generating)
+        self.assertEqual(materialize_sessions(), 'Session batches generated: 0')
+
+    def test_materialize_sessions_capped(self):
+        MovieSessionSettings.objects.filter(pk=self.setting.pk)\
+            .update(requested_until=datetime.now().date() + timedelta(days=100))
+        with mock.patch('cinema.models.SESSIONS_ON_DEMAND_MAX_DAYS', SESSIONS_HORIZON_DAYS + 2):
+            materialize_sessions()
+        self.assertEqual(MovieSession.objects.filter(settings=self.setting).count(), SESSIONS_HORIZON_DAYS + 3)
+        materialize_sessions()
+        self.assertEqual(MovieSession.objects.filter(settings=self.setting).count(), SESSIONS_HORIZON_DAYS + 11)
+
+    def test_nothing_queued_when_generated(self):
+        MovieSessionSettings.objects.materialize(self.setting.date_end)
+        with mock.patch('cinema.models.current_app') as celery, self.captureOnCommitCallbacks(execute=True):
+            Client().get('/schedule/', {'date_end': str(self.setting.date_end)})
+            response = APIClient().get('/api/sessions/facets/',
+                                       {'date_range': f',{datetime.now().date() + timedelta(days=1000)}'})
+        celery.send_task.assert_not_called()
+        # no settings run beyond the last day generated, the facets are complete
+        self.assertEqual(response['Sessions-Until'], str(datetime.now().date() + timedelta(days=1000)))
+        self.assertFalse(response.has_header('Sessions-Partial'))
+
+    def test_list_without_date_end_partial(self):
+        response = APIClient().get('/api/sessions/')
+        self.assertEqual(response['Sessions-Until'], sessions_horizon().isoformat())
+        self.assertEqual(response['Sessions-Partial'], 'true')
+
+
+class GenerateSettingsSessionsTest(TestCase):
+    def setUp(self):
+        hall = HallFactory(sits_rows=2, sits_cols=2)
+        hall.save()
+        movie = MovieFactory()
+        movie.save()
+        self.setting = MovieSessionSettings(hall=hall,
+                                            movie=movie,
+                                            price=20,
+                                            date_start=(datetime.now().date() + timedelta(days=1)),
+                                            date_end=(datetime.now().date() + timedelta(days=10)),
+                                            time_start='18:00',
+                                            time_end='21:00')
+        with mock.patch('cinema.models.SESSIONS_GENERATE_INLINE_MAX_SITS', 10), \
+                mock.patch('cinema.models.current_app') as self.app, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.setting.save()
+
+    def test_large_schedule_goes_to_background(self):
+        self.app.send_task.assert_called_once_with('staff.tasks.generate_settings_sessions', args=[self.setting.pk])
+        self.assertTrue(MovieSessionSettings.objects.get(pk=self.setting.pk).generating)
+        self.assertFalse(MovieSession.objects.filter(settings=self.setting).exists())
+
+    def test_batches(self):
+        self.assertEqual(generate_settings_sessions(self.setting.pk), 'Session batches generated: 4')
+        setting = MovieSessionSettings.objects.get(pk=self.setting.pk)
+        self.assertFalse(setting.generating)
+        self.assertEqual(setting.generation_progress, 1.0)
+        self.assertEqual(MovieSession.objects.filter(settings=self.setting).count(), 10)
+        self.assertEqual(Sit.objects.filter(session__settings=self.setting).count(), 40)
+
+    def test_running_task_not_sent_again(self):
+        self.setting.date_end = datetime.now().date() + timedelta(days=12)
+        with mock.patch('cinema.models.SESSIONS_GENERATE_INLINE_MAX_SITS', 10), \
+                mock.patch('cinema.models.current_app') as app, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.setting.save()
+        app.send_task.assert_not_called()
+        generate_settings_sessions(self.setting.pk)
+        self.assertEqual(MovieSession.objects.filter(settings=self.setting).count(), 12)
+
+
+class PurgeDeletedTest(TestCase):
+    def setUp(self):
+        self.hall = HallFactory(sits_rows=2, sits_cols=2)
+        self.hall.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+        self.setting = MovieSessionSettings(hall=self.hall,
+                                            movie=self.movie,
+                                            price=20,
+                                            date_start=datetime.now().date(),
+                                            date_end=(datetime.now().date() + timedelta(days=4)),
+                                            time_start='18:00',
+                                            time_end='21:00')
+        self.setting.save()
+        customer = UserFactory()
+        customer.save()
+        session = MovieSession.objects.filter(settings=self.setting).first()
+        self.order = Order.objects.place(customer, session, Sit.objects.filter(session=session, number__in=[1, 2]))
+
+    def test_deleted_movie_is_hidden(self):
+        admin = SuperUserFactory()
+        admin.save()
+        client = Client()
+        client.force_login(admin)
+        with mock.patch('cinema.models.current_app') as app, self.captureOnCommitCallbacks(execute=True):
+            client.post(f'/staff/main/movie/delete/{self.movie.pk}/')
+        app.send_task.assert_called_once_with('staff.tasks.purge_deleted')
+        self.assertFalse(Movie.objects.filter(pk=self.movie.pk).exists())
+        self.assertFalse(MovieSession.objects.filter(settings__movie=self.movie).exists())
+        self.assertTrue(MovieSession.all_objects.filter(settings__movie=self.movie).exists())
+        self.assertTrue(Hall.objects.filter(pk=self.hall.pk).exists())
+
+    def test_purge(self):
+        with mock.patch('cinema.models.current_app'):
+            self.hall.soft_delete()
+        with mock.patch('staff.tasks.PURGE_SESSIONS_BATCH_SIZE', 2):
+            self.assertEqual(purge_deleted(), 'Sessions purged: 5')
+        self.assertFalse(Hall.all_objects.filter(pk=self.hall.pk).exists())
+        self.assertFalse(MovieSessionSettings.all_objects.filter(pk=self.setting.pk).exists())
+        self.assertFalse(Sit.objects.filter(session__settings_id=self.setting.pk).exists())
+        self.assertFalse(Order.objects.filter(pk=self.order.pk).exists())
+        self.assertTrue(Movie.objects.filter(pk=self.movie.pk).exists())
+
+    def test_deleted_names_free_before_purge(self):
+        with mock.patch('cinema.models.current_app'):
+            self.hall.soft_delete()
+        data = {'name': self.hall.name, 'sits_rows': 3, 'sits_cols': 3}
+        form = HallCreateForm(data)
+        self.assertTrue(form.is_valid())
+        form.save()
+        form = HallCreateForm(data)
+        self.assertFalse(form.is_valid())
+        self.assertIn('name', form.errors)
+
+        serializer = HallSerializer(data=data)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('name', serializer.errors)
+        self.assertEqual(Hall.all_objects.filter(name=self.hall.name).count(), 2)
+
+
+class RollupDailySalesTest(TestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.user.save()
+        self.hall = HallFactory(sits_rows=2, sits_cols=5)
+        self.hall.save()
+        self.movie = MovieFactory()
+        self.movie.save()
+
+        setting = MovieSessionSettings(hall=self.hall,
+                                       movie=self.movie,
+                                       price=20,
+                                       date_start=datetime.now().date(),
+                                       date_end=(datetime.now().date() + timedelta(days=2)),
+                                       time_start='18:00',
+                                       time_end='21:00')
+        setting.save()
+        self.session = MovieSession.objects.get(settings=setting, date=datetime.now().date() + timedelta(days=1))
+
+    def place(self, numbers):
+        order = Order.objects.place(self.user, self.session, Sit.objects.filter(session=self.session,
+                                                                                number__in=numbers))
+        # orders of the last minute wait for the next run
+        Order.objects.filter(pk=order.pk).update(datetime=timezone.now() - timedelta(minutes=2))
+        return order
+
+    def test_rollup(self):
+        self.place([1, 2])
+        self.place([3])
+        self.assertEqual(rollup_daily_sales(), 'Orders counted into daily sales: 2')
+        sales = DailySales.objects.get()
+        self.assertEqual((sales.date, sales.hall, sales.movie), (self.session.date, self.hall, self.movie))
+        self.assertEqual((sales.tickets, sales.revenue, sales.capacity), (3, 60, 10))
+        self.assertEqual(sales.occupancy, 30)
+
+    def test_rollup_incremental(self):
+        self.place([1, 2])
+        rollup_daily_sales()
+        self.assertEqual(rollup_daily_sales(), 'Orders counted into daily sales: 0')
+        self.place([5])
+        rollup_daily_sales()
+        self.assertEqual(DailySales.objects.get().tickets, 3)
+
+    def test_fresh_orders_wait(self):
+        Order.objects.place(self.user, self.session, Sit.objects.filter(session=self.session, number=1))
+        self.assertEqual(rollup_daily_sales(), 'Orders counted into daily sales: 0')
+        self.assertFalse(DailySales.objects.exists())
+
+    def test_fresh_order_with_lower_id_not_skipped(self):
+        fresh = Order.objects.place(self.user, self.session, Sit.objects.filter(session=self.session, number=1))
+        self.place([2])
+        self.assertEqual(rollup_daily_sales(), 'Orders counted into daily sales: 0')
+        Order.objects.filter(pk=fresh.pk).update(datetime=timezone.now() - timedelta(minutes=2))
+        self.assertEqual(rollup_daily_sales(), 'Orders counted into daily sales: 2')
+        self.assertEqual(DailySales.objects.get().tickets, 2)
+
+
+class TaskRoutingTest(SimpleTestCase):
+    def test_every_task_routed(self):
+        tasks = [name for name in app.tasks if name.startswith('staff.tasks.')]
+        self.assertTrue(tasks)
+        self.assertEqual(sorted(tasks), sorted(app.conf.task_routes))
+
+    def test_batch_flood_does_not_delay_booking(self):
+        with app.connection_for_write('memory://') as connection:
+            for _ in range(500):
+                app.send_task('staff.tasks.purge_deleted', connection=connection)
+            app.send_task('staff.tasks.admit_waiting_rooms', connection=connection)
+
+            # a booking worker takes the task at once, the batch backlog waits for batch workers
+            channel = connection.default_channel
+            message = channel.basic_get(BOOKING_QUEUE)
+            self.assertEqual(message.headers['task'], 'staff.tasks.admit_waiting_rooms')
+            self.assertEqual(message.properties['priority'], 0)
+            self.assertIsNone(channel.basic_get(BOOKING_QUEUE))
+            self.assertEqual(channel.queue_declare(BATCH_QUEUE, passive=True).message_count, 500)
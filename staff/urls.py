@@ -5,6 +5,7 @@ from staff.views import MovieSessionSettingsUpdateView, MovieSessionSettingsDele
 from staff.views import MovieSessionSettingsListView, MovieSessionSettingsCreateView
 from staff.views import MovieListView, MovieCreateView, MovieDeleteView, MovieUpdateView
 from staff.views import HallListView, HallCreateView, HallDeleteView, HallUpdateView
+from staff.views import ProfileListView, ProfileDetailView
 
 urlpatterns = [
     path('main/', MainView.as_view(), name='main'),
@@ -30,4 +31,7 @@ urlpatterns = [
     path('main/session-settings/edit/<int:pk>/', MovieSessionSettingsUpdateView.as_view(), name='settings-edit'),
 
     path('main/sessions-list/', MovieSessionsStaffListView.as_view(), name='sessions-list'),
+
+    path('main/profiles/', ProfileListView.as_view(), name='profiles'),
+    path('main/profiles/<int:pk>/', ProfileDetailView.as_view(), name='profile'),
 ]
\ No newline at end of file
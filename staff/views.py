@@ -1,8 +1,13 @@
+from datetime import timedelta
+
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import HttpResponseRedirect
 from django.urls import reverse_lazy
-from django.views.generic import TemplateView, CreateView, ListView, DeleteView, UpdateView
+from django.utils import timezone
+from django.views.generic import TemplateView, CreateView, ListView, DeleteView, UpdateView, DetailView
 
-from cinema.models import Genre, Hall, Movie, MovieSessionSettings, MovieSession, Order
+from cinema.models import Genre, Hall, Movie, MovieSessionSettings, MovieSession, Order, DailySales, occupancy
+from cinema.models import RequestProfile
 from cinema.views import MovieSessionsListView
 from staff.forms import GenreCreateForm, HallCreateForm, HallUpdateForm, MovieUpdateForm, \
     SettingsCreateForm
@@ -15,9 +20,35 @@ class SuperUserRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
         return self.request.user.is_superuser
 
 
+class SoftDeleteViewMixin:
+    """The object is hidden at once, the purge_deleted task deletes it with everything depending on it"""
+
+    def form_valid(self, form):
+        self.object.soft_delete()
+        return HttpResponseRedirect(self.get_success_url())
+
+
 class MainView(SuperUserRequiredMixin, TemplateView):
     template_name = 'admin.html'
     extra_context = {'title': 'Main | Admin Popcorn cinema'}
+    sales_days = 30
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        today = timezone.now().date()
+        sales = DailySales.objects.filter(date__gt=today - timedelta(days=self.sales_days), date__lte=today)
+
+        days = list(sales.totals('date'))
+        top = max((day['total_revenue'] for day in days), default=0)
+        for day in days:
+            day['occupancy'] = occupancy(day['total_tickets'], day['total_capacity'])
+            day['bar'] = round(100 * day['total_revenue'] / top) if top else 0
+        context['sales_days'] = days
+        context['sales_movies'] = sorted(sales.totals('movie__title'), key=lambda row: row['total_revenue'],
+                                         reverse=True)
+        for movie in context['sales_movies']:
+            movie['occupancy'] = occupancy(movie['total_tickets'], movie['total_capacity'])
+        return context
 
 
 
@@ -55,7 +86,7 @@ class HallListView(SuperUserRequiredMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super(HallListView, self).get_context_data(**kwargs)
-        context['ordered'] = [hall for hall in Hall.objects.all() if Order.objects.filter(sits__session__settings__hall=hall)]
+        context['ordered'] = list(Hall.objects.filter(pk__in=Order.objects.values('session__settings__hall')))
         return context
 
 
@@ -68,7 +99,7 @@ class HallCreateView(SuperUserRequiredMixin, CreateView):
 
 
 
-class HallDeleteView(SuperUserRequiredMixin, DeleteView):
+class HallDeleteView(SuperUserRequiredMixin, SoftDeleteViewMixin, DeleteView):
     model = Hall
     success_url = reverse_lazy('hall')
 
@@ -87,10 +118,12 @@ class MovieListView(SuperUserRequiredMixin, ListView):
     paginate_by = 10
     extra_context = {'title': 'Movies | Admin Popcorn cinema'}
 
+    def get_queryset(self):
+        return super().get_queryset().prefetch_related('genres')
+
     def get_context_data(self, **kwargs):
         context = super(MovieListView, self).get_context_data(**kwargs)
-        context['ordered'] = [movie for movie in Movie.objects.all() if
-                              Order.objects.filter(sits__session__settings__movie=movie)]
+        context['ordered'] = list(Movie.objects.filter(pk__in=Order.objects.values('session__settings__movie')))
         return context
 
 
@@ -102,7 +135,7 @@ class MovieCreateView(SuperUserRequiredMixin, CreateView):
     extra_context = {'title': 'Movie create | Admin Popcorn cinema'}
 
 
-class MovieDeleteView(SuperUserRequiredMixin, DeleteView):
+class MovieDeleteView(SuperUserRequiredMixin, SoftDeleteViewMixin, DeleteView):
     model = Movie
     success_url = reverse_lazy('allmovies')
 
@@ -121,10 +154,12 @@ class MovieSessionSettingsListView(SuperUserRequiredMixin, ListView):
     paginate_by = 10
     extra_context = {'title': 'Session settings | Admin Popcorn cinema'}
 
+    def get_queryset(self):
+        return super().get_queryset().select_related('hall', 'movie')
+
     def get_context_data(self, **kwargs):
         context = super(MovieSessionSettingsListView, self).get_context_data(**kwargs)
-        context['ordered'] = [setting for setting in MovieSessionSettings.objects.all() if
-                              Order.objects.filter(sits__session__settings=setting)]
+        context['ordered'] = list(MovieSessionSettings.objects.filter(pk__in=Order.objects.values('session__settings')))
         return context
 
 
@@ -136,7 +171,7 @@ class MovieSessionSettingsCreateView(SuperUserRequiredMixin, CreateView):
     extra_context = {'title': 'Setting create | Admin Popcorn cinema'}
 
 
-class MovieSessionSettingsDeleteView(SuperUserRequiredMixin, DeleteView):
+class MovieSessionSettingsDeleteView(SuperUserRequiredMixin, SoftDeleteViewMixin, DeleteView):
     model = MovieSessionSettings
     success_url = reverse_lazy('settings-list')
 
@@ -152,3 +187,22 @@ class MovieSessionSettingsUpdateView(LoginRequiredMixin, UpdateView):
 class MovieSessionsStaffListView(SuperUserRequiredMixin, MovieSessionsListView):
     template_name = 'staff-movie-session-list.html'
     extra_context = {'title': 'Movies | Admin Popcorn cinema'}
+
+
+class ProfileListView(SuperUserRequiredMixin, ListView):
+    model = RequestProfile
+    template_name = 'staff-profile-list.html'
+    paginate_by = 30
+    extra_context = {'title': 'Profiles | Admin Popcorn cinema'}
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('user').defer('stats', 'queries')
+
+
+class ProfileDetailView(SuperUserRequiredMixin, DetailView):
+    model = RequestProfile
+    template_name = 'staff-profile.html'
+    extra_context = {'title': 'Profile | Admin Popcorn cinema'}
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('user')